@@ -0,0 +1,145 @@
+"""
+Benchmark da extração do cabeçalho da nota fiscal.
+
+Compara a extração antiga (várias buscas completas na árvore: find_all com
+regex em 'string=', find_parent/find_next e get_text em todo span/td/div/
+strong/p para achar a chave) com extract_header_fields (uma única passagem).
+
+Uso (dentro do diretório invoice_api):
+    python bench_header_extraction.py
+    python bench_header_extraction.py --sizes 50 300 1000 --repeat 20
+"""
+import argparse
+import re
+import time
+
+from bs4 import BeautifulSoup
+
+from main import extract_header_fields
+
+
+def build_page(item_count: int) -> str:
+    """Gera uma página no formato do portal da SEFAZ MG com 'item_count' itens."""
+    rows = []
+    for i in range(1, item_count + 1):
+        rows.append(
+            f'<tr id="Item + {i}">'
+            f'<td valign="top"><span class="txtTit">PRODUTO {i} EMBALAGEM {i % 7}KG</span>'
+            f'<span class="RCod"> (Código: {100000 + i})</span></td>'
+            f'<td><span class="Rqtd"><strong>Qtde total de ítens: </strong>{i % 5 + 1},{i % 1000:04d}</span></td>'
+            f'<td><span class="RUN"><strong>UN: </strong>KG</span></td>'
+            f'<td align="right"><span class="valor">Vl. Total R$: {i},{i % 100:02d}</span></td>'
+            f'</tr>'
+        )
+    return (
+        '<html><body><div class="container">'
+        '<table class="table"><thead><tr><th class="text-center text-uppercase">'
+        '<h4><b>SUPERMERCADO BENCHMARK LTDA</b></h4></th></tr></thead></table>'
+        f'<table class="table table-striped"><tbody id="myTable">{"".join(rows)}</tbody></table>'
+        '<div class="row"><div class="col-lg-10"><strong>Qtde total de ítens:</strong></div>'
+        f'<div class="col-lg-2"><strong>{item_count}</strong></div></div>'
+        '<div id="linhaTotal"><label>Valor total R$:</label> <span class="totalNumb">1.234,56</span></div>'
+        '<table class="table"><tr><td>Número: 439835 Série: 4</td>'
+        '<td>Data de Emissão: 20/05/2025 18:22:31</td></tr></table>'
+        '<div><span>Chave de acesso</span> '
+        '<span>3125-0502-5820-1700-0120-6500-4000-4398-3510-0078-1850</span></div>'
+        '</div></body></html>'
+    )
+
+
+def extract_header_fields_multipass(soup: BeautifulSoup) -> dict:
+    """Extração anterior do cabeçalho (referência), sem os prints de debug."""
+    market_name = None
+    market_name_tag = soup.find('th', class_='text-center text-uppercase')
+    if market_name_tag and market_name_tag.find('h4') and market_name_tag.find('h4').find('b'):
+        market_name = market_name_tag.find('h4').find('b').get_text(strip=True)
+
+    invoice_date_str = None
+    date_pattern = re.compile(r'\d{2}/\d{2}/\d{4}\s+\d{2}:\d{2}:\d{2}')
+    for parent in soup.find_all(['div', 'td', 'span'], string=re.compile("Data de Emissão", re.IGNORECASE)):
+        container = parent.find_parent(['div', 'tr']) or parent
+        match = date_pattern.search(container.get_text(" ", strip=True))
+        if match:
+            invoice_date_str = match.group(0)
+            break
+    if not invoice_date_str:
+        all_text_nodes = soup.find_all(string=date_pattern)
+        if all_text_nodes:
+            invoice_date_str = date_pattern.search(all_text_nodes[0]).group(0)
+        else:
+            for td in soup.find_all('td'):
+                match = date_pattern.search(td.get_text(strip=True))
+                if match:
+                    invoice_date_str = match.group(0)
+                    break
+
+    total_invoice_str = None
+    total_label = soup.find(['strong', 'label', 'span', 'div'], string=re.compile(r'Valor\s+total\s+R?\$\s*:?', re.IGNORECASE))
+    if total_label:
+        for container in [total_label.find_next(['div', 'span', 'td', 'strong']), total_label.find_parent(['div', 'tr'])]:
+            if container:
+                strong_value = container.find('strong')
+                target_text = strong_value.get_text(strip=True) if strong_value else container.get_text(strip=True)
+                match = re.search(r'([\d.,]+)', target_text)
+                if match:
+                    total_invoice_str = match.group(1)
+                    break
+
+    quantity_total_items_str = None
+    value_div = soup.find('div', class_=re.compile(r'\bcol-lg-2\b'))
+    if value_div:
+        value_strong = value_div.find('strong')
+        raw_text = (value_strong or value_div).get_text(strip=True)
+        match = re.search(r'^(\d+)$', raw_text)
+        if match:
+            quantity_total_items_str = match.group(1)
+
+    access_key = None
+    for element in soup.find_all(['span', 'td', 'div', 'strong', 'p']):
+        original_text = element.get_text(" ", strip=True)
+        if (re.search(r'\d', original_text) and re.search(r'[-/\.]', original_text) and len(original_text) >= 44):
+            if len(re.sub(r'\D', '', original_text)) == 44:
+                key_match = re.search(r'(\d[\d./-]{40,})', original_text)
+                if key_match and len(re.sub(r'\D', '', key_match.group(1).strip())) == 44:
+                    access_key = key_match.group(1).strip()
+                    break
+
+    return {
+        "market_name": market_name,
+        "invoice_date": invoice_date_str,
+        "total_invoice": total_invoice_str,
+        "quantity_total_items": quantity_total_items_str,
+        "access_key": access_key,
+    }
+
+
+def time_per_call(func, soup: BeautifulSoup, repeat: int) -> float:
+    """Menor tempo (em ms) entre 'repeat' execuções de func(soup)."""
+    best = float('inf')
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func(soup)
+        best = min(best, time.perf_counter() - start)
+    return best * 1000
+
+
+def main():
+    arg_parser = argparse.ArgumentParser(description="Benchmark da extração do cabeçalho da nota fiscal.")
+    arg_parser.add_argument("--sizes", type=int, nargs="+", default=[10, 50, 300, 1000], help="Quantidades de itens por página")
+    arg_parser.add_argument("--repeat", type=int, default=10, help="Execuções por medição (usa o menor tempo)")
+    args = arg_parser.parse_args()
+
+    print(f"{'itens':>7} {'várias passagens (ms)':>22} {'passagem única (ms)':>20} {'ganho':>7}")
+    for size in args.sizes:
+        soup = BeautifulSoup(build_page(size), 'lxml')
+        old_fields = extract_header_fields_multipass(soup)
+        new_fields = extract_header_fields(soup)
+        if old_fields != new_fields:
+            raise SystemExit(f"Resultados diferentes para {size} itens:\n  antes: {old_fields}\n  agora: {new_fields}")
+        old_ms = time_per_call(extract_header_fields_multipass, soup, args.repeat)
+        new_ms = time_per_call(extract_header_fields, soup, args.repeat)
+        print(f"{size:>7} {old_ms:>22.2f} {new_ms:>20.2f} {old_ms / new_ms:>6.1f}x")
+
+
+if __name__ == "__main__":
+    main()
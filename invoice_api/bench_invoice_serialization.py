@@ -0,0 +1,110 @@
+"""
+Benchmark da construção e serialização do Invoice.
+
+Compara, para notas com N itens:
+- construção validada (Invoice/ItemInvoice com os BeforeValidators) x
+  construção confiável (conversão pelas mesmas funções + model_construct,
+  como em parse_invoice_html);
+- serialização pelo caminho padrão do FastAPI (jsonable_encoder + json) x
+  FastJSONResponse.
+Antes de medir, confere que os dois caminhos geram exatamente o mesmo JSON.
+
+Uso (dentro do diretório invoice_api):
+    python bench_invoice_serialization.py
+    python bench_invoice_serialization.py --sizes 50 200 1000 --repeat 20
+"""
+import argparse
+import json
+import time
+
+from fastapi.encoders import jsonable_encoder
+
+from main import (FastJSONResponse, Invoice, ItemInvoice, parse_datetime_flexible,
+                  parse_decimal_universal, safe_strip)
+
+
+def build_raw_invoice(item_count: int) -> dict:
+    """Textos como saem do extrator para uma nota com 'item_count' itens."""
+    return {
+        "market_name": " SUPERMERCADO BENCHMARK LTDA ",
+        "invoice_date": "20/05/2025 18:22:31",
+        "total_invoice": "12.345,67",
+        "quantity_total_items": item_count,
+        "access_key": "3125-0502-5820-1700-0120-6500-4000-4398-3510-0078-1850",
+        "items": [
+            {"code": str(100000 + i), "description": f"PRODUTO {i} EMBALAGEM {i % 7}KG",
+             "quantity": f"{i % 5 + 1},{i % 1000:04d}", "unit": "KG", "value": f"{i},{i % 100:02d}"}
+            for i in range(1, item_count + 1)
+        ],
+    }
+
+
+def build_validated(raw: dict) -> Invoice:
+    return Invoice(**{**raw, "items": [ItemInvoice(**item) for item in raw["items"]]})
+
+
+def build_trusted(raw: dict) -> Invoice:
+    items = [
+        ItemInvoice.model_construct(
+            code=safe_strip(item["code"]),
+            description=safe_strip(item["description"]),
+            quantity=parse_decimal_universal(item["quantity"]),
+            unit=safe_strip(item["unit"]),
+            value=parse_decimal_universal(item["value"]),
+        )
+        for item in raw["items"]
+    ]
+    return Invoice.model_construct(
+        market_name=safe_strip(raw["market_name"]),
+        invoice_date=parse_datetime_flexible(raw["invoice_date"]),
+        total_invoice=parse_decimal_universal(raw["total_invoice"]),
+        quantity_total_items=raw["quantity_total_items"],
+        access_key=safe_strip(raw["access_key"]),
+        items=items,
+    )
+
+
+def serialize_default(invoice: Invoice) -> bytes:
+    """Equivalente ao caminho do FastAPI com response_model (jsonable_encoder + JSONResponse)."""
+    return json.dumps(jsonable_encoder(invoice), ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+
+
+def serialize_fast(invoice: Invoice) -> bytes:
+    return FastJSONResponse(invoice).body
+
+
+def best_ms(func, arg, repeat: int) -> float:
+    """Menor tempo (em ms) entre 'repeat' execuções de func(arg)."""
+    best = float('inf')
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func(arg)
+        best = min(best, time.perf_counter() - start)
+    return best * 1000
+
+
+def main():
+    arg_parser = argparse.ArgumentParser(description="Benchmark da construção e serialização do Invoice.")
+    arg_parser.add_argument("--sizes", type=int, nargs="+", default=[10, 200, 500, 2000], help="Itens por nota")
+    arg_parser.add_argument("--repeat", type=int, default=10, help="Execuções por medição (usa o menor tempo)")
+    args = arg_parser.parse_args()
+
+    print(f"{'itens':>6} {'validada (ms)':>14} {'confiável (ms)':>15} {'ganho':>6}"
+          f" {'jsonable_encoder (ms)':>22} {'FastJSONResponse (ms)':>22} {'ganho':>6}")
+    for size in args.sizes:
+        raw = build_raw_invoice(size)
+        validated = build_validated(raw)
+        trusted = build_trusted(raw)
+        if validated != trusted or serialize_default(validated) != serialize_fast(trusted):
+            raise SystemExit(f"JSON diferente entre os caminhos para {size} itens.")
+
+        validated_ms = best_ms(build_validated, raw, args.repeat)
+        trusted_ms = best_ms(build_trusted, raw, args.repeat)
+        default_ms = best_ms(serialize_default, validated, args.repeat)
+        fast_ms = best_ms(serialize_fast, validated, args.repeat)
+        print(f"{size:>6} {validated_ms:>14.2f} {trusted_ms:>15.2f} {validated_ms / trusted_ms:>5.1f}x"
+              f" {default_ms:>22.2f} {fast_ms:>22.2f} {default_ms / fast_ms:>5.1f}x")
+
+
+if __name__ == "__main__":
+    main()
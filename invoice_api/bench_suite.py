@@ -0,0 +1,222 @@
+"""
+Suíte de benchmarks do scraper, sem acessar o portal da SEFAZ.
+
+Usa páginas sintéticas (sefaz_page_generator.py) de 5 a 2000 itens e mede,
+para cada tamanho, o tempo (mediana) e o pico de memória (tracemalloc) de:
+- items_bs4: extract_items_from_html (BeautifulSoup, sem contar o parse do HTML);
+- items_lxml: extract_items_with_lxml (inclui o parse do HTML);
+- pipeline: GET / completo (busca HTTP, arquivo desligado, extração e
+  resposta JSON) contra um servidor HTTP local que imita o portal.
+
+Cada execução é acrescentada (uma linha JSON, com o commit do git) ao arquivo
+de resultados e comparada com a execução anterior: variações acima do limite
+aparecem como REGRESSÃO. Versione o arquivo de resultados para acompanhar
+a evolução entre commits (rode sempre na mesma máquina).
+
+Uso (dentro do diretório invoice_api):
+    python bench_suite.py
+    python bench_suite.py --sizes 5 50 300 2000 --repeat 10
+    python bench_suite.py --mongo                  # pipeline gravando no MONGO_URI
+    python bench_suite.py --fail-on-regression     # código de saída 1 se houver regressão
+"""
+import argparse
+import asyncio
+import json
+import logging
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import threading
+import time
+import tracemalloc
+from datetime import datetime, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from urllib.parse import parse_qs, urlsplit
+
+os.environ["HTML_ARCHIVE_DIR"] = "" # Não grava as páginas sintéticas no arquivo de HTML
+os.environ.setdefault("INVOICE_CACHE_SIZE", "0") # Toda requisição passa pela extração
+os.environ.setdefault("SEFAZ_RATE_LIMIT", "0") # O token bucket limitaria a vazão medida contra o portal local
+
+import httpx
+from bs4 import BeautifulSoup
+
+import main as invoice_api
+from sefaz_page_generator import generate_invoice_page
+
+DEFAULT_RESULTS_FILE = Path(__file__).parent / "bench_results" / "results.jsonl"
+
+
+class StubPortal:
+    """Servidor HTTP local que responde como o qrcode.xhtml do portal (página por chave)."""
+
+    def __init__(self):
+        self.pages = {}
+        portal = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                query = parse_qs(urlsplit(self.path).query)
+                key = query.get("p", [""])[0].split("|")[0]
+                body = portal.pages.get(key)
+                if body is None:
+                    self.send_error(404)
+                    return
+                self.send_response(200)
+                self.send_header("Content-Type", "text/html; charset=UTF-8")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass # Sem log por requisição
+
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self.url = f"http://127.0.0.1:{self.server.server_address[1]}/portalnfce/sistema/qrcode.xhtml"
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+
+    def add(self, page):
+        self.pages[page.qr_code_parameter.split("|")[0]] = page.html.encode("utf-8")
+
+    def close(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+def measure(func, repeat: int) -> dict:
+    """Mediana/mínimo do tempo (ms) em 'repeat' execuções e pico de memória (KiB) de uma execução extra."""
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        times.append((time.perf_counter() - start) * 1000)
+    tracemalloc.start()
+    func()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return {"median_ms": round(statistics.median(times), 3), "min_ms": round(min(times), 3),
+            "peak_kib": round(peak / 1024, 1)}
+
+
+async def measure_pipeline(portal: StubPortal, size: int, repeat: int, seed: int) -> dict:
+    """Tempo do GET / completo; cada execução usa uma nota (chave) diferente."""
+    pages = [generate_invoice_page(size, seed=seed + i) for i in range(repeat + 1)]
+    for page in pages:
+        portal.add(page)
+    transport = httpx.ASGITransport(app=invoice_api.app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+        async def request(page):
+            response = await client.get("/", params={"qr_code_parameter": page.qr_code_parameter})
+            if response.status_code != 200 or len(response.json()["Items"]) != size:
+                raise SystemExit(f"Pipeline falhou para {size} itens: HTTP {response.status_code}")
+
+        times = []
+        for page in pages[:-1]:
+            start = time.perf_counter()
+            await request(page)
+            times.append((time.perf_counter() - start) * 1000)
+        tracemalloc.start()
+        await request(pages[-1])
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+    return {"median_ms": round(statistics.median(times), 3), "min_ms": round(min(times), 3),
+            "peak_kib": round(peak / 1024, 1)}
+
+
+async def run_suite(sizes, repeat: int, seed: int, use_mongo: bool) -> dict:
+    results = {}
+    for size in sizes:
+        page = generate_invoice_page(size, seed=seed)
+        soup = BeautifulSoup(page.html, 'lxml')
+        results[f"items_bs4/{size}"] = measure(lambda: invoice_api.extract_items_from_html(soup), repeat)
+        if invoice_api.lxml_etree is not None:
+            results[f"items_lxml/{size}"] = measure(lambda: invoice_api.extract_items_with_lxml(page.html), repeat)
+
+    portal = StubPortal()
+    invoice_api.SEFAZ_QRCODE_URL = portal.url
+    try:
+        if use_mongo:
+            async with invoice_api.lifespan(invoice_api.app):
+                if not await invoice_api.mongo_connector.wait_connected(30):
+                    raise SystemExit("MongoDB indisponível (MONGO_URI).")
+                for size in sizes:
+                    results[f"pipeline/{size}"] = await measure_pipeline(portal, size, repeat, seed * 100_000 + size)
+        else:
+            for size in sizes:
+                results[f"pipeline/{size}"] = await measure_pipeline(portal, size, repeat, seed * 100_000 + size)
+            await invoice_api.sefaz_http_client.aclose()
+    finally:
+        portal.close()
+    return results
+
+
+def git_commit() -> str:
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                              cwd=Path(__file__).parent, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "desconhecido"
+
+
+def load_previous(results_file: Path):
+    if not results_file.exists():
+        return None
+    lines = [line for line in results_file.read_text(encoding="utf-8").splitlines() if line.strip()]
+    return json.loads(lines[-1]) if lines else None
+
+
+def main():
+    arg_parser = argparse.ArgumentParser(description="Benchmarks do scraper com páginas sintéticas e portal local.")
+    arg_parser.add_argument("--sizes", type=int, nargs="+", default=[5, 50, 300, 1000, 2000], help="Itens por página")
+    arg_parser.add_argument("--repeat", type=int, default=7, help="Execuções por medição (usa a mediana)")
+    arg_parser.add_argument("--seed", type=int, default=1, help="Semente das páginas sintéticas")
+    arg_parser.add_argument("--mongo", action="store_true", help="Pipeline com gravação no MongoDB (MONGO_URI)")
+    arg_parser.add_argument("--results-file", type=Path, default=DEFAULT_RESULTS_FILE, help="Histórico (JSON lines)")
+    arg_parser.add_argument("--threshold", type=float, default=0.10, help="Variação da mediana considerada regressão")
+    arg_parser.add_argument("--no-save", action="store_true", help="Não acrescenta a execução ao histórico")
+    arg_parser.add_argument("--fail-on-regression", action="store_true", help="Sai com código 1 se houver regressão")
+    args = arg_parser.parse_args()
+    invoice_api.logger.setLevel(logging.ERROR) # Sem os logs por requisição durante as medições
+
+    results = asyncio.run(run_suite(args.sizes, args.repeat, args.seed, args.mongo))
+    previous = load_previous(args.results_file)
+    baseline = previous["results"] if previous else {}
+
+    regressions = 0
+    print(f"{'benchmark':<18} {'mediana (ms)':>13} {'mínimo (ms)':>12} {'pico (KiB)':>11} {'anterior (ms)':>14} {'variação':>9}")
+    for name, result in results.items():
+        before = baseline.get(name, {}).get("median_ms")
+        change = ""
+        if before:
+            ratio = result["median_ms"] / before - 1
+            change = f"{ratio:+.1%}"
+            if ratio > args.threshold:
+                regressions += 1
+                change += "  REGRESSÃO"
+        print(f"{name:<18} {result['median_ms']:>13.2f} {result['min_ms']:>12.2f} {result['peak_kib']:>11.1f}"
+              f" {f'{before:.2f}' if before else '-':>14} {change:>9}")
+    if previous:
+        print(f"\nComparado com o commit {previous['commit']} ({previous['timestamp']}).")
+
+    if not args.no_save:
+        args.results_file.parent.mkdir(parents=True, exist_ok=True)
+        entry = {
+            "commit": git_commit(),
+            "timestamp": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+            "python": platform.python_version(),
+            "machine": platform.node(),
+            "repeat": args.repeat,
+            "mongo": args.mongo,
+            "results": results,
+        }
+        with args.results_file.open("a", encoding="utf-8") as results_file:
+            results_file.write(json.dumps(entry, ensure_ascii=False) + "\n")
+        print(f"Resultados acrescentados a {args.results_file}.")
+
+    return 1 if regressions and args.fail_on_regression else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,73 @@
+"""
+Micro-benchmark dos parsers de número e data.
+
+Compara, para textos no formato da SEFAZ, o parser genérico
+(parse_decimal_generic / parse_datetime_generic com dateutil) com o
+caminho rápido usado por parse_decimal_universal / parse_datetime_flexible,
+e mostra o custo dos validadores de uma página com N itens.
+
+Uso (dentro do diretório invoice_api):
+    python bench_value_parsers.py
+    python bench_value_parsers.py --number 100000 --items 1000
+"""
+import argparse
+import time
+
+from main import (ItemInvoice, parse_datetime_flexible, parse_datetime_generic, parse_decimal_generic,
+                  parse_decimal_universal)
+
+SAMPLE_NUMBERS = ["1", "10", "2,0000", "0,5000", "3,49", "1.234,56", "12.345.678,90", "215,70"]
+SAMPLE_DATES = ["20/05/2025 18:22:31", "01/01/2024 00:00:00", "31/12/2023 23:59:59"]
+
+
+def time_per_call(func, values, number: int) -> float:
+    """Tempo médio (em µs) por chamada de func, percorrendo 'values' em ciclo."""
+    calls = [values[i % len(values)] for i in range(number)]
+    start = time.perf_counter()
+    for value in calls:
+        func(value)
+    return (time.perf_counter() - start) / number * 1_000_000
+
+
+def time_items(item_count: int, repeat: int) -> float:
+    """Menor tempo (em ms) para validar 'item_count' ItemInvoice a partir de texto."""
+    rows = [
+        {"Code": str(100000 + i), "Description": f"PRODUTO {i}", "Quantity": f"{i % 5 + 1},{i % 1000:04d}",
+         "Unit": "KG", "Value": f"{i // 100}.{i % 1000:03d},{i % 100:02d}" if i >= 100 else f"{i},{i % 100:02d}"}
+        for i in range(1, item_count + 1)
+    ]
+    best = float('inf')
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for row in rows:
+            ItemInvoice(**row)
+        best = min(best, time.perf_counter() - start)
+    return best * 1000
+
+
+def main():
+    arg_parser = argparse.ArgumentParser(description="Micro-benchmark dos parsers de número e data.")
+    arg_parser.add_argument("--number", type=int, default=50000, help="Chamadas por medição")
+    arg_parser.add_argument("--items", type=int, default=300, help="Itens da página no teste de validação")
+    arg_parser.add_argument("--repeat", type=int, default=10, help="Execuções da validação (usa o menor tempo)")
+    args = arg_parser.parse_args()
+
+    for sample in SAMPLE_NUMBERS:
+        assert parse_decimal_universal(sample) == parse_decimal_generic(sample), sample
+    for sample in SAMPLE_DATES:
+        assert parse_datetime_flexible(sample) == parse_datetime_generic(sample), sample
+
+    print(f"{'parser':<10} {'genérico (µs)':>14} {'rápido (µs)':>12} {'ganho':>7}")
+    for name, generic, fast, samples in [
+        ("número", parse_decimal_generic, parse_decimal_universal, SAMPLE_NUMBERS),
+        ("data", parse_datetime_generic, parse_datetime_flexible, SAMPLE_DATES),
+    ]:
+        generic_us = time_per_call(generic, samples, args.number)
+        fast_us = time_per_call(fast, samples, args.number)
+        print(f"{name:<10} {generic_us:>14.2f} {fast_us:>12.2f} {generic_us / fast_us:>6.1f}x")
+
+    print(f"\nValidação de {args.items} ItemInvoice: {time_items(args.items, args.repeat):.2f} ms")
+
+
+if __name__ == "__main__":
+    main()
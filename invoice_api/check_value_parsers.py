@@ -0,0 +1,148 @@
+"""
+Teste de equivalência (baseado em propriedades) dos parsers rápidos de
+número e data contra os parsers genéricos.
+
+Gera aleatoriamente (com semente fixa) textos no formato da SEFAZ e textos
+arbitrários e verifica, para cada um:
+- formato da SEFAZ: o caminho rápido aceita e devolve exatamente o mesmo
+  valor (inclusive a representação do Decimal) que o parser genérico;
+- texto arbitrário: se o caminho rápido aceitar, o resultado é o mesmo do
+  parser genérico; se recusar, parse_decimal_universal/parse_datetime_flexible
+  caem no genérico.
+Também confere a construção confiável dos itens (conversão pelas mesmas
+funções + ItemInvoice.model_construct, como em parse_invoice_html) contra
+ItemInvoice.model_validate com os mesmos textos.
+Sai com código 1 e mostra os contraexemplos se alguma propriedade falhar.
+
+Uso (dentro do diretório invoice_api):
+    python check_value_parsers.py
+    python check_value_parsers.py --cases 200000 --seed 7
+"""
+import argparse
+import logging
+import random
+import sys
+import warnings
+from datetime import datetime, timedelta
+
+from main import (ItemInvoice, logger, parse_datetime_flexible, parse_datetime_generic, parse_decimal_generic,
+                  parse_decimal_universal, parse_sefaz_datetime, parse_sefaz_decimal, safe_strip)
+
+JUNK_NUMBER_ALPHABET = "0123456789.,R$ -+e٣²"
+JUNK_DATE_ALPHABET = "0123456789/:- T"
+JUNK_TEXT_ALPHABET = "ABCÇÃ xyz 0123456789-/.\t"
+
+
+def sefaz_number(rng: random.Random) -> str:
+    """Número como o portal mostra: '10', '0,5000', '1.234,56' ou '1234,56'."""
+    integer = str(rng.choice([0, rng.randint(1, 999), rng.randint(1000, 10 ** 9)]))
+    if rng.random() < 0.3:
+        return integer
+    if rng.random() < 0.5 and len(integer) > 3:
+        head = len(integer) % 3 or 3
+        integer = ".".join([integer[:head]] + [integer[i:i + 3] for i in range(head, len(integer), 3)])
+    fraction = "".join(rng.choice("0123456789") for _ in range(rng.randint(1, 4)))
+    return f"{integer},{fraction}"
+
+
+def sefaz_datetime(rng: random.Random) -> str:
+    moment = datetime(2000, 1, 1) + timedelta(seconds=rng.randint(0, 40 * 365 * 86400))
+    if rng.random() < 0.1:
+        return moment.strftime("%d/%m/%Y")
+    return moment.strftime("%d/%m/%Y %H:%M:%S")
+
+
+def shaped_datetime(rng: random.Random) -> str:
+    """Texto no formato da SEFAZ mas com dia/mês/hora possivelmente impossíveis (ex: 31/02)."""
+    return (f"{rng.randint(0, 39):02d}/{rng.randint(0, 19):02d}/{rng.randint(1900, 2100)} "
+            f"{rng.randint(0, 29):02d}:{rng.randint(0, 69):02d}:{rng.randint(0, 69):02d}")
+
+
+def junk(rng: random.Random, alphabet: str) -> str:
+    return "".join(rng.choice(alphabet) for _ in range(rng.randint(1, 20)))
+
+
+def item_texts(rng: random.Random) -> dict:
+    """Textos de um item como o extrator os encontra na página (unidade às vezes ausente)."""
+    return {
+        "Code": rng.choice([str(rng.randint(1, 10 ** 13)), junk(rng, JUNK_TEXT_ALPHABET)]),
+        "Description": f"  {junk(rng, JUNK_TEXT_ALPHABET)} ",
+        "Quantity": sefaz_number(rng),
+        "Unit": rng.choice(["UN", " KG ", "Lt", None]),
+        "Value": sefaz_number(rng),
+    }
+
+
+def check_item_construction(texts: dict, failures: list):
+    values = {
+        "code": safe_strip(texts["Code"]),
+        "description": safe_strip(texts["Description"]),
+        "quantity": parse_decimal_universal(texts["Quantity"]),
+        "unit": safe_strip(texts["Unit"]),
+        "value": parse_decimal_universal(texts["Value"]),
+    }
+    trusted = ItemInvoice.model_construct(**values)
+    validated = ItemInvoice.model_validate(texts)
+    if (trusted != validated or trusted.model_fields_set != validated.model_fields_set
+            or trusted.model_dump_json(by_alias=True) != validated.model_dump_json(by_alias=True)):
+        failures.append(f"item {texts!r}: confiável={trusted!r} validado={validated!r}")
+
+
+def same(a, b) -> bool:
+    """Igualdade estrita: mesmo tipo, mesmo valor e mesma representação."""
+    return type(a) is type(b) and a == b and str(a) == str(b)
+
+
+def check(cases: int, seed: int):
+    rng = random.Random(seed)
+    failures = []
+
+    for _ in range(cases):
+        text = sefaz_number(rng)
+        fast = parse_sefaz_decimal(text)
+        if fast is None or not same(fast, parse_decimal_generic(text)):
+            failures.append(f"número SEFAZ {text!r}: rápido={fast!r} genérico={parse_decimal_generic(text)!r}")
+
+        text = junk(rng, JUNK_NUMBER_ALPHABET)
+        fast = parse_sefaz_decimal(text.strip())
+        generic = parse_decimal_generic(text)
+        if fast is not None and not same(fast, generic):
+            failures.append(f"número {text!r}: rápido={fast!r} genérico={generic!r}")
+        if not same(parse_decimal_universal(text), generic):
+            failures.append(f"número {text!r}: universal={parse_decimal_universal(text)!r} genérico={generic!r}")
+
+        text = sefaz_datetime(rng)
+        fast = parse_sefaz_datetime(text)
+        if fast is None or fast != parse_datetime_generic(text):
+            failures.append(f"data SEFAZ {text!r}: rápido={fast!r} genérico={parse_datetime_generic(text)!r}")
+
+        for text in (shaped_datetime(rng), junk(rng, JUNK_DATE_ALPHABET)):
+            fast = parse_sefaz_datetime(text.strip())
+            generic = parse_datetime_generic(text)
+            if fast is not None and fast != generic:
+                failures.append(f"data {text!r}: rápido={fast!r} genérico={generic!r}")
+            if parse_datetime_flexible(text) != generic:
+                failures.append(f"data {text!r}: flexível={parse_datetime_flexible(text)!r} genérico={generic!r}")
+
+        check_item_construction(item_texts(rng), failures)
+
+    return failures
+
+
+def main():
+    arg_parser = argparse.ArgumentParser(description="Equivalência dos parsers rápidos de número e data.")
+    arg_parser.add_argument("--cases", type=int, default=20000, help="Casos gerados por propriedade")
+    arg_parser.add_argument("--seed", type=int, default=2025, help="Semente do gerador aleatório")
+    args = arg_parser.parse_args()
+    logger.setLevel(logging.CRITICAL) # O parser genérico avisa a cada texto inválido
+    warnings.simplefilter("ignore") # dateutil avisa sobre fusos desconhecidos no texto aleatório
+
+    failures = check(args.cases, args.seed)
+    for failure in failures[:20]:
+        print(f"FALHA  {failure}")
+    print(f"{args.cases} casos por propriedade (semente {args.seed}), {len(failures)} falhas.")
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,78 @@
+"""
+Teste diferencial dos backends de extração de itens.
+
+Roda o backend BeautifulSoup (extract_items_from_html) e o backend lxml
+(extract_items_with_lxml) sobre um conjunto de páginas HTML e falha (código
+de saída 1) se algum ItemInvoice for diferente entre os dois.
+
+Uso (dentro do diretório invoice_api):
+    python diff_item_parsers.py                  # usa as páginas em fixtures/
+    python diff_item_parsers.py pagina1.html dir_com_paginas/
+"""
+import argparse
+import logging
+import sys
+from pathlib import Path
+
+from bs4 import BeautifulSoup
+
+from main import extract_items_from_html, extract_items_with_lxml, logger
+
+DEFAULT_FIXTURES_DIR = Path(__file__).parent / "fixtures"
+
+
+def collect_pages(paths):
+    """Expande diretórios em arquivos .html, mantendo a ordem."""
+    pages = []
+    for path in paths:
+        path = Path(path)
+        if path.is_dir():
+            pages.extend(sorted(path.glob("*.html")))
+        else:
+            pages.append(path)
+    return pages
+
+
+def compare_page(path: Path):
+    """Retorna (quantidade de itens, lista de diferenças) para uma página."""
+    html_content = path.read_text(encoding="utf-8")
+    bs4_items = [item.model_dump() for item in extract_items_from_html(BeautifulSoup(html_content, 'lxml'))]
+    lxml_items = [item.model_dump() for item in extract_items_with_lxml(html_content)]
+
+    differences = []
+    if len(bs4_items) != len(lxml_items):
+        differences.append(f"quantidade de itens: bs4={len(bs4_items)} lxml={len(lxml_items)}")
+    for index, (bs4_item, lxml_item) in enumerate(zip(bs4_items, lxml_items), start=1):
+        if bs4_item != lxml_item:
+            differences.append(f"item {index}:\n      bs4:  {bs4_item}\n      lxml: {lxml_item}")
+    return len(bs4_items), differences
+
+
+def main():
+    arg_parser = argparse.ArgumentParser(description="Compara os backends de extração de itens (bs4 x lxml).")
+    arg_parser.add_argument("paths", nargs="*", default=[DEFAULT_FIXTURES_DIR], help="Arquivos .html ou diretórios")
+    args = arg_parser.parse_args()
+    logger.setLevel(logging.ERROR) # Avisos de linhas ignoradas não interessam aqui
+
+    pages = collect_pages(args.paths)
+    if not pages:
+        print("Nenhuma página HTML encontrada.")
+        return 1
+
+    failures = 0
+    for page in pages:
+        item_count, differences = compare_page(page)
+        if differences:
+            failures += 1
+            print(f"DIFERENTE  {page} ({item_count} itens)")
+            for difference in differences:
+                print(f"    {difference}")
+        else:
+            print(f"OK         {page} ({item_count} itens)")
+
+    print(f"\n{len(pages)} páginas comparadas, {failures} com diferenças.")
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
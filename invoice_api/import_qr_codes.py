@@ -0,0 +1,255 @@
+"""
+Importação em massa de QR Codes de NFC-e a partir de arquivos texto ou CSV.
+
+- Lê o arquivo em streaming (uma linha por vez), aceitando o parâmetro 'p' puro
+  ou a URL completa do QR Code (...qrcode.xhtml?p=...).
+- Processa as entradas em paralelo, com limite de concorrência, usando a mesma
+  busca/extração do invoice_api (limite de taxa, novas tentativas e circuit
+  breaker do portal incluídos) e grava em lote no MongoDB.
+- Antes de buscar na SEFAZ, consulta no MongoDB (em lotes) as chaves lidas:
+  notas já gravadas contam como 'exists' sem acessar o portal.
+- É retomável: as chaves já gravadas vão para um arquivo de estado e são
+  puladas ao rodar de novo. Entradas com erro não entram no estado (são
+  tentadas de novo) e podem ser listadas em um arquivo de erros.
+- Mostra o progresso com vazão e tempo estimado (ETA).
+
+Uso (dentro do diretório invoice_api):
+    python import_qr_codes.py qrcodes.txt
+    python import_qr_codes.py leituras.csv --column qrcode --concurrency 16
+    python import_qr_codes.py qrcodes.txt --errors-file erros.txt
+    python import_qr_codes.py qrcodes.txt --restart      # ignora o estado salvo
+"""
+import argparse
+import asyncio
+import csv
+import logging
+import os
+import sys
+import time
+from pathlib import Path
+from urllib.parse import parse_qs, urlsplit
+
+from fastapi import HTTPException
+
+import main as invoice_api
+
+
+def qr_parameter_from_entry(value: str) -> str:
+    """Aceita o parâmetro 'p' puro ou a URL completa do QR Code."""
+    value = value.strip()
+    if "?" in value and "p=" in value:
+        return parse_qs(urlsplit(value).query).get("p", [value])[0]
+    return value
+
+
+def iter_entries(path: Path, column, delimiter: str):
+    """Gera os parâmetros do arquivo, um por vez (sem carregar o arquivo inteiro)."""
+    with path.open(encoding="utf-8-sig", newline="") as input_file:
+        if path.suffix.lower() == ".csv":
+            reader = csv.reader(input_file, delimiter=delimiter)
+            index = 0
+            if column is not None and not column.isdigit():
+                header = next(reader, [])
+                if column not in header:
+                    raise SystemExit(f"Coluna '{column}' não encontrada no cabeçalho: {header}")
+                index = header.index(column)
+            elif column is not None:
+                index = int(column)
+            for row in reader:
+                if len(row) > index and row[index].strip():
+                    yield qr_parameter_from_entry(row[index])
+        else:
+            for line in input_file:
+                line = line.strip()
+                if line and not line.startswith("#"):
+                    yield qr_parameter_from_entry(line)
+
+
+def count_entries(path: Path, column, delimiter: str) -> int:
+    return sum(1 for _ in iter_entries(path, column, delimiter))
+
+
+class Checkpoint:
+    """Arquivo de estado: uma chave normalizada por linha, acrescentada após cada lote gravado."""
+
+    def __init__(self, path: Path, restart: bool):
+        self.path = path
+        if restart and path.exists():
+            path.unlink()
+        self.done = set()
+        if path.exists():
+            self.done = {line.strip() for line in path.read_text(encoding="utf-8").splitlines() if line.strip()}
+        self._file = path.open("a", encoding="utf-8")
+
+    def mark(self, keys):
+        self._file.write("".join(f"{key}\n" for key in keys))
+        self._file.flush()
+        os.fsync(self._file.fileno()) # O lote só conta como feito depois de chegar ao disco
+        self.done.update(keys)
+
+    def close(self):
+        self._file.close()
+
+
+class Progress:
+    def __init__(self, total, interval: float):
+        self.total = total
+        self.interval = interval
+        self.start = time.monotonic()
+        self.last_report = self.start
+        self.counts = {"inserted": 0, "exists": 0, "skipped": 0, "duplicate": 0, "error": 0}
+
+    @property
+    def processed(self) -> int:
+        return sum(self.counts.values())
+
+    def add(self, status: str, amount: int = 1):
+        self.counts[status] += amount
+        now = time.monotonic()
+        if now - self.last_report >= self.interval:
+            self.last_report = now
+            self.report()
+
+    def report(self, final: bool = False):
+        elapsed = time.monotonic() - self.start
+        rate = self.processed / elapsed if elapsed > 0 else 0.0
+        position = f"{self.processed}/{self.total}" if self.total else str(self.processed)
+        eta = ""
+        if self.total and rate > 0 and not final:
+            remaining = (self.total - self.processed) / rate
+            eta = f", ETA {int(remaining // 3600):02d}:{int(remaining % 3600 // 60):02d}:{int(remaining % 60):02d}"
+        details = ", ".join(f"{name} {count}" for name, count in self.counts.items())
+        print(f"{'Concluído: ' if final else ''}{position} entradas ({rate:.1f}/s{eta}) - {details}", flush=True)
+
+
+async def run_import(args) -> int:
+    input_path = Path(args.input)
+    total = None if args.no_count else count_entries(input_path, args.column, args.delimiter)
+    checkpoint = Checkpoint(Path(args.state_file or f"{input_path}.state"), args.restart)
+    errors_file = open(args.errors_file, "a", encoding="utf-8") if args.errors_file else None
+    progress = Progress(total, args.progress_interval)
+    if checkpoint.done:
+        print(f"Retomando: {len(checkpoint.done)} chaves já importadas serão puladas.")
+
+    queue: asyncio.Queue = asyncio.Queue(maxsize=args.concurrency * 2) # Leitura limitada (streaming)
+    pending = [] # Notas extraídas aguardando gravação em lote
+    write_lock = asyncio.Lock()
+    seen = set()
+
+    def record_error(qr_code_parameter: str, detail):
+        progress.add("error")
+        if errors_file is not None:
+            errors_file.write(f"{qr_code_parameter}\t{detail}\n")
+            errors_file.flush()
+
+    async def flush():
+        async with write_lock:
+            batch = pending[:]
+            pending.clear()
+            if not batch:
+                return
+            statuses = await invoice_api.save_invoices_bulk([invoice for invoice, _ in batch])
+            saved = []
+            for invoice, qr_code_parameter in batch:
+                status = statuses.get(invoice.access_key, "error")
+                if status == "error":
+                    record_error(qr_code_parameter, "falha ao gravar no MongoDB")
+                else:
+                    saved.append(invoice_api.normalize_access_key(invoice.access_key))
+                    progress.add(status)
+            checkpoint.mark(saved)
+
+    async def worker():
+        while True:
+            qr_code_parameter = await queue.get()
+            try:
+                invoice, _ = await invoice_api.fetch_and_parse_shared(qr_code_parameter)
+                if not invoice_api.normalize_access_key(invoice.access_key):
+                    record_error(qr_code_parameter, "chave de acesso não encontrada na nota")
+                else:
+                    pending.append((invoice, qr_code_parameter))
+                    if len(pending) >= args.batch_size:
+                        await flush()
+            except HTTPException as e:
+                record_error(qr_code_parameter, e.detail)
+            except Exception as e:
+                record_error(qr_code_parameter, f"erro inesperado: {e}")
+            finally:
+                queue.task_done()
+
+    async def enqueue(chunk):
+        """Consulta as chaves do lote no banco: as já gravadas não vão à SEFAZ."""
+        stored = await invoice_api.lookup_stored_invoices([key for key, _ in chunk])
+        existing = [key for key, _ in chunk if key in stored]
+        if existing:
+            checkpoint.mark(existing)
+            progress.add("exists", len(existing))
+        for key, qr_code_parameter in chunk:
+            if key not in stored:
+                await queue.put(qr_code_parameter)
+
+    workers = [asyncio.create_task(worker()) for _ in range(args.concurrency)]
+    chunk = [] # Chaves lidas aguardando a consulta em lote no banco
+    try:
+        for qr_code_parameter in iter_entries(input_path, args.column, args.delimiter):
+            key = invoice_api.access_key_from_qr(qr_code_parameter)
+            if key is None:
+                record_error(qr_code_parameter, "parâmetro sem chave de acesso de 44 dígitos")
+            elif key in checkpoint.done:
+                progress.add("skipped")
+            elif key in seen:
+                progress.add("duplicate")
+            else:
+                seen.add(key)
+                chunk.append((key, qr_code_parameter))
+                if len(chunk) >= args.batch_size:
+                    await enqueue(chunk)
+                    chunk = []
+        await enqueue(chunk)
+        await queue.join()
+        await flush()
+    finally:
+        for task in workers:
+            task.cancel()
+        await asyncio.gather(*workers, return_exceptions=True)
+        await flush() # Grava o que já foi extraído mesmo se a importação for interrompida
+        checkpoint.close()
+        if errors_file is not None:
+            errors_file.close()
+        progress.report(final=True)
+    return 1 if progress.counts["error"] else 0
+
+
+async def main_async(args) -> int:
+    async with invoice_api.lifespan(invoice_api.app): # Conexões com o MongoDB e a SEFAZ, como na API
+        if not await invoice_api.mongo_connector.wait_connected(args.mongo_timeout):
+            print("MongoDB indisponível: nada seria gravado. Verifique MONGO_URI.")
+            return 1
+        return await run_import(args)
+
+
+def main():
+    arg_parser = argparse.ArgumentParser(description="Importa em massa QR Codes de NFC-e (texto ou CSV).")
+    arg_parser.add_argument("input", help="Arquivo .txt (um QR Code por linha) ou .csv")
+    arg_parser.add_argument("--column", help="Coluna do CSV com o QR Code (nome ou índice; padrão: primeira)")
+    arg_parser.add_argument("--delimiter", default=",", help="Separador do CSV")
+    arg_parser.add_argument("--concurrency", type=int, default=invoice_api.BATCH_CONCURRENCY, help="Buscas simultâneas")
+    arg_parser.add_argument("--batch-size", type=int, default=100, help="Notas por gravação em lote")
+    arg_parser.add_argument("--state-file", help="Arquivo de estado (padrão: <entrada>.state)")
+    arg_parser.add_argument("--restart", action="store_true", help="Recomeça do início, ignorando o estado salvo")
+    arg_parser.add_argument("--errors-file", help="Acrescenta as entradas com erro (parâmetro<TAB>motivo)")
+    arg_parser.add_argument("--progress-interval", type=float, default=5.0, help="Segundos entre as linhas de progresso")
+    arg_parser.add_argument("--mongo-timeout", type=float, default=30.0, help="Segundos esperando o MongoDB responder")
+    arg_parser.add_argument("--no-count", action="store_true", help="Não conta as entradas antes (sem ETA)")
+    args = arg_parser.parse_args()
+    invoice_api.logger.setLevel(logging.WARNING) # Só avisos e erros; o progresso é impresso à parte
+
+    try:
+        return asyncio.run(main_async(args))
+    except KeyboardInterrupt:
+        print("Interrompido. Rode de novo para continuar de onde parou.")
+        return 130
+
+
+if __name__ == "__main__":
+    sys.exit(main())
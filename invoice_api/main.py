@@ -1,16 +1,39 @@
+import asyncio
+import gzip
+import json
+import logging
+import multiprocessing
 import os
+import random
 import re
-from datetime import datetime
+import time
+import unicodedata
+from collections import OrderedDict
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+from contextlib import asynccontextmanager
+from datetime import datetime, timezone
 from decimal import Decimal, InvalidOperation
-from typing import List, Optional, Annotated
+from pathlib import Path
+from typing import Awaitable, Callable, Dict, List, Optional, Tuple, Annotated
+from urllib.parse import urlsplit
 
-import requests
-from bs4 import BeautifulSoup # Para parsear HTML
+import httpx # Cliente HTTP assíncrono com pool de conexões keep-alive
+from bs4 import BeautifulSoup, Comment, NavigableString, Tag # Para parsear HTML
+try:
+    from lxml import etree as lxml_etree # Backend rápido para a tabela de itens
+except ImportError:
+    lxml_etree = None
+try:
+    import orjson # Serialização JSON rápida (Decimal via default, datetime nativo)
+except ImportError:
+    orjson = None
 from dotenv import load_dotenv # Para carregar variáveis de ambiente (.env)
-from fastapi import FastAPI, HTTPException # Framework web
+from fastapi import FastAPI, HTTPException, Response # Framework web
+from fastapi.responses import JSONResponse
+from prometheus_client import CONTENT_TYPE_LATEST, Gauge, Histogram, generate_latest # Métricas /metrics
 from pydantic import BaseModel, Field, ConfigDict, BeforeValidator
-from pymongo import MongoClient # Driver MongoDB
-from pymongo.errors import ConnectionFailure, OperationFailure
+from pymongo import AsyncMongoClient, UpdateOne # Driver MongoDB (API assíncrona)
+from pymongo.errors import BulkWriteError, DuplicateKeyError, OperationFailure
 from dateutil import parser as date_parser # Para parsear datas de forma mais flexível
 
 from bson.decimal128 import Decimal128
@@ -19,6 +42,47 @@ from bson.codec_options import CodecOptions, TypeRegistry, TypeCodec
 # Carregar variáveis de ambiente do arquivo .env
 load_dotenv()
 
+# --- Logging (níveis configuráveis; DEBUG desligado por padrão) ---
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO").upper()
+LOG_FORMAT = os.getenv("LOG_FORMAT", "text").lower() # 'text' ou 'json' (uma linha JSON por evento)
+
+class JsonLogFormatter(logging.Formatter):
+    """Formata cada registro de log como uma linha JSON."""
+
+    def format(self, record):
+        entry = {
+            "time": self.formatTime(record),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+        }
+        if record.exc_info:
+            entry["exception"] = self.formatException(record.exc_info)
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+logger = logging.getLogger("invoice_api")
+if not logger.handlers:
+    log_handler = logging.StreamHandler()
+    log_handler.setFormatter(
+        JsonLogFormatter() if LOG_FORMAT == "json"
+        else logging.Formatter("%(asctime)s %(levelname)s [%(name)s] %(message)s")
+    )
+    logger.addHandler(log_handler)
+    logger.propagate = False
+logger.setLevel(LOG_LEVEL)
+
+# --- Métricas (Prometheus) ---
+# Etapas: fetch (portal SEFAZ), html_parse, header, items (inclui a validação de
+# cada ItemInvoice), validation (Invoice final), parse (extração completa, inclusive
+# a espera no pool de threads/processos) e mongo_write. Com PARSER_MODE=process as
+# etapas internas da extração são medidas nos processos filhos e não aparecem aqui
+STAGE_SECONDS = Histogram(
+    "invoice_api_stage_seconds",
+    "Duração de cada etapa do processamento de uma nota fiscal",
+    ["stage"],
+    buckets=(0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30),
+)
+
 # --- Codec para Decimal ---
 class DecimalCodec(TypeCodec):
     python_type = Decimal    # O tipo Python que estamos tratando
@@ -50,32 +114,499 @@ MONGO_CONNECTION_STRING = os.getenv("MONGO_URI", "mongodb://localhost:27017/")
 DB_NAME = os.getenv("DB_NAME", "InvoicesDB") # Usando o nome do seu log
 COLLECTION_NAME = os.getenv("COLLECTION_NAME", "Invoices") # Nome da coleção default
 
+NORMALIZED_KEY_FIELD = "NormalizedAccessKey" # Chave de acesso só com os 44 dígitos
+NORMALIZED_KEY_INDEX = "ux_normalized_access_key"
+MARKET_SEARCH_FIELD = "MarketNameNormalized" # Nome do mercado sem acentos, em maiúsculas (filtro do invoice_lister)
+UPDATED_AT_FIELD = "UpdatedAt" # Momento da última gravação; todo $set numa nota gravada deve atualizá-lo (ETags do invoice_lister)
+
+# Pool de conexões do cliente assíncrono
+MONGO_MAX_POOL_SIZE = int(os.getenv("MONGO_MAX_POOL_SIZE", "100")) # Conexões simultâneas ao MongoDB
+MONGO_MIN_POOL_SIZE = int(os.getenv("MONGO_MIN_POOL_SIZE", "10")) # Conexões mantidas abertas (aquecidas)
+MONGO_MAX_IDLE_TIME_MS = int(os.getenv("MONGO_MAX_IDLE_TIME_MS", "60000")) # Fecha conexões ociosas após N ms
+MONGO_WAIT_QUEUE_TIMEOUT_MS = int(os.getenv("MONGO_WAIT_QUEUE_TIMEOUT_MS", "5000")) # Espera máxima por uma conexão livre
+MONGO_SERVER_SELECTION_TIMEOUT_MS = int(os.getenv("MONGO_SERVER_SELECTION_TIMEOUT_MS", "5000"))
+
+MONGO_RETRY_MIN = float(os.getenv("MONGO_RETRY_MIN", "1")) # Espera (s) após a primeira tentativa de conexão falhar
+MONGO_RETRY_MAX = float(os.getenv("MONGO_RETRY_MAX", "30")) # Espera máxima (s) entre tentativas
+MONGO_READY_TIMEOUT = float(os.getenv("MONGO_READY_TIMEOUT", "1")) # Tempo do ping em /health/ready
+
+# Preenchidos pelo MongoConnector quando o banco responde (None = sem banco por enquanto)
 mongo_client = None
 db = None
 invoices_collection = None
 
-try:
-    print(f"Tentando conectar ao MongoDB em {MONGO_CONNECTION_STRING}...")
-    # Conecta sem passar codec_options diretamente aqui
-    mongo_client = MongoClient(
-        MONGO_CONNECTION_STRING,
-        serverSelectionTimeoutMS=5000
-        # REMOVIDO: codec_options=codec_options
-    )
-    mongo_client.admin.command('ping') # Verifica a conexão
+class MongoConnector:
+    """
+    Conexão preguiçosa com o MongoDB. start() só agenda uma tarefa de fundo,
+    então o servidor sobe na hora; a tarefa tenta o ping com backoff até o
+    banco responder, publica cliente/banco/coleção (com as codec_options de
+    Decimal128) e então cria os índices uma única vez. Enquanto o banco não
+    responde, as notas são extraídas mas não gravadas, como antes.
+    """
+
+    def __init__(self):
+        self._client = None
+        self._task: Optional[asyncio.Task] = None
+        self._connected: Optional[asyncio.Event] = None
+        self.attempts = 0
+        self.last_error: Optional[str] = None
+        self.indexes_ready = False
+
+    def start(self):
+        self._connected = asyncio.Event()
+        self._client = AsyncMongoClient(
+            MONGO_CONNECTION_STRING,
+            serverSelectionTimeoutMS=MONGO_SERVER_SELECTION_TIMEOUT_MS,
+            maxPoolSize=MONGO_MAX_POOL_SIZE,
+            minPoolSize=MONGO_MIN_POOL_SIZE,
+            maxIdleTimeMS=MONGO_MAX_IDLE_TIME_MS,
+            waitQueueTimeoutMS=MONGO_WAIT_QUEUE_TIMEOUT_MS
+        ) # Não conecta aqui: o driver abre as conexões em segundo plano
+        self._task = asyncio.create_task(self._run())
+
+    async def _run(self):
+        global mongo_client, db, invoices_collection
+        delay = MONGO_RETRY_MIN
+        logger.info("Tentando conectar ao MongoDB em %s...", MONGO_CONNECTION_STRING)
+        while True:
+            self.attempts += 1
+            try:
+                await self._client.admin.command('ping') # Verifica a conexão
+                break
+            except Exception as e:
+                self.last_error = str(e)
+                logger.warning("MongoDB indisponível (tentativa %d): %s. Nova tentativa em %.1fs.", self.attempts, e, delay)
+                await asyncio.sleep(delay)
+                delay = min(delay * 2, MONGO_RETRY_MAX)
+
+        # Obter o banco e a coleção aplicando as codec_options aqui (CORRETO)
+        database = self._client.get_database(DB_NAME, codec_options=codec_options)
+        collection = database.get_collection(COLLECTION_NAME, codec_options=codec_options)
+        mongo_client, db, invoices_collection = self._client, database, collection
+        self.last_error = None
+        self._connected.set()
+        logger.info("Conectado ao MongoDB. DB='%s', Collection='%s' configuradas com suporte a Decimal128 (pool máx. %d).",
+                    DB_NAME, COLLECTION_NAME, MONGO_MAX_POOL_SIZE)
+        await self._ensure_indexes(collection)
+
+    async def _ensure_indexes(self, collection):
+        try:
+            # Índice único na chave normalizada (só dígitos). Documentos antigos sem o
+            # campo ficam fora do índice até rodar migrate_access_key.py
+            await collection.create_index(
+                NORMALIZED_KEY_FIELD,
+                unique=True,
+                name=NORMALIZED_KEY_INDEX,
+                partialFilterExpression={NORMALIZED_KEY_FIELD: {"$type": "string"}}
+            )
+            self.indexes_ready = True
+            logger.info("Índices do MongoDB verificados.")
+        except Exception as e:
+            self.last_error = str(e)
+            logger.error("Falha ao criar os índices do MongoDB: %s", e)
+
+    @property
+    def connected(self) -> bool:
+        return self._connected is not None and self._connected.is_set()
+
+    async def wait_connected(self, timeout: float) -> bool:
+        """Espera até 'timeout' segundos pela conexão (para scripts que precisam do banco)."""
+        if self._connected is None:
+            return False
+        try:
+            await asyncio.wait_for(self._connected.wait(), timeout)
+            return True
+        except asyncio.TimeoutError:
+            return False
+
+    async def ping(self) -> bool:
+        if not self.connected:
+            return False
+        try:
+            await asyncio.wait_for(self._client.admin.command('ping'), MONGO_READY_TIMEOUT)
+            return True
+        except Exception as e:
+            self.last_error = str(e)
+            return False
+
+    async def stop(self):
+        global mongo_client, db, invoices_collection
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        if self._client is not None:
+            await self._client.close()
+            self._client = None
+        mongo_client = db = invoices_collection = None
+        self._connected = None
+
+    def stats(self) -> dict:
+        return {"connected": self.connected, "indexes_ready": self.indexes_ready,
+                "attempts": self.attempts, "last_error": self.last_error}
+
+
+mongo_connector = MongoConnector()
+
+
+# --- Configuração do Parser de Itens ---
+ITEM_PARSER_BACKEND = os.getenv("ITEM_PARSER_BACKEND", "lxml").lower() # 'lxml' (rápido) ou 'bs4'
+PARSER_MODE = os.getenv("PARSER_MODE", "inline").lower() # 'inline' (no event loop), 'thread' ou 'process'
+PARSER_WORKERS = int(os.getenv("PARSER_WORKERS", str(os.cpu_count() or 1))) # Threads/processos de extração
+PARSER_MP_START_METHOD = os.getenv("PARSER_MP_START_METHOD", "spawn") # 'spawn' evita fork com threads ativas
+
+
+# --- Configuração do Processamento em Lote ---
+BATCH_MAX_ITEMS = int(os.getenv("BATCH_MAX_ITEMS", "500")) # QR Codes aceitos por requisição
+BATCH_CONCURRENCY = int(os.getenv("BATCH_CONCURRENCY", "16")) # Buscas simultâneas por lote
+
+
+# --- Configuração do Cache de Notas já Armazenadas ---
+INVOICE_CACHE_SIZE = int(os.getenv("INVOICE_CACHE_SIZE", "5000")) # Notas mantidas em memória
+INVOICE_CACHE_TTL = float(os.getenv("INVOICE_CACHE_TTL", "3600")) # Segundos até expirar
+
+
+# --- Configuração do Arquivo de HTML Bruto ---
+HTML_ARCHIVE_DIR = os.getenv("HTML_ARCHIVE_DIR", "html_archive") # Vazio desativa o arquivamento
+HTML_ARCHIVE_COMPRESSLEVEL = int(os.getenv("HTML_ARCHIVE_COMPRESSLEVEL", "6"))
+
+
+# --- Configuração da Gravação Assíncrona (write-behind) ---
+WRITE_BEHIND_ENABLED = os.getenv("WRITE_BEHIND_ENABLED", "false").lower() in ("1", "true", "yes")
+WRITE_BEHIND_QUEUE_SIZE = int(os.getenv("WRITE_BEHIND_QUEUE_SIZE", "1000")) # Notas aguardando gravação
+WRITE_BEHIND_BATCH_SIZE = int(os.getenv("WRITE_BEHIND_BATCH_SIZE", "100")) # Grava ao juntar N notas...
+WRITE_BEHIND_FLUSH_INTERVAL = float(os.getenv("WRITE_BEHIND_FLUSH_INTERVAL", "1.0")) # ...ou a cada N segundos
+WRITE_BEHIND_MAX_RETRIES = int(os.getenv("WRITE_BEHIND_MAX_RETRIES", "5")) # Novas tentativas de notas com erro
+WRITE_BEHIND_RETRY_DELAY = float(os.getenv("WRITE_BEHIND_RETRY_DELAY", "1.0")) # Espera inicial (dobra, até 30s)
+
+
+# --- Configuração do Cliente HTTP (Portal SEFAZ) ---
+SEFAZ_QRCODE_URL = os.getenv("SEFAZ_QRCODE_URL", "https://portalsped.fazenda.mg.gov.br/portalnfce/sistema/qrcode.xhtml")
+HTTP_USER_AGENT = 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36'
+HTTP_CONNECT_TIMEOUT = float(os.getenv("HTTP_CONNECT_TIMEOUT", "5")) # Tempo para abrir a conexão TCP/TLS
+HTTP_READ_TIMEOUT = float(os.getenv("HTTP_READ_TIMEOUT", "30")) # Tempo máximo esperando bytes da resposta
+HTTP_POOL_TIMEOUT = float(os.getenv("HTTP_POOL_TIMEOUT", "10")) # Tempo esperando uma conexão livre no pool
+HTTP_MAX_CONNECTIONS = int(os.getenv("HTTP_MAX_CONNECTIONS", "100"))
+HTTP_MAX_KEEPALIVE_CONNECTIONS = int(os.getenv("HTTP_MAX_KEEPALIVE_CONNECTIONS", "20"))
+HTTP_KEEPALIVE_EXPIRY = float(os.getenv("HTTP_KEEPALIVE_EXPIRY", "30"))
+HTTP_MAX_PER_HOST = int(os.getenv("HTTP_MAX_PER_HOST", "32")) # Requisições simultâneas por host
 
-    # Obter o banco e a coleção aplicando as codec_options aqui (CORRETO)
-    db = mongo_client.get_database(DB_NAME, codec_options=codec_options)
-    invoices_collection = db.get_collection(COLLECTION_NAME, codec_options=codec_options)
 
-    # Criar índice único (sem alterações aqui)
-    invoices_collection.create_index("access_key", unique=True, sparse=True)
-    # Atualiza a mensagem de log para refletir onde as opções são aplicadas
-    print(f"Conectado ao MongoDB. DB='{DB_NAME}', Collection='{COLLECTION_NAME}' configuradas com suporte a Decimal128.")
-except ConnectionFailure as e:
-    print(f"Erro ao conectar ao MongoDB: {e}")
-except Exception as e:
-    print(f"Ocorreu um erro inesperado na configuração do MongoDB: {e}")
+# --- Configuração da Proteção do Portal (limite de taxa, novas tentativas, circuit breaker) ---
+SEFAZ_RATE_LIMIT = float(os.getenv("SEFAZ_RATE_LIMIT", "10")) # Requisições por segundo ao portal (0 desativa)
+SEFAZ_RATE_BURST = int(os.getenv("SEFAZ_RATE_BURST", "20")) # Rajada máxima acima da taxa
+SEFAZ_MAX_RETRIES = int(os.getenv("SEFAZ_MAX_RETRIES", "3")) # Novas tentativas em erro transitório
+SEFAZ_BACKOFF_BASE = float(os.getenv("SEFAZ_BACKOFF_BASE", "0.5")) # Espera base (s), dobra a cada tentativa
+SEFAZ_BACKOFF_MAX = float(os.getenv("SEFAZ_BACKOFF_MAX", "8")) # Espera máxima (s) entre tentativas
+SEFAZ_CIRCUIT_FAILURES = int(os.getenv("SEFAZ_CIRCUIT_FAILURES", "5")) # Falhas seguidas que abrem o circuito
+SEFAZ_CIRCUIT_RESET = float(os.getenv("SEFAZ_CIRCUIT_RESET", "30")) # Segundos com o circuito aberto antes de testar
+
+
+class SefazHttpClient:
+    """
+    Cliente HTTP assíncrono compartilhado para buscar páginas no portal da SEFAZ.
+    Mantém conexões keep-alive em pool, limita a concorrência por host e
+    guarda estatísticas simples de uso.
+    """
+
+    def __init__(self):
+        self._client: Optional[httpx.AsyncClient] = None
+        self._host_semaphores: Dict[str, asyncio.Semaphore] = {}
+        self.stats = {
+            "requests_total": 0,
+            "responses_ok": 0,
+            "errors_total": 0,
+            "timeouts_total": 0,
+            "in_flight": 0,
+            "max_in_flight": 0,
+            "waiting_for_slot": 0,
+        }
+
+    def _get_client(self) -> httpx.AsyncClient:
+        # Criado sob demanda para ficar preso ao event loop que está rodando
+        if self._client is None or self._client.is_closed:
+            self._client = httpx.AsyncClient(
+                headers={'User-Agent': HTTP_USER_AGENT},
+                timeout=httpx.Timeout(
+                    connect=HTTP_CONNECT_TIMEOUT,
+                    read=HTTP_READ_TIMEOUT,
+                    write=HTTP_READ_TIMEOUT,
+                    pool=HTTP_POOL_TIMEOUT,
+                ),
+                limits=httpx.Limits(
+                    max_connections=HTTP_MAX_CONNECTIONS,
+                    max_keepalive_connections=HTTP_MAX_KEEPALIVE_CONNECTIONS,
+                    keepalive_expiry=HTTP_KEEPALIVE_EXPIRY,
+                ),
+                follow_redirects=True,
+            )
+        return self._client
+
+    def _host_semaphore(self, url: str) -> asyncio.Semaphore:
+        host = urlsplit(url).netloc
+        semaphore = self._host_semaphores.get(host)
+        if semaphore is None:
+            semaphore = asyncio.Semaphore(HTTP_MAX_PER_HOST)
+            self._host_semaphores[host] = semaphore
+        return semaphore
+
+    async def fetch_text(self, url: str) -> str:
+        """Faz GET na URL e retorna o corpo como texto. Lança exceções do httpx."""
+        client = self._get_client()
+        semaphore = self._host_semaphore(url)
+        self.stats["waiting_for_slot"] += 1
+        try:
+            await semaphore.acquire()
+        finally:
+            self.stats["waiting_for_slot"] -= 1
+        self.stats["requests_total"] += 1
+        self.stats["in_flight"] += 1
+        self.stats["max_in_flight"] = max(self.stats["max_in_flight"], self.stats["in_flight"])
+        try:
+            response = await client.get(url)
+            response.raise_for_status()
+            self.stats["responses_ok"] += 1
+            return response.text
+        except httpx.TimeoutException:
+            self.stats["timeouts_total"] += 1
+            raise
+        except httpx.HTTPError:
+            self.stats["errors_total"] += 1
+            raise
+        finally:
+            self.stats["in_flight"] -= 1
+            semaphore.release()
+
+    def pool_stats(self) -> dict:
+        """Retorna estatísticas do pool e a configuração em uso."""
+        open_connections = None
+        idle_connections = None
+        if self._client is not None and not self._client.is_closed:
+            # O pool do httpcore não é parte da API pública do httpx; lê com cuidado
+            pool = getattr(getattr(self._client, "_transport", None), "_pool", None)
+            connections = getattr(pool, "connections", None)
+            if connections is not None:
+                open_connections = len(connections)
+                idle_connections = sum(1 for conn in connections if conn.is_idle())
+        return {
+            **self.stats,
+            "open_connections": open_connections,
+            "idle_connections": idle_connections,
+            "hosts": {
+                host: {"available_slots": sem._value, "max_per_host": HTTP_MAX_PER_HOST}
+                for host, sem in self._host_semaphores.items()
+            },
+            "config": {
+                "connect_timeout": HTTP_CONNECT_TIMEOUT,
+                "read_timeout": HTTP_READ_TIMEOUT,
+                "pool_timeout": HTTP_POOL_TIMEOUT,
+                "max_connections": HTTP_MAX_CONNECTIONS,
+                "max_keepalive_connections": HTTP_MAX_KEEPALIVE_CONNECTIONS,
+                "keepalive_expiry": HTTP_KEEPALIVE_EXPIRY,
+                "max_per_host": HTTP_MAX_PER_HOST,
+            },
+        }
+
+    async def aclose(self):
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+
+
+sefaz_http_client = SefazHttpClient()
+
+
+# --- Proteção do Portal da SEFAZ ---
+class TokenBucket:
+    """Limitador de taxa (token bucket): 'rate' requisições por segundo, com rajadas de até 'burst'."""
+
+    def __init__(self, rate: float, burst: int):
+        self.rate = rate
+        self.burst = max(burst, 1)
+        self._tokens = float(self.burst)
+        self._updated_at = time.monotonic()
+        self._lock = asyncio.Lock() # Quem chega primeiro é atendido primeiro
+        self.waits = 0
+        self.waited_seconds = 0.0
+
+    def _refill(self):
+        now = time.monotonic()
+        self._tokens = min(self.burst, self._tokens + (now - self._updated_at) * self.rate)
+        self._updated_at = now
+
+    async def acquire(self):
+        if self.rate <= 0:
+            return
+        async with self._lock:
+            self._refill()
+            if self._tokens < 1:
+                delay = (1 - self._tokens) / self.rate
+                self.waits += 1
+                self.waited_seconds += delay
+                await asyncio.sleep(delay)
+                self._refill()
+            self._tokens -= 1
+
+    def stats(self) -> dict:
+        return {"rate": self.rate, "burst": self.burst, "waits": self.waits,
+                "waited_seconds": round(self.waited_seconds, 3)}
+
+
+class CircuitBreaker:
+    """
+    Circuit breaker do portal: após 'failure_threshold' falhas seguidas o
+    circuito abre e as buscas falham na hora, sem ir à SEFAZ. Depois de
+    'reset_timeout' segundos uma única requisição de teste é liberada
+    (meio-aberto): sucesso fecha o circuito, falha o abre de novo.
+    """
+
+    def __init__(self, failure_threshold: int, reset_timeout: float):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.state = "closed"
+        self.failures = 0
+        self.opened_at = 0.0
+        self.times_opened = 0
+        self.rejected = 0
+        self._probe_in_flight = False
+        self._probe_started_at = 0.0
+
+    def retry_after(self) -> float:
+        """Segundos até o circuito aceitar uma requisição de teste."""
+        return max(0.0, self.opened_at + self.reset_timeout - time.monotonic())
+
+    def allow_request(self) -> bool:
+        if self.state == "open" and self.retry_after() <= 0:
+            self.state = "half_open"
+            self._probe_in_flight = False
+        if self.state == "closed":
+            return True
+        # Se o teste se perdeu (ex: requisição cancelada), libera outro após reset_timeout
+        probe_lost = time.monotonic() - self._probe_started_at > self.reset_timeout
+        if self.state == "half_open" and (not self._probe_in_flight or probe_lost):
+            self._probe_in_flight = True
+            self._probe_started_at = time.monotonic()
+            return True
+        self.rejected += 1
+        return False
+
+    def record_success(self):
+        if self.state != "closed":
+            logger.info("[Portal] Circuito fechado: o portal da SEFAZ voltou a responder.")
+        self.state = "closed"
+        self.failures = 0
+        self._probe_in_flight = False
+
+    def record_failure(self):
+        self.failures += 1
+        self._probe_in_flight = False
+        if self.state == "half_open" or (self.state == "closed" and self.failures >= self.failure_threshold):
+            self.state = "open"
+            self.opened_at = time.monotonic()
+            self.times_opened += 1
+            logger.warning("[Portal] Circuito aberto após %d falhas seguidas; novas buscas bloqueadas por %.0fs.",
+                           self.failures, self.reset_timeout)
+
+    def stats(self) -> dict:
+        return {"state": self.state, "consecutive_failures": self.failures, "times_opened": self.times_opened,
+                "rejected": self.rejected, "retry_after": round(self.retry_after(), 1) if self.state == "open" else 0}
+
+
+class SingleFlight:
+    """
+    Junta chamadas simultâneas com a mesma chave: a primeira (líder) executa,
+    as outras esperam o mesmo resultado (ou a mesma exceção).
+    """
+
+    def __init__(self):
+        self._flights: Dict[str, asyncio.Future] = {}
+        self.leaders = 0
+        self.shared = 0
+
+    def _finished(self, key: str, future: asyncio.Future):
+        self._flights.pop(key, None)
+        if not future.cancelled():
+            future.exception() # Marca a exceção como lida, mesmo se ninguém mais esperar
+
+    async def do(self, key: str, factory: Callable[[], Awaitable]) -> Tuple[object, bool]:
+        """Retorna (resultado, True se esta chamada foi a líder)."""
+        future = self._flights.get(key)
+        if future is not None:
+            self.shared += 1
+            return await asyncio.shield(future), False
+        future = asyncio.ensure_future(factory())
+        self._flights[key] = future
+        future.add_done_callback(lambda done: self._finished(key, done))
+        self.leaders += 1
+        # shield: se o cliente do líder desconectar, a busca continua para os demais
+        return await asyncio.shield(future), True
+
+    def stats(self) -> dict:
+        return {"in_flight": len(self._flights), "leaders": self.leaders, "shared": self.shared}
+
+
+portal_rate_limiter = TokenBucket(SEFAZ_RATE_LIMIT, SEFAZ_RATE_BURST)
+portal_circuit = CircuitBreaker(SEFAZ_CIRCUIT_FAILURES, SEFAZ_CIRCUIT_RESET)
+invoice_flights = SingleFlight()
+PORTAL_CIRCUIT_OPEN = Gauge("invoice_api_sefaz_circuit_open", "1 se o circuito do portal da SEFAZ está aberto")
+PORTAL_CIRCUIT_OPEN.set_function(lambda: 1 if portal_circuit.state == "open" else 0)
+
+RETRYABLE_STATUS_CODES = {429, 500, 502, 503, 504}
+
+def backoff_delay(attempt: int, retry_after: Optional[str] = None) -> float:
+    """Espera antes da nova tentativa: Retry-After do portal ou backoff exponencial com jitter."""
+    if retry_after and retry_after.isdigit():
+        return min(float(retry_after), SEFAZ_BACKOFF_MAX)
+    return random.uniform(0, min(SEFAZ_BACKOFF_MAX, SEFAZ_BACKOFF_BASE * 2 ** attempt))
+
+async def fetch_sefaz_page(qr_code_parameter: str) -> str:
+    """
+    Busca o HTML da NFC-e no portal da SEFAZ, convertendo falhas em HTTPException.
+    Respeita o limite de taxa, tenta de novo erros transitórios (timeout, conexão,
+    429 e 5xx) com backoff exponencial e falha na hora com o circuito aberto.
+    """
+    target_url = f"{SEFAZ_QRCODE_URL}?p={qr_code_parameter}"
+    if not portal_circuit.allow_request():
+        retry_after = max(1, round(portal_circuit.retry_after()))
+        raise HTTPException(status_code=503, headers={"Retry-After": str(retry_after)},
+                            detail=f"Portal da SEFAZ indisponível no momento. Tente novamente em {retry_after}s.")
+
+    attempt = 0
+    while True:
+        await portal_rate_limiter.acquire()
+        logger.info("Buscando dados de: %s", target_url)
+        retry_after = None
+        try:
+            with STAGE_SECONDS.labels("fetch").time():
+                html_content = await sefaz_http_client.fetch_text(target_url)
+            portal_circuit.record_success()
+            return html_content
+        except httpx.HTTPStatusError as e:
+            if e.response.status_code not in RETRYABLE_STATUS_CODES:
+                portal_circuit.record_success() # O portal respondeu; o erro é da requisição
+                logger.warning("Erro ao buscar URL: %s", e)
+                raise HTTPException(status_code=503, detail=f"Erro ao acessar o portal da SEFAZ: {e}")
+            retry_after = e.response.headers.get("Retry-After")
+            error = e
+        except httpx.HTTPError as e: # Timeout ou falha de conexão
+            error = e
+
+        if attempt < SEFAZ_MAX_RETRIES:
+            delay = backoff_delay(attempt, retry_after)
+            attempt += 1
+            logger.warning("Erro transitório no portal (%s). Tentativa %d/%d em %.2fs.",
+                           error, attempt, SEFAZ_MAX_RETRIES, delay)
+            await asyncio.sleep(delay)
+            continue
+
+        portal_circuit.record_failure()
+        if isinstance(error, httpx.TimeoutException):
+            raise HTTPException(status_code=408, detail="Tempo limite excedido ao buscar a URL da SEFAZ.")
+        logger.warning("Erro ao buscar URL: %s", error)
+        raise HTTPException(status_code=503, detail=f"Erro ao acessar o portal da SEFAZ: {error}")
 
 
 # --- Funções Auxiliares de Limpeza/Conversão ---
@@ -84,14 +615,34 @@ def safe_strip(value: Optional[str]) -> Optional[str]:
     """Remove espaços em branco das bordas se a string não for None."""
     return value.strip() if value else None
 
-def parse_decimal_universal(value: Optional[str]) -> Optional[Decimal]:
+# Formatos fixos da SEFAZ: números "10", "1,2340", "1.234,56" e datas "dd/mm/aaaa hh:mm:ss"
+SEFAZ_THOUSANDS_PATTERN = re.compile(r'\d{1,3}(?:\.\d{3})+', re.ASCII)
+SEFAZ_DATETIME_PATTERN = re.compile(r'(\d{2})/(\d{2})/(\d{4})(?:\s+(\d{2}):(\d{2}):(\d{2}))?', re.ASCII)
+
+def parse_sefaz_decimal(value: str) -> Optional[Decimal]:
     """
-    Converte string numérica (possivelmente com . ou ,) para Decimal.
-    Tenta lidar com milhares e separadores decimais de forma mais robusta.
+    Caminho rápido para os números no formato da SEFAZ (vírgula decimal, ponto
+    de milhar só junto com vírgula). Retorna None se o texto não estiver nesse
+    formato; o chamador então usa parse_decimal_generic.
     """
-    if not value:
+    integer, comma, fraction = value.partition(',')
+    if '.' in integer:
+        if not comma or not SEFAZ_THOUSANDS_PATTERN.fullmatch(integer):
+            return None
+        integer = integer.replace('.', '')
+    if not (integer.isascii() and integer.isdigit()):
         return None
+    if comma:
+        if not (fraction.isascii() and fraction.isdigit()):
+            return None
+        return Decimal(f"{integer}.{fraction}")
+    return Decimal(integer)
 
+def parse_decimal_generic(value: str) -> Optional[Decimal]:
+    """
+    Converte string numérica (possivelmente com . ou ,) para Decimal.
+    Tenta lidar com milhares e separadores decimais de forma mais robusta.
+    """
     cleaned_value = value.strip()
     # Remover caracteres não numéricos exceto ponto e vírgula
     cleaned_value = re.sub(r'[^\d,\.]', '', cleaned_value)
@@ -130,19 +681,79 @@ def parse_decimal_universal(value: Optional[str]) -> Optional[Decimal]:
         return Decimal(cleaned_value)
 
     except (InvalidOperation, TypeError, ValueError) as e:
-        print(f"Aviso: Falha ao converter '{value}' para Decimal. Limpo: '{cleaned_value}'. Erro: {e}")
+        logger.warning("Falha ao converter '%s' para Decimal. Limpo: '%s'. Erro: %s", value, cleaned_value, e)
         return None
-    
-def parse_datetime_flexible(value: Optional[str]) -> Optional[datetime]:
-    """Converte string de data/hora para datetime usando dateutil."""
+
+def parse_decimal_universal(value: Optional[str]) -> Optional[Decimal]:
+    """Converte para Decimal: formato da SEFAZ pelo caminho rápido, o resto pelo parser genérico."""
+    if isinstance(value, Decimal):
+        return value # Já convertido (ex: documento lido do MongoDB)
+    if isinstance(value, Decimal128):
+        return value.to_decimal() # Documento lido sem as codec_options
     if not value:
         return None
+    fast_value = parse_sefaz_decimal(value.strip())
+    if fast_value is not None:
+        return fast_value
+    return parse_decimal_generic(value)
+
+def parse_sefaz_datetime(value: str) -> Optional[datetime]:
+    """Caminho rápido para 'dd/mm/aaaa hh:mm:ss' (ou só a data). Retorna None fora desse formato."""
+    match = SEFAZ_DATETIME_PATTERN.fullmatch(value)
+    if not match:
+        return None
+    day, month, year, hour, minute, second = match.groups()
+    try:
+        if hour is None:
+            return datetime(int(year), int(month), int(day))
+        return datetime(int(year), int(month), int(day), int(hour), int(minute), int(second))
+    except ValueError:
+        return None # Data impossível (ex: 31/02): o parser genérico decide e registra o aviso
+
+def parse_datetime_generic(value: str) -> Optional[datetime]:
+    """Converte string de data/hora para datetime usando dateutil."""
     try:
         # dayfirst=True ajuda a interpretar formatos como DD/MM/YYYY
         return date_parser.parse(value, dayfirst=True)
-    except (ValueError, TypeError) as e:
-        print(f"Aviso: Falha ao converter '{value}' para datetime. Erro: {e}")
+    except (ValueError, TypeError, OverflowError) as e:
+        logger.warning("Falha ao converter '%s' para datetime. Erro: %s", value, e)
+        return None
+
+def parse_datetime_flexible(value: Optional[str]) -> Optional[datetime]:
+    """Converte para datetime: formato da SEFAZ pelo caminho rápido, o resto via dateutil."""
+    if isinstance(value, datetime):
+        return value # Já convertido (ex: documento lido do MongoDB)
+    if not value:
         return None
+    fast_value = parse_sefaz_datetime(value.strip())
+    if fast_value is not None:
+        return fast_value
+    return parse_datetime_generic(value)
+
+ACCESS_KEY_LENGTH = 44
+
+def normalize_access_key(value: Optional[str]) -> Optional[str]:
+    """Mantém apenas os dígitos da chave de acesso. Retorna None se não tiver 44 dígitos."""
+    if not value:
+        return None
+    digits = re.sub(r'\D', '', value)
+    return digits if len(digits) == ACCESS_KEY_LENGTH else None
+
+def normalize_market_name(value: Optional[str]) -> Optional[str]:
+    """
+    Nome do mercado para busca: sem acentos, em maiúsculas e com espaços simples.
+    O portal só mostra o nome em maiúsculas via CSS; o texto gravado vem como está.
+    O invoice_lister aplica a mesma normalização ao filtro.
+    """
+    if not value:
+        return None
+    decomposed = unicodedata.normalize("NFKD", value)
+    name = "".join(char for char in decomposed if not unicodedata.combining(char))
+    return " ".join(name.upper().split()) or None
+
+def access_key_from_qr(qr_code_parameter: str) -> Optional[str]:
+    """Extrai a chave de acesso normalizada (só dígitos) do parâmetro do QR Code."""
+    return normalize_access_key(qr_code_parameter.split('|')[0]) if qr_code_parameter else None
 
 UniversalDecimalValidator = BeforeValidator(parse_decimal_universal) # Novo nome
 CleanStringValidator = BeforeValidator(safe_strip)
@@ -180,449 +791,984 @@ class Invoice(BaseModel):
         extra='ignore'
     )
 
+
+class BatchRequest(BaseModel):
+    qr_code_parameters: List[str] = Field(..., min_length=1)
+    include_invoices: bool = False # Se True, devolve a nota completa em cada item
+
+
+class BatchItemResult(BaseModel):
+    qr_code_parameter: str
+    status: str # 'inserted', 'queued', 'exists', 'duplicate', 'parsed' ou 'error'
+    access_key: Optional[str] = None
+    detail: Optional[str] = None
+    invoice: Optional[Invoice] = None
+
+
+class BatchResponse(BaseModel):
+    total: int
+    inserted: int
+    existing: int
+    errors: int
+    results: List[BatchItemResult]
+
+# --- Resposta JSON Rápida ---
+def json_default(value):
+    """Tipos que o serializador JSON não conhece: Decimal vira string, modelos viram dict (com aliases)."""
+    if isinstance(value, Decimal):
+        return str(value)
+    if isinstance(value, BaseModel):
+        return value.model_dump(by_alias=True)
+    raise TypeError(f"Tipo não serializável em JSON: {type(value).__name__}")
+
+class FastJSONResponse(JSONResponse):
+    """
+    Resposta JSON sem o jsonable_encoder do FastAPI. Modelos Pydantic são
+    serializados direto pelo pydantic-core (model_dump_json, mesma saída do
+    response_model); o resto vai pelo orjson (ou json, se não instalado).
+    Os endpoints devolvem esta resposta diretamente, o que também evita a
+    revalidação pelo response_model.
+    """
+
+    def __init__(self, content, exclude_none: bool = False, **kwargs):
+        self.exclude_none = exclude_none
+        super().__init__(content, **kwargs)
+
+    def render(self, content) -> bytes:
+        if isinstance(content, BaseModel):
+            return content.model_dump_json(by_alias=True, exclude_none=self.exclude_none).encode("utf-8")
+        if orjson is not None:
+            return orjson.dumps(content, default=json_default)
+        return json.dumps(content, default=json_default, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+
 # --- Lógica de Scraping ---
 
+# Padrões pré-compilados usados na extração do cabeçalho
+DATE_PATTERN = re.compile(r'\d{2}/\d{2}/\d{4}\s+\d{2}:\d{2}:\d{2}')
+DATE_LABEL_PATTERN = re.compile(r'Data de Emissão', re.IGNORECASE)
+TOTAL_LABEL_PATTERN = re.compile(r'Valor\s+total\s+R?\$\s*:?', re.IGNORECASE)
+DATE_LABEL_TAGS = {'div', 'td', 'span'} # Tags onde os rótulos podem aparecer (linhas de item usam <td>)
+TOTAL_LABEL_TAGS = {'strong', 'label', 'span', 'div'}
+NUMBER_PATTERN = re.compile(r'\d[\d.,]*')
+INTEGER_PATTERN = re.compile(r'^\d+$')
+FORMATTED_KEY_PATTERN = re.compile(r'\d[\d./-]{40,}')
+KEY_SEPARATOR_PATTERN = re.compile(r'[-/.]')
+NON_DIGIT_PATTERN = re.compile(r'\D')
+
+def extract_header_fields(soup: BeautifulSoup) -> dict:
+    """
+    Extrai nome do mercado, data, valor total, quantidade de itens e chave de
+    acesso formatada percorrendo o documento uma única vez.
+
+    - Nome do mercado: <th class="text-center text-uppercase"><h4><b>.
+    - Data: primeira data após o rótulo 'Data de Emissão' em div/td/span
+      (ou a primeira data da página).
+    - Valor total: primeiro número após o rótulo 'Valor total R$' em
+      strong/label/span/div.
+    - Quantidade de itens: inteiro no primeiro <div class="col-lg-2">.
+    - Chave de acesso: primeiro texto com 44 dígitos separados por '.', '/' ou '-'.
+    """
+    fields = {
+        "market_name": None,
+        "invoice_date": None,
+        "total_invoice": None,
+        "quantity_total_items": None,
+        "access_key": None,
+    }
+    first_date = None
+    after_date_label = False
+    after_total_label = False
+    quantity_div_seen = False
+
+    for node in soup.descendants:
+        if isinstance(node, Tag):
+            if node.name == 'th' and fields["market_name"] is None:
+                classes = node.get('class') or []
+                if 'text-center' in classes and 'text-uppercase' in classes:
+                    h4 = node.find('h4')
+                    bold = h4.find('b') if h4 else None
+                    if bold:
+                        fields["market_name"] = bold.get_text(strip=True)
+            elif node.name == 'div' and not quantity_div_seen and 'col-lg-2' in (node.get('class') or []):
+                quantity_div_seen = True # Só o primeiro div 'col-lg-2' contém a quantidade
+                strong = node.find('strong')
+                raw_text = (strong or node).get_text(strip=True)
+                if INTEGER_PATTERN.match(raw_text):
+                    fields["quantity_total_items"] = raw_text
+            continue
+
+        if not isinstance(node, NavigableString) or isinstance(node, Comment):
+            continue
+        text = str(node)
+
+        if fields["invoice_date"] is None:
+            if not after_date_label and node.parent.name in DATE_LABEL_TAGS and DATE_LABEL_PATTERN.search(text):
+                after_date_label = True
+            if after_date_label or first_date is None:
+                match = DATE_PATTERN.search(text)
+                if match:
+                    if after_date_label:
+                        fields["invoice_date"] = match.group(0)
+                    elif first_date is None:
+                        first_date = match.group(0)
+
+        if fields["total_invoice"] is None:
+            search_from = 0
+            if not after_total_label and node.parent.name in TOTAL_LABEL_TAGS:
+                label_match = TOTAL_LABEL_PATTERN.search(text)
+                if label_match:
+                    after_total_label = True
+                    search_from = label_match.end()
+            if after_total_label:
+                match = NUMBER_PATTERN.search(text, search_from)
+                if match:
+                    fields["total_invoice"] = match.group(0)
+
+        if fields["access_key"] is None and len(text) >= 44:
+            match = FORMATTED_KEY_PATTERN.search(text)
+            if match:
+                candidate = match.group(0).strip()
+                if KEY_SEPARATOR_PATTERN.search(candidate) and len(NON_DIGIT_PATTERN.sub('', candidate)) == 44:
+                    fields["access_key"] = candidate
+
+    if fields["invoice_date"] is None:
+        fields["invoice_date"] = first_date
+    return fields
+
+
+ITEM_DESCRIPTION_PATTERN = re.compile(r'(.*?)\s+\(Código:\s*(\d+)\)', re.IGNORECASE | re.DOTALL)
+ITEM_QUANTITY_PATTERN = re.compile(r':\s*([\d.,]+)')
+ITEM_QUANTITY_FALLBACK_PATTERN = re.compile(r'([\d.,]+)')
+ITEM_UNIT_PATTERN = re.compile(r'UN\.?:\s*(\w+)', re.IGNORECASE)
+ITEM_VALUE_PATTERN = re.compile(r'(?:Valor|Vl)\.?\s*(?:total)?\s*R?\$?\s*:\s*R?\$?\s*([\d.,]+)', re.IGNORECASE)
+
+def build_item_from_columns(col0_text: str, col1_text: str, col2_text: str, col3_text: str, row_number: int) -> Optional[ItemInvoice]:
+    """
+    Monta o ItemInvoice a partir dos textos das 4 colunas de uma linha da tabela
+    de itens. Comum a todos os backends de parser; retorna None se faltarem dados.
+    """
+    # Coluna 0: Descrição e Código
+    desc_match = ITEM_DESCRIPTION_PATTERN.search(col0_text)
+    description = desc_match.group(1).strip() if desc_match else col0_text # Fallback se regex falhar
+    code = desc_match.group(2).strip() if desc_match else None
+
+    # Coluna 1: Quantidade (': ' seguido do número; se não houver ':', só o número)
+    quantity_match = ITEM_QUANTITY_PATTERN.search(col1_text) or ITEM_QUANTITY_FALLBACK_PATTERN.search(col1_text)
+    quantity_str = quantity_match.group(1) if quantity_match else None
+
+    # Coluna 2: Unidade
+    unit_match = ITEM_UNIT_PATTERN.search(col2_text)
+    unit = unit_match.group(1).strip() if unit_match else None
+
+    # Coluna 3: Valor Total do Item ("Valor total R$:", "Vl. Total", etc.)
+    value_match = ITEM_VALUE_PATTERN.search(col3_text)
+    value_str = value_match.group(1) if value_match else None
+
+    # Verifica se conseguimos extrair pelo menos descrição ou código E quantidade E valor
+    if (description or code) and quantity_str and value_str:
+        # Construção confiável: converte com as mesmas funções dos validadores e
+        # monta o modelo sem revalidar
+        return ItemInvoice.model_construct(
+            code=safe_strip(code),
+            description=safe_strip(description),
+            quantity=parse_decimal_universal(quantity_str),
+            unit=safe_strip(unit),
+            value=parse_decimal_universal(value_str),
+        )
+
+    logger.warning("[Linha %d] Dados essenciais não extraídos. Item ignorado. Desc/Code: %s/%s, Qtde: %s, Valor: %s, Unit: %s",
+                   row_number, description, code, quantity_str, value_str, unit)
+    return None
+
 def extract_items_from_html(soup: BeautifulSoup) -> List[ItemInvoice]:
-    """Extrai os itens da nota fiscal da tabela no HTML."""
+    """Extrai os itens da nota fiscal da tabela no HTML (backend BeautifulSoup)."""
     items = []
     table_body = soup.find('tbody', id='myTable')
     if not table_body:
-        print("Aviso: Tabela de itens <tbody id='myTable'> não encontrada.")
+        logger.warning("Tabela de itens <tbody id='myTable'> não encontrada.")
         return items
 
     rows = table_body.find_all('tr')
-    print(f"DEBUG: Encontradas {len(rows)} linhas na tabela de itens.") # DEBUG
+    logger.debug("Encontradas %d linhas na tabela de itens.", len(rows))
     for i, row in enumerate(rows): # Adiciona índice para debug
         columns = row.find_all('td')
-        print(f"\nDEBUG: Processando linha {i+1}, Colunas: {len(columns)}") # DEBUG
         if len(columns) >= 4:
             try:
-                col0_text = columns[0].get_text(separator=' ', strip=True)
-                # Regex para Descrição e Código (ajustada ligeiramente para robustez)
-                desc_match = re.search(r'(.*?)\s+\(Código:\s*(\d+)\)', col0_text, re.IGNORECASE | re.DOTALL)
-                description = desc_match.group(1).strip() if desc_match else col0_text # Fallback se regex falhar
-                code = desc_match.group(2).strip() if desc_match else None
-                print(f"DEBUG [Linha {i+1}] Descrição: '{description}', Código: '{code}'")
-
-                # Coluna 1: Quantidade - Regex mais robusta
-                col1_text = columns[1].get_text(strip=True)
-                print(f"DEBUG [Linha {i+1}] Texto Coluna Qtde: '{col1_text}'") # DEBUG
-                # Tenta encontrar ': ' seguido por um número (com . ou ,)
-                quantity_match = re.search(r':\s*([\d.,]+)', col1_text) # <-- Regex CORRIGIDA
-                quantity_str = quantity_match.group(1) if quantity_match else None
-                # Se falhar, tenta pegar só o número (caso não tenha ':')
-                if quantity_str is None:
-                    quantity_match_fallback = re.search(r'([\d.,]+)', col1_text)
-                    quantity_str = quantity_match_fallback.group(1) if quantity_match_fallback else None
-                    print(f"DEBUG [Linha {i+1}] Fallback Qtde String: '{quantity_str}'") # Debug Fallback
-                print(f"DEBUG [Linha {i+1}] String Qtde extraída: '{quantity_str}'") # DEBUG
-
-                # Coluna 2: Unidade
-                col2_text = columns[2].get_text(strip=True)
-                # Regex para Unidade (parece ok, mas descomentar)
-                unit_match = re.search(r'UN\.?:\s*(\w+)', col2_text, re.IGNORECASE)
-                unit = unit_match.group(1).strip() if unit_match else None
-                print(f"DEBUG [Linha {i+1}] Unidade extraída: '{unit}'")
-
-                # Coluna 3: Valor Total do Item
-                col3_text = columns[3].get_text(strip=True)
-                print(f"DEBUG [Linha {i+1}] Texto Coluna Valor: '{col3_text}'") # DEBUG
-                # Procura por "Valor total R$:" ou "Vl. Total" etc, seguido pelo número
-                value_match = re.search(r'(?:Valor|Vl)\.?\s*(?:total)?\s*R?\$?\s*:\s*R?\$?\s*([\d.,]+)', col3_text, re.IGNORECASE) # <-- Regex Corrigida (mais flexível com texto e :)
-                value_str = value_match.group(1) if value_match else None
-                print(f"DEBUG [Linha {i+1}] String Valor extraída: '{value_str}'") # DEBUG
-
-                # Verifica se conseguimos extrair pelo menos descrição ou código E quantidade E valor
-                if (description or code) and quantity_str and value_str:
-                     # Certifica que code, description, unit não são usados antes de serem definidos
-                    item = ItemInvoice(
-                        code=code,             # Garanta que 'code' foi definido acima
-                        description=description, # Garanta que 'description' foi definido acima
-                        quantity=quantity_str,
-                        unit=unit,             # Garanta que 'unit' foi definido acima
-                        value=value_str
-                    )
-                    print(f"DEBUG [Linha {i+1}] Item Pydantic criado: {item.model_dump()}") # DEBUG
+                item = build_item_from_columns(
+                    columns[0].get_text(separator=' ', strip=True),
+                    columns[1].get_text(strip=True),
+                    columns[2].get_text(strip=True),
+                    columns[3].get_text(strip=True),
+                    i + 1,
+                )
+                if item is not None:
                     items.append(item)
-                else:
-                    print(f"AVISO [Linha {i+1}]: Dados essenciais não extraídos. Item ignorado.")
-                    print(f"  -> Desc/Code: {description if 'description' in locals() else 'N/D'}/{code if 'code' in locals() else 'N/D'}, Qtde Str: {quantity_str}, Valor Str: {value_str}, Unit: {unit if 'unit' in locals() else 'N/D'}")
-
-
-            except (AttributeError, IndexError, Exception) as e:
-                # Não usar 'code' aqui pois pode não ter sido definido se o erro ocorreu antes
-                print(f"Erro CRÍTICO ao processar linha de item {i+1}: {row.get_text(strip=True)} | Erro: {e}")
-                # Considerar logar o traceback completo para depuração mais profunda
-                # import traceback
-                # print(traceback.format_exc())
+            except Exception as e:
+                logger.error("Erro ao processar linha de item %d: %s | Erro: %s", i + 1, row.get_text(strip=True), e)
                 continue # Continua para a próxima linha
 
-    print(f"DEBUG: Final da extração. Total de itens adicionados: {len(items)}") # DEBUG
+    logger.debug("Final da extração. Total de itens adicionados: %d", len(items))
     return items
 
-# --- Função para Salvar no MongoDB ---
-async def save_invoice_to_db(invoice: Invoice):
-    """Salva a nota fiscal no MongoDB se não existir pela chave de acesso."""
-    if invoices_collection is None:
-        print("Aviso: Conexão com MongoDB não está disponível. Não foi possível salvar a nota.")
-        return
+_LXML_ITEMS_TABLE = lxml_etree.XPath('//tbody[@id="myTable"]') if lxml_etree is not None else None
 
-    # Garante que temos o objeto Pydantic e a chave de acesso (que é o atributo python)
-    if not invoice or not invoice.access_key:
-        print("AVISO [DB]: Nota fiscal inválida ou sem chave de acesso (atributo python). Não será salva.")
-        return
+def _lxml_text(element, separator: str = '') -> str:
+    """Equivalente ao get_text(separator, strip=True) do BeautifulSoup para um elemento lxml."""
+    return separator.join([stripped for stripped in (text.strip() for text in element.itertext()) if stripped])
+
+def extract_items_with_lxml(html_content: str) -> List[ItemInvoice]:
+    """Extrai os itens da nota fiscal usando lxml/XPath diretamente (backend rápido)."""
+    items = []
+    # Parser HTML "cru" do lxml (sem as classes de lxml.html, bem mais leve)
+    tree = lxml_etree.fromstring(html_content, lxml_etree.HTMLParser())
+    table_bodies = _LXML_ITEMS_TABLE(tree)
+    if not table_bodies:
+        logger.warning("Tabela de itens <tbody id='myTable'> não encontrada.")
+        return items
 
-    access_key_value = invoice.access_key # Pega o valor da chave do objeto pydantic
-    db_field_name = "AccessKey" # Usa o nome do campo como está no MongoDB (o Alias)
+    rows = list(table_bodies[0].iter('tr'))
+    logger.debug("Encontradas %d linhas na tabela de itens.", len(rows))
+    for i, row in enumerate(rows):
+        columns = list(row.iter('td'))
+        if len(columns) >= 4:
+            try:
+                item = build_item_from_columns(
+                    _lxml_text(columns[0], ' '),
+                    _lxml_text(columns[1]),
+                    _lxml_text(columns[2]),
+                    _lxml_text(columns[3]),
+                    i + 1,
+                )
+                if item is not None:
+                    items.append(item)
+            except Exception as e:
+                logger.error("Erro ao processar linha de item %d: %s | Erro: %s", i + 1, _lxml_text(row), e)
+                continue
 
-    try:
-        # 1. Verifica se a nota já existe usando a chave de acesso
-        print(f"DEBUG [DB]: Verificando existência da chave: {invoice.access_key}") # Log adicional
-        #existing_invoice = invoices_collection.find_one({"access_key": invoice.access_key})
-        existing_invoice = invoices_collection.find_one({db_field_name: access_key_value})
-
-        # 2. Se NÃO existir (find_one retorna None), insere
-        if existing_invoice is None:
-            print(f"DEBUG [DB]: Chave {invoice.access_key} não encontrada. Preparando para inserir.") # Log adicional
-            # Converte o modelo Pydantic para dict ANTES de inserir
-            invoice_dict = invoice.model_dump(exclude_unset=True, by_alias=True) # exclude_unset é geralmente melhor que exclude_none
-            # Remove o campo 'id' se ele for None (o _id do Pydantic)
-            if 'id' in invoice_dict and invoice_dict['id'] is None:
-                 del invoice_dict['id'] # MongoDB gerará _id
-
-            print(f"DEBUG [DB]: Inserindo documento: {list(invoice_dict.keys())}") # Log chaves a inserir
-            result = invoices_collection.insert_one(invoice_dict)
-            print(f"SUCESSO [DB]: Nota fiscal {invoice.access_key} salva com ID: {result.inserted_id}")
-
-        # 3. Se JÁ existir, NÃO faz nada (apenas loga)
+    logger.debug("Final da extração. Total de itens adicionados: %d", len(items))
+    return items
+
+def extract_items(html_content: str, soup: Optional[BeautifulSoup] = None, backend: Optional[str] = None) -> List[ItemInvoice]:
+    """
+    Extrai os itens usando o backend configurado em ITEM_PARSER_BACKEND ('lxml' ou 'bs4').
+    O BeautifulSoup é o fallback se o lxml não estiver disponível ou falhar.
+    """
+    backend = backend or ITEM_PARSER_BACKEND
+    if backend == "lxml" and lxml_etree is not None:
+        try:
+            return extract_items_with_lxml(html_content)
+        except Exception as e:
+            logger.warning("Backend lxml falhou (%s). Usando BeautifulSoup.", e)
+    if soup is None:
+        soup = BeautifulSoup(html_content, 'lxml')
+    return extract_items_from_html(soup)
+
+def parse_invoice_html(html_content: str, qr_code_parameter: str) -> Invoice:
+    """
+    Extrai os dados da nota fiscal (cabeçalho e itens) do HTML da SEFAZ e
+    retorna o objeto Invoice validado. O parâmetro do QR Code é usado como
+    fallback/validação da chave de acesso.
+    """
+    # Parseia o HTML com BeautifulSoup
+    with STAGE_SECONDS.labels("html_parse").time():
+        soup = BeautifulSoup(html_content, 'lxml')
+
+    # --- Extração dos dados principais (uma única passagem pelo documento) ---
+    with STAGE_SECONDS.labels("header").time():
+        header = extract_header_fields(soup)
+    market_name = header["market_name"]
+    invoice_date_str = header["invoice_date"]
+    total_invoice_str = header["total_invoice"]
+    quantity_total_items_str = header["quantity_total_items"]
+    access_key = header["access_key"]
+    formatted_key_found_in_html = access_key is not None
+    logger.debug("Cabeçalho extraído: %s", header)
+
+    # --- Chave de Acesso: Fallback/Validação usando o parâmetro QR Code ---
+    key_from_param = None
+    digits_only_param = None
+    param_is_valid = False
+
+    if '|' in qr_code_parameter:
+        key_from_param = qr_code_parameter.split('|')[0]
+        digits_only_param = NON_DIGIT_PATTERN.sub('', key_from_param)
+        if len(digits_only_param) == 44:
+            param_is_valid = True
         else:
-            print(f"INFO [DB]: Nota fiscal com chave {invoice.access_key} já existe no banco de dados. Nenhuma ação realizada.")
+            logger.warning("Parâmetro QR não contém 44 dígitos após limpeza ('%s').", digits_only_param)
+    else:
+        logger.warning("Formato do qr_code_parameter inesperado: '%s'.", qr_code_parameter)
+
+    # Decisão final sobre qual chave usar:
+    if formatted_key_found_in_html:
+        # Já temos a chave formatada do HTML, usamos ela (validando com o parâmetro se possível)
+        if param_is_valid:
+            digits_from_html_key = NON_DIGIT_PATTERN.sub('', access_key)
+            if digits_from_html_key != digits_only_param:
+                logger.error("Dígitos da chave formatada HTML ('%s') DIFEREM dos dígitos do parâmetro ('%s')!", digits_from_html_key, digits_only_param)
+                # Por enquanto, mantemos a do HTML que encontramos, mas com o alerta.
+    elif param_is_valid:
+        # Não achamos no HTML, mas o parâmetro é válido. Usamos o valor do parâmetro.
+        access_key = key_from_param # Pode ter ou não formatação, dependendo do parâmetro
+        logger.info("Usando chave do parâmetro QR ('%s') pois a formatada não foi encontrada/validada no HTML.", access_key)
+    else:
+        # Falha total: Nem HTML nem parâmetro forneceram uma chave válida.
+        logger.error("Não foi possível determinar uma chave de acesso válida nem no HTML nem no parâmetro QR.")
+    # --- Fim da Extração da Chave de Acesso ---
 
-    except OperationFailure as e:
-        # Pode acontecer se houver violação de índice único (concorrência, SE o índice existe)
-        print(f"ERRO [DB]: Erro de operação no MongoDB ao processar {invoice.access_key}: {e}")
-        # Se o erro for de chave duplicada (E11000), a lógica funcionou mas houve concorrência
-        if "E11000 duplicate key error" in str(e):
-             print("INFO [DB]: Erro de chave duplicada indica que a nota foi inserida por outra requisição concorrente.")
-    except Exception as e:
-        print(f"ERRO [DB]: Erro inesperado ao salvar no MongoDB {invoice.access_key}: {e}")
-        import traceback
-        print(traceback.format_exc())
+    # Extração dos Itens da Nota (Chamando a outra função)
+    with STAGE_SECONDS.labels("items").time():
+        invoice_items = extract_items(html_content, soup)
+
+    # Cria o objeto Invoice. Os dados vêm do nosso próprio extrator: convertemos
+    # com as funções dos validadores e usamos model_construct, sem revalidar a
+    # nota e cada um dos itens (equivalente a Invoice(...), bem mais barato)
+    try:
+        with STAGE_SECONDS.labels("validation").time():
+            invoice = Invoice.model_construct(
+                market_name=safe_strip(market_name),
+                invoice_date=parse_datetime_flexible(invoice_date_str),
+                total_invoice=parse_decimal_universal(total_invoice_str),
+                # Tenta converter a string para int, ou None se falhar ou for None
+                quantity_total_items=int(quantity_total_items_str) if quantity_total_items_str else None,
+                access_key=safe_strip(access_key),
+                items=invoice_items # Lista já contém objetos ItemInvoice
+            )
     except Exception as e:
-        print(f"Erro inesperado ao salvar no MongoDB {invoice.access_key}: {e}")
-        # Considerar lançar uma exceção HTTP 500 aqui se o salvamento for crítico
-        # raise HTTPException(status_code=500, detail="Erro ao salvar a nota fiscal no banco de dados.")
+        logger.error("Erro ao criar o objeto Invoice Pydantic: %s", e)
+        # Importante lançar erro aqui, pois os dados podem estar inconsistentes
+        raise HTTPException(status_code=500, detail=f"Erro ao processar os dados extraídos para criar a nota: {e}")
 
+    return invoice
 
-# --- Inicialização do FastAPI ---
-app = FastAPI(
-    title="API de Scraping de Nota Fiscal",
-    description="Extrai dados de notas fiscais da SEFAZ MG a partir do parâmetro QR Code.",
-    version="1.0.0"
-)
+# --- Função para Salvar no MongoDB ---
+def invoice_to_document(invoice: Invoice) -> dict:
+    """Converte o modelo Pydantic no documento (dict com aliases) gravado no MongoDB."""
+    invoice_dict = invoice.model_dump(exclude_unset=True, by_alias=True) # exclude_unset é geralmente melhor que exclude_none
+    # Remove o campo '_id' se ele for None (MongoDB gerará o _id)
+    if '_id' in invoice_dict and invoice_dict['_id'] is None:
+        del invoice_dict['_id']
+    normalized_key = normalize_access_key(invoice.access_key)
+    if normalized_key:
+        invoice_dict[NORMALIZED_KEY_FIELD] = normalized_key
+    market_search = normalize_market_name(invoice.market_name)
+    if market_search:
+        invoice_dict[MARKET_SEARCH_FIELD] = market_search
+    invoice_dict[UPDATED_AT_FIELD] = datetime.now(timezone.utc)
+    return invoice_dict
 
-# --- Endpoint ---
-@app.get("/", response_model=Invoice) # Define o modelo de resposta
-async def index(qr_code_parameter: str):
+async def save_invoice_to_db(invoice: Invoice):
     """
-    Recebe o parâmetro 'p' do QR Code da NFC-e de MG, busca os dados na SEFAZ,
-    extrai as informações e as salva no MongoDB se for uma nota nova.
-    Retorna os dados extraídos da nota fiscal.
+    Salva a nota fiscal no MongoDB se ainda não existir, com um único upsert
+    atômico na chave normalizada ($setOnInsert não altera notas já gravadas).
     """
-    if not qr_code_parameter:
-        raise HTTPException(status_code=400, detail="Parâmetro 'qr_code_parameter' é obrigatório.")
+    if invoices_collection is None:
+        logger.warning("Conexão com MongoDB não está disponível. Não foi possível salvar a nota.")
+        return
 
-    # Constrói a URL alvo
-    target_url = f"https://portalsped.fazenda.mg.gov.br/portalnfce/sistema/qrcode.xhtml?p={qr_code_parameter}"
-    print(f"Buscando dados de: {target_url}")
+    normalized_key = normalize_access_key(invoice.access_key) if invoice else None
+    if not normalized_key:
+        logger.warning("[DB] Nota fiscal inválida ou sem chave de acesso de 44 dígitos. Não será salva.")
+        return
 
-    # Faz a requisição HTTP
     try:
-        headers = {'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36'}
-        response = requests.get(target_url, headers=headers, timeout=30)
-        response.raise_for_status()
-        html_content = response.text
-    except requests.exceptions.Timeout:
-        raise HTTPException(status_code=408, detail="Tempo limite excedido ao buscar a URL da SEFAZ.")
-    except requests.exceptions.RequestException as e:
-        print(f"Erro ao buscar URL: {e}")
-        raise HTTPException(status_code=503, detail=f"Erro ao acessar o portal da SEFAZ: {e}")
-
-    # Parseia o HTML com BeautifulSoup
-    soup = BeautifulSoup(html_content, 'lxml')
-    print("DEBUG: HTML parseado com BeautifulSoup.")
+        with STAGE_SECONDS.labels("mongo_write").time():
+            result = await invoices_collection.update_one(
+                {NORMALIZED_KEY_FIELD: normalized_key},
+                {"$setOnInsert": invoice_to_document(invoice)},
+                upsert=True
+            )
+        if result.upserted_id is not None:
+            logger.info("[DB] Nota fiscal %s salva com ID: %s", invoice.access_key, result.upserted_id)
+        else:
+            logger.info("[DB] Nota fiscal com chave %s já existe no banco de dados. Nenhuma ação realizada.", invoice.access_key)
+        remember_invoice(invoice)
+    except DuplicateKeyError:
+        # Dois upserts simultâneos da mesma chave: o outro venceu, a nota está gravada
+        logger.info("[DB] Nota %s inserida por outra requisição concorrente.", invoice.access_key)
+        remember_invoice(invoice)
+    except OperationFailure as e:
+        logger.error("[DB] Erro de operação no MongoDB ao processar %s: %s", invoice.access_key, e)
+    except Exception as e:
+        logger.exception("[DB] Erro inesperado ao salvar no MongoDB %s: %s", invoice.access_key, e)
 
-    # --- Extração dos dados principais ---
 
-    # Nome do Mercado
-    market_name = None
+async def save_invoices_bulk(invoices: List[Invoice]) -> Dict[str, str]:
+    """
+    Salva várias notas com um único bulk_write não ordenado de upserts na
+    chave normalizada. Retorna um dict chave de acesso -> status
+    ('inserted', 'exists' ou 'error').
+    """
+    statuses: Dict[str, str] = {}
+    if invoices_collection is None or not invoices:
+        return statuses
+
+    to_write = []
+    for invoice in invoices:
+        normalized_key = normalize_access_key(invoice.access_key)
+        if normalized_key:
+            to_write.append((invoice, normalized_key))
+        else:
+            statuses[invoice.access_key] = "error"
+    if not to_write:
+        return statuses
+
+    operations = [
+        UpdateOne({NORMALIZED_KEY_FIELD: key}, {"$setOnInsert": invoice_to_document(invoice)}, upsert=True)
+        for invoice, key in to_write
+    ]
+    failed = {}
+    upserted_indexes = set()
     try:
-        market_name_tag = soup.find('th', class_='text-center text-uppercase')
-        if market_name_tag and market_name_tag.find('h4') and market_name_tag.find('h4').find('b'):
-            market_name = market_name_tag.find('h4').find('b').get_text(strip=True)
+        with STAGE_SECONDS.labels("mongo_write").time():
+            result = await invoices_collection.bulk_write(operations, ordered=False)
+        upserted_indexes = set(result.upserted_ids)
+    except BulkWriteError as e:
+        failed = {error["index"]: error for error in e.details.get("writeErrors", [])}
+        upserted_indexes = {upserted["index"] for upserted in e.details.get("upserted", [])}
+        logger.warning("[DB] %d falhas no upsert em lote.", len(failed))
     except Exception as e:
-        print(f"DEBUG: Erro ao extrair Nome do Mercado: {e}")
-    print(f"DEBUG: Nome do Mercado extraído: '{market_name}'")
+        logger.exception("[DB] Erro inesperado ao salvar lote no MongoDB: %s", e)
+        failed = {index: {} for index in range(len(to_write))}
+
+    for index, (invoice, _) in enumerate(to_write):
+        error = failed.get(index)
+        if error is None or error.get("code") == 11000:
+            # Sem erro, ou chave duplicada por upsert concorrente: a nota está gravada
+            statuses[invoice.access_key] = "inserted" if index in upserted_indexes else "exists"
+            remember_invoice(invoice)
+        else:
+            statuses[invoice.access_key] = "error"
+    logger.info("[DB] Lote gravado, %d notas novas.", len(upserted_indexes))
+    return statuses
+
+
+# --- Cache de Notas já Armazenadas (consultado antes de ir à SEFAZ) ---
+class InvoiceLookupCache:
+    """Cache LRU em memória, com TTL, de notas já gravadas, indexado pela chave normalizada."""
+
+    def __init__(self, max_size: int, ttl: float):
+        self.max_size = max_size
+        self.ttl = ttl
+        self._entries: "OrderedDict[str, tuple]" = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key: str) -> Optional[Invoice]:
+        entry = self._entries.get(key)
+        if entry is None:
+            self.misses += 1
+            return None
+        expires_at, invoice = entry
+        if expires_at < time.monotonic():
+            del self._entries[key]
+            self.misses += 1
+            return None
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return invoice
 
-    # Data da Nota Fiscal
-    invoice_date_str = None
-    try:
-        date_pattern = re.compile(r'\d{2}/\d{2}/\d{4}\s+\d{2}:\d{2}:\d{2}')
-        possible_date_parents = soup.find_all(['div', 'td', 'span'], string=re.compile("Data de Emissão", re.IGNORECASE))
-        print(f"DEBUG: Encontrados {len(possible_date_parents)} elementos com 'Data de Emissão'.")
-        if possible_date_parents:
-            for parent in possible_date_parents:
-                container = parent.find_parent(['div', 'tr']) or parent # Busca em container maior
-                match = date_pattern.search(container.get_text(" ", strip=True))
-                if match:
-                    invoice_date_str = match.group(0)
-                    print(f"DEBUG: Data encontrada via label 'Data de Emissão': '{invoice_date_str}'")
-                    break
-        # Fallback: busca geral (menos confiável)
-        if not invoice_date_str:
-            print("DEBUG: Buscando data de emissão via fallback (procurando padrão em Tds)...")
-            all_text_nodes = soup.find_all(string=date_pattern) # Procura direto pelo padrão no texto
-            if all_text_nodes:
-                 invoice_date_str = all_text_nodes[0].strip()
-                 print(f"DEBUG: Data encontrada via fallback (texto direto): '{invoice_date_str}'")
-            else: # Fallback final em TDs
-                 for td in soup.find_all('td'):
-                    match = date_pattern.search(td.get_text(strip=True))
-                    if match:
-                        invoice_date_str = match.group(0)
-                        print(f"DEBUG: Data encontrada via fallback (busca em Td): '{invoice_date_str}'")
-                        break
-    except Exception as e:
-        print(f"DEBUG: Erro ao extrair Data da Nota: {e}")
-    print(f"DEBUG: String final extraída para invoice_date: '{invoice_date_str}'")
+    def put(self, key: str, invoice: Invoice):
+        if self.max_size <= 0:
+            return
+        self._entries[key] = (time.monotonic() + self.ttl, invoice)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
 
-    # Valor Total da Nota
-    total_invoice_str = None
-    try:
-        total_label = soup.find(['strong', 'label', 'span', 'div'], string=re.compile(r'Valor\s+total\s+R?\$\s*:?', re.IGNORECASE))
-        print(f"DEBUG: Label 'Valor total R$' encontrada: {total_label is not None}")
-        if total_label:
-            # Tenta encontrar o valor no próximo elemento relevante ou dentro do container
-            possible_containers = [total_label.find_next(['div', 'span', 'td', 'strong']), total_label.find_parent(['div', 'tr'])]
-            for container in possible_containers:
-                if container:
-                    strong_value = container.find('strong')
-                    target_text = strong_value.get_text(strip=True) if strong_value else container.get_text(strip=True)
-                    print(f"DEBUG: Tentando extrair valor total do texto: '{target_text}'")
-                    match = re.search(r'([\d.,]+)', target_text) # Regex simples para o número
-                    if match:
-                        total_invoice_str = match.group(1)
-                        print(f"DEBUG: Valor total encontrado: '{total_invoice_str}'")
-                        break # Para no primeiro sucesso
-            if not total_invoice_str:
-                 print("DEBUG: Não foi possível encontrar valor total próximo à label.")
-    except Exception as e:
-        print(f"DEBUG: Erro ao extrair Valor Total: {e}")
-    print(f"DEBUG: String final extraída para total_invoice: '{total_invoice_str}'")
+    def invalidate(self, key: str):
+        self._entries.pop(key, None)
 
-    # --- Quantidade Total de Itens (Baseado no HTML Fornecido) ---
-    quantity_total_items_str = None
-    try:
-        # 1. Encontra o <div> que contém o VALOR (baseado na classe do HTML)
-        #    Usamos uma regex para a classe por segurança contra espaços extras
-        value_div = soup.find('div', class_=re.compile(r'\bcol-lg-2\b')) # \b = word boundary
+    def stats(self) -> dict:
+        return {"size": len(self._entries), "max_size": self.max_size, "ttl": self.ttl,
+                "hits": self.hits, "misses": self.misses}
 
-        print(f"DEBUG: Div do valor (class col-lg-2) encontrado: {value_div is not None}")
 
-        if value_div:
-            # 2. Tenta encontrar a tag <strong> dentro deste div
-            value_strong = value_div.find('strong')
-            print(f"DEBUG: Strong tag dentro do div do valor encontrada: {value_strong is not None}")
+invoice_cache = InvoiceLookupCache(INVOICE_CACHE_SIZE, INVOICE_CACHE_TTL)
 
-            if value_strong:
-                # 3. Extrai o texto da tag <strong>
-                raw_text = value_strong.get_text(strip=True)
-                print(f"DEBUG: Texto cru da strong tag do valor: '{raw_text}'")
+def remember_invoice(invoice: Invoice):
+    """Coloca no cache uma nota que sabemos estar gravada no banco."""
+    key = normalize_access_key(invoice.access_key)
+    if key:
+        invoice_cache.put(key, invoice)
 
-                # 4. Valida e extrai apenas se for um número inteiro
-                match = re.search(r'^(\d+)$', raw_text)
-                if match:
-                    quantity_total_items_str = match.group(1)
-                else:
-                    print(f"DEBUG: Texto '{raw_text}' não parece ser um número inteiro.")
-            else:
-                 # Fallback: Se não houver <strong>, tenta pegar texto direto do div
-                 raw_text = value_div.get_text(strip=True)
-                 print(f"DEBUG: Texto cru do div do valor (fallback): '{raw_text}'")
-                 match = re.search(r'^(\d+)$', raw_text)
-                 if match:
-                      quantity_total_items_str = match.group(1)
-                 else:
-                      print(f"DEBUG: Texto '{raw_text}' (fallback div) não parece ser um número inteiro.")
+async def lookup_stored_invoices(keys: List[str]) -> Dict[str, Invoice]:
+    """
+    Procura notas já gravadas pelas chaves normalizadas: primeiro no cache em
+    memória, depois no MongoDB (uma única consulta para as chaves restantes).
+    """
+    found: Dict[str, Invoice] = {}
+    missing = []
+    for key in keys:
+        invoice = invoice_cache.get(key)
+        if invoice is not None:
+            found[key] = invoice
         else:
-            print("DEBUG: Não foi encontrado o div com a classe 'col-lg-2' esperada para o valor.")
-
-    except Exception as e:
-        print(f"DEBUG: Erro ao extrair Quantidade Total de Itens: {e}")
-        import traceback
-        print(traceback.format_exc()) # Imprime traceback completo para erros
+            missing.append(key)
+
+    if missing and invoices_collection is not None:
+        try:
+            async for doc in invoices_collection.find({NORMALIZED_KEY_FIELD: {"$in": missing}}):
+                doc["_id"] = str(doc["_id"])
+                invoice = Invoice.model_validate(doc)
+                key = normalize_access_key(invoice.access_key)
+                if key:
+                    found[key] = invoice
+                    invoice_cache.put(key, invoice)
+        except Exception as e:
+            logger.error("[Cache] Falha ao consultar notas existentes no MongoDB: %s", e)
+    return found
+
+async def lookup_stored_invoice(key: Optional[str]) -> Optional[Invoice]:
+    """Versão de lookup_stored_invoices para uma única chave."""
+    if not key:
+        return None
+    return (await lookup_stored_invoices([key])).get(key)
 
-    print(f"DEBUG: String final extraída para quantity_total_items: '{quantity_total_items_str}'")
-    # --- Fim da Extração de Quantidade Total ---
 
-    # --- Chave de Acesso (Prioritizando Formatação do HTML) ---
-    access_key = None
-    formatted_key_found_in_html = False # Flag para indicar se encontramos no HTML
+# --- Arquivo Local do HTML Bruto ---
+def archive_path(access_key: str) -> Path:
+    """Caminho do HTML arquivado: <dir>/<AAMM da chave>/<chave>.html.gz"""
+    return Path(HTML_ARCHIVE_DIR) / access_key[2:6] / f"{access_key}.html.gz"
 
+def archive_html(access_key: Optional[str], html_content: str) -> Optional[Path]:
+    """
+    Grava o HTML da nota compactado (gzip), endereçado pela chave normalizada.
+    A escrita é atômica (arquivo temporário + rename). Retorna o caminho ou None.
+    """
+    if not HTML_ARCHIVE_DIR or not access_key:
+        return None
+    path = archive_path(access_key)
     try:
-        print("DEBUG: Buscando chave de acesso FORMATADA no HTML PRIMEIRO...")
-
-        # Estratégia: Encontrar texto que contenha dígitos E hífens/barras/pontos
-        # É difícil ter uma regex perfeita sem ver mais HTML, então buscamos candidatos.
-        # Procuramos em tags comuns onde a chave formatada pode estar exibida.
-        potential_key_elements = soup.find_all(['span', 'td', 'div', 'strong', 'p'])
-        print(f"DEBUG: Verificando {len(potential_key_elements)} elementos candidatos para chave formatada.")
-
-        for element in potential_key_elements:
-            # Pega o texto original, respeitando espaços entre tags internas se houver
-            original_text = element.get_text(" ", strip=True)
-
-            # Heurística para identificar um candidato a chave formatada:
-            # - Contém dígitos?
-            # - Contém pelo menos um dos separadores comuns?
-            # - Tem um comprimento razoável (pelo menos 44 caracteres)?
-            if (re.search(r'\d', original_text) and
-                re.search(r'[-/\.]', original_text) and
-                len(original_text) >= 44):
-
-                print(f"DEBUG: Candidato a chave formatada encontrado no HTML: '{original_text}'")
-                # Validação: Remover não-dígitos e verificar se tem 44 dígitos
-                digits_only_html = re.sub(r'\D', '', original_text)
-                if len(digits_only_html) == 44:
-                    print(f"DEBUG: Candidato '{original_text}' contém 44 dígitos. Tentando extrair padrão formatado...")
-                    # Tenta extrair APENAS o padrão formatado (dígitos e separadores)
-                    # Regex busca por uma sequência que se pareça com a chave formatada
-                    # (Começa com dígito, contém dígitos/pontos/barras/hífens, e tem comprimento substancial)
-                    key_match = re.search(r'(\d[\d./-]{40,})', original_text) # Procura padrão começando com dígito, min ~40 chars
-                    if key_match:
-                        potential_key = key_match.group(1).strip()
-                        # Valida se *este* padrão extraído também limpa para 44 dígitos (segurança extra)
-                        if len(re.sub(r'\D', '', potential_key)) == 44:
-                            access_key = potential_key # Armazena SOMENTE o padrão encontrado
-                            formatted_key_found_in_html = True
-                            print(f"DEBUG: Chave formatada EXTRAÍDA e validada do HTML: '{access_key}'")
-                            break # Encontramos e extraímos, parar busca no HTML
-                        else:
-                             print(f"DEBUG: Padrão extraído '{potential_key}' não validou 44 dígitos. Tentando próximo elemento.")
-                    else:
-                        # Se a regex não pegou o padrão, talvez o prefixo seja o problema. Tentativa simples de remover:
-                        prefix = "Chave de acesso "
-                        if original_text.startswith(prefix):
-                            cleaned_key = original_text[len(prefix):].strip()
-                            # Revalida se o resto tem 44 dígitos
-                            if len(re.sub(r'\D', '', cleaned_key)) == 44:
-                                access_key = cleaned_key
-                                formatted_key_found_in_html = True
-                                print(f"DEBUG: Chave formatada encontrada no HTML (após remover prefixo): '{access_key}'")
-                                break
-                            else:
-                                 print(f"DEBUG: Texto após remover prefixo '{cleaned_key}' não validou 44 digitos.")
-                        else:
-                             print(f"DEBUG: Não foi possível extrair padrão formatado específico de '{original_text}'.")
-                else:
-                     print(f"DEBUG: Candidato '{original_text}' não contém 44 dígitos após limpeza ('{digits_only_html}'). Continuando busca...")
-        if not formatted_key_found_in_html:
-            print("DEBUG: Chave formatada não encontrada/validada no HTML.")
-
-        # ---------------------------------------------------------------------
-        # Fallback/Validação usando o parâmetro QR Code
-        # ---------------------------------------------------------------------
-        print("DEBUG: Verificando parâmetro QR Code para fallback ou validação...")
-        key_from_param = None
-        digits_only_param = None
-        param_is_valid = False
-
-        if '|' in qr_code_parameter:
-            key_from_param = qr_code_parameter.split('|')[0]
-            digits_only_param = re.sub(r'\D', '', key_from_param)
-            if len(digits_only_param) == 44:
-                param_is_valid = True
-                print(f"DEBUG: Parâmetro QR contém 44 dígitos ('{digits_only_param}'). Valor original: '{key_from_param}'")
-            else:
-                print(f"AVISO: Parâmetro QR não contém 44 dígitos após limpeza ('{digits_only_param}').")
+        path.parent.mkdir(parents=True, exist_ok=True)
+        temp_path = path.with_name(f"{path.name}.{os.getpid()}.tmp")
+        with gzip.open(temp_path, "wb", compresslevel=HTML_ARCHIVE_COMPRESSLEVEL) as archive_file:
+            archive_file.write(html_content.encode("utf-8"))
+        os.replace(temp_path, path)
+        return path
+    except OSError as e:
+        logger.warning("[Arquivo] Não foi possível arquivar o HTML da chave %s: %s", access_key, e)
+        return None
+
+def read_archived_html(path: Path) -> str:
+    """Lê um HTML arquivado por archive_html."""
+    with gzip.open(path, "rb") as archive_file:
+        return archive_file.read().decode("utf-8")
+
+# --- Extração fora do Event Loop (thread ou processo) ---
+parser_executor: Optional[Executor] = None
+
+def get_parser_executor() -> Executor:
+    """Cria (na primeira chamada) o pool de threads ou processos conforme PARSER_MODE."""
+    global parser_executor
+    if parser_executor is None:
+        if PARSER_MODE == "process":
+            parser_executor = ProcessPoolExecutor(
+                max_workers=PARSER_WORKERS,
+                mp_context=multiprocessing.get_context(PARSER_MP_START_METHOD)
+            )
         else:
-            print(f"AVISO: Formato do qr_code_parameter inesperado: '{qr_code_parameter}'.")
-
-        # Decisão final sobre qual chave usar:
-        if formatted_key_found_in_html:
-            # Já temos a chave formatada do HTML, usamos ela.
-            # Opcional: Validar cruzado com o parâmetro se ele for válido
-            if param_is_valid:
-                digits_from_html_key = re.sub(r'\D', '', access_key)
-                if digits_from_html_key != digits_only_param:
-                    print(f"ALERTA GRANDE: Dígitos da chave formatada HTML ('{digits_from_html_key}') DIFEREM dos dígitos do parâmetro ('{digits_only_param}')!")
-                    # Neste caso, talvez seja mais seguro usar a do parâmetro? Ou logar um erro grave?
-                    # Por enquanto, vamos manter a do HTML que encontramos, mas com o alerta.
-                    print(f"DEBUG: Mantendo a chave formatada do HTML encontrada: '{access_key}'")
-                else:
-                    print("DEBUG: Dígitos da chave HTML e parâmetro coincidem. Usando versão formatada do HTML.")
+            parser_executor = ThreadPoolExecutor(max_workers=PARSER_WORKERS, thread_name_prefix="parser")
+        logger.info("[Parser] Extração em modo '%s' com %d workers.", PARSER_MODE, PARSER_WORKERS)
+    return parser_executor
+
+def shutdown_parser_executor():
+    global parser_executor
+    if parser_executor is not None:
+        parser_executor.shutdown(wait=True, cancel_futures=True)
+        parser_executor = None
+
+def parse_invoice_to_data(html_content: str, qr_code_parameter: str) -> dict:
+    """
+    Executado no pool: extrai a nota e devolve só dados simples (dicts, str,
+    Decimal, datetime), baratos de serializar entre processos. As métricas por
+    etapa ficam no processo filho; o processo principal mede a etapa 'parse'.
+    """
+    invoice = parse_invoice_html(html_content, qr_code_parameter)
+    data = invoice.model_dump(include=invoice.model_fields_set - {"items"})
+    data["items"] = [item.model_dump() for item in invoice.items]
+    return data
+
+def invoice_from_data(data: dict) -> Invoice:
+    """Reconstrói o Invoice de parse_invoice_to_data sem revalidar (os dados vêm do nosso extrator)."""
+    items = [ItemInvoice.model_construct(**item) for item in data.pop("items")]
+    return Invoice.model_construct(**data, items=items)
+
+async def parse_invoice(html_content: str, qr_code_parameter: str) -> Invoice:
+    """Extrai a nota no event loop, em uma thread ou em um processo, conforme PARSER_MODE."""
+    with STAGE_SECONDS.labels("parse").time():
+        if PARSER_MODE not in ("thread", "process"):
+            return parse_invoice_html(html_content, qr_code_parameter)
+        loop = asyncio.get_running_loop()
+        data = await loop.run_in_executor(get_parser_executor(), parse_invoice_to_data, html_content, qr_code_parameter)
+        return invoice_from_data(data)
+
+async def fetch_and_parse(qr_code_parameter: str) -> Invoice:
+    """Busca a página da nota na SEFAZ, arquiva o HTML bruto e devolve o Invoice extraído."""
+    html_content = await fetch_sefaz_page(qr_code_parameter)
+    # Arquiva antes do parse: se o parser falhar ou mudar, a página pode ser reprocessada offline
+    await asyncio.to_thread(archive_html, access_key_from_qr(qr_code_parameter), html_content)
+    return await parse_invoice(html_content, qr_code_parameter)
+
+
+# --- Gravação Assíncrona (write-behind) ---
+class WriteBehindQueue:
+    """
+    Fila limitada de notas a gravar no MongoDB. A resposta ao cliente não espera
+    o banco: uma tarefa em segundo plano grava em lote quando junta
+    WRITE_BEHIND_BATCH_SIZE notas ou a cada WRITE_BEHIND_FLUSH_INTERVAL segundos.
+    Com a fila cheia, put() espera (backpressure). No desligamento, tudo é gravado.
+
+    Um lote só sai da fila depois de gravado: enquanto o MongoDB não conectou
+    (a conexão é aberta em segundo plano), o lote espera; notas com erro de
+    gravação são tentadas de novo até WRITE_BEHIND_MAX_RETRIES vezes. A nota só
+    entra no cache de consultas depois de gravada (save_invoices_bulk).
+    """
+
+    def __init__(self, max_size: int, batch_size: int, flush_interval: float,
+                 max_retries: int = WRITE_BEHIND_MAX_RETRIES, retry_delay: float = WRITE_BEHIND_RETRY_DELAY):
+        self.max_size = max_size
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.max_retries = max_retries
+        self.retry_delay = retry_delay
+        self._queue: Optional[asyncio.Queue] = None
+        self._task: Optional[asyncio.Task] = None
+        self._collecting: List[Invoice] = [] # Lote sendo montado (já fora da fila)
+        self._writing = 0 # Notas do lote em gravação (ou esperando nova tentativa)
+        self._stopping = False
+        self.written = 0 # Notas confirmadas no banco (inseridas ou já existentes)
+        self.failed = 0 # Notas descartadas após esgotar as tentativas (ou sem chave de acesso)
+        self.retries = 0
+        self.batches = 0
+
+    def start(self):
+        self._queue = asyncio.Queue(maxsize=self.max_size)
+        self._task = asyncio.create_task(self._run())
+        logger.info("[WriteBehind] Gravação assíncrona ativa (fila=%d, lote=%d, intervalo=%.1fs).",
+                    self.max_size, self.batch_size, self.flush_interval)
+
+    @property
+    def running(self) -> bool:
+        return self._task is not None and not self._task.done()
+
+    async def put(self, invoice: Invoice):
+        """Enfileira a nota; espera se a fila estiver cheia."""
+        await self._queue.put(invoice)
+
+    async def _next_batch(self) -> List[Invoice]:
+        """Junta notas até completar o lote, estourar o intervalo ou receber o sinal de parada (None)."""
+        batch = self._collecting = []
+        deadline = None
+        while len(batch) < self.batch_size:
+            if deadline is None:
+                item = await self._queue.get() # Lote vazio: espera sem limite
+                deadline = time.monotonic() + self.flush_interval
             else:
-                print("DEBUG: Usando chave formatada encontrada no HTML (parâmetro inválido ou ausente).")
+                timeout = deadline - time.monotonic()
+                if timeout <= 0:
+                    break
+                try:
+                    item = await asyncio.wait_for(self._queue.get(), timeout)
+                except asyncio.TimeoutError:
+                    break
+            if item is None:
+                self._queue.task_done() # Sinal de parada: grava o que já juntou
+                break
+            batch.append(item)
+        self._collecting = []
+        return batch
+
+    def _retry_wait(self, attempt: int) -> float:
+        return min(30.0, self.retry_delay * 2 ** attempt)
+
+    async def _write(self, batch: List[Invoice]):
+        if not batch:
+            return
+        pending = batch
+        attempt = 0
+        self._writing = len(batch)
+        try:
+            while pending:
+                if invoices_collection is None:
+                    # Banco ainda não conectado: o lote espera (no desligamento, com limite de tentativas)
+                    if self._stopping:
+                        attempt += 1
+                        if attempt > self.max_retries:
+                            break
+                    elif attempt == 0:
+                        logger.warning("[WriteBehind] MongoDB indisponível; %d notas aguardam a conexão.", len(pending))
+                        attempt = 1
+                    await mongo_connector.wait_connected(self._retry_wait(attempt))
+                    continue
+
+                try:
+                    statuses = await save_invoices_bulk(pending)
+                except Exception as e:
+                    logger.exception("[WriteBehind] Falha ao gravar lote de %d notas: %s", len(pending), e)
+                    statuses = {}
+                retry = []
+                for invoice in pending:
+                    status = statuses.get(invoice.access_key)
+                    if status in ("inserted", "exists"):
+                        self.written += 1
+                    elif not normalize_access_key(invoice.access_key):
+                        self.failed += 1 # Sem chave de 44 dígitos: nunca será gravada
+                        logger.warning("[WriteBehind] Nota sem chave de acesso válida descartada: %s", invoice.access_key)
+                    else:
+                        retry.append(invoice)
+                pending = retry
+                if pending:
+                    attempt += 1
+                    if attempt > self.max_retries:
+                        break
+                    self.retries += 1
+                    delay = self._retry_wait(attempt - 1)
+                    logger.warning("[WriteBehind] %d notas não gravadas; nova tentativa em %.1fs (%d/%d).",
+                                   len(pending), delay, attempt, self.max_retries)
+                    await asyncio.sleep(delay)
+            if pending:
+                self.failed += len(pending)
+                logger.error("[WriteBehind] %d notas descartadas sem gravar após %d tentativas: %s", len(pending),
+                             attempt, ", ".join(invoice.access_key or "?" for invoice in pending))
+            self.batches += 1
+        finally:
+            self._writing = 0
+            for _ in batch:
+                self._queue.task_done()
+
+    async def _run(self):
+        while True:
+            batch = await self._next_batch()
+            await self._write(batch)
+
+    async def stop(self):
+        """Espera a fila ser gravada por completo e só então para a tarefa de fundo."""
+        if self._task is None:
+            return
+        pending = self.stats()["queued"]
+        self._stopping = True # Sem banco, o desligamento não espera indefinidamente
+        await self._queue.put(None) # Interrompe a espera do intervalo do lote atual
+        await self._queue.join() # Todo item enfileirado já passou por _write
+        self._task.cancel() # A tarefa está parada esperando a próxima nota
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        self._task = None
+        self._stopping = False
+        logger.info("[WriteBehind] Fila esvaziada no desligamento (%d notas pendentes processadas, %d descartadas no total).",
+                    pending, self.failed)
+
+    def stats(self) -> dict:
+        return {
+            "enabled": WRITE_BEHIND_ENABLED,
+            "running": self.running,
+            "queued": (self._queue.qsize() if self._queue is not None else 0) + len(self._collecting) + self._writing,
+            "max_size": self.max_size,
+            "written": self.written,
+            "failed": self.failed,
+            "retries": self.retries,
+            "batches": self.batches,
+        }
+
+
+write_behind_queue = WriteBehindQueue(WRITE_BEHIND_QUEUE_SIZE, WRITE_BEHIND_BATCH_SIZE, WRITE_BEHIND_FLUSH_INTERVAL)
+WRITE_BEHIND_QUEUED = Gauge("invoice_api_write_behind_queued", "Notas aguardando gravação na fila write-behind")
+WRITE_BEHIND_QUEUED.set_function(lambda: write_behind_queue.stats()["queued"])
+
+
+async def store_invoice(invoice: Invoice):
+    """Salva a nota no MongoDB (ou na fila write-behind), se a conexão estiver ativa."""
+    if write_behind_queue.running:
+        await write_behind_queue.put(invoice) # Gravação em segundo plano
+    elif mongo_client is not None and db is not None and invoices_collection is not None:
+        await save_invoice_to_db(invoice)
+    else:
+        logger.warning("Conexão com MongoDB não está disponível. Nota não será salva.")
 
-        elif param_is_valid:
-            # Não achamos no HTML, mas o parâmetro é válido. Usamos o valor do parâmetro.
-            access_key = key_from_param # Pode ter ou não formatação, dependendo do parâmetro
-            print(f"AVISO: Usando chave do parâmetro QR ('{access_key}') pois a formatada não foi encontrada/validada no HTML.")
+async def fetch_and_parse_shared(qr_code_parameter: str, store: bool = False) -> Tuple[Invoice, bool]:
+    """
+    fetch_and_parse com coalescência pela chave de acesso: chamadas simultâneas
+    da mesma nota fazem uma única busca/extração. Com store=True o líder também
+    salva a nota antes de liberar os demais. Retorna (nota, True se foi o líder).
+    """
+    async def run() -> Invoice:
+        invoice = await fetch_and_parse(qr_code_parameter)
+        if store:
+            await store_invoice(invoice)
+        return invoice
 
-        else:
-            # Falha total: Nem HTML nem parâmetro forneceram uma chave válida.
-            access_key = None # Garante que é None
-            print("ERRO FATAL: Não foi possível determinar uma chave de acesso válida nem no HTML nem no parâmetro QR.")
-            # Considerar lançar HTTPException aqui
+    key = access_key_from_qr(qr_code_parameter)
+    if not key:
+        return await run(), True
+    return await invoice_flights.do(key, run)
 
 
-    except Exception as e:
-        print(f"DEBUG: Erro CRÍTICO durante extração da Chave de Acesso: {e}")
-        import traceback
-        print(traceback.format_exc())
+# --- Inicialização do FastAPI ---
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    mongo_connector.start() # Conexão em segundo plano: o servidor não espera o banco
+    if WRITE_BEHIND_ENABLED:
+        write_behind_queue.start()
+    yield
+    # Grava as notas pendentes e fecha as conexões com a SEFAZ e o MongoDB ao desligar
+    if WRITE_BEHIND_ENABLED:
+        await write_behind_queue.stop()
+    await sefaz_http_client.aclose()
+    await mongo_connector.stop()
+    shutdown_parser_executor()
 
-    # Log Final
-    if access_key:
-        print(f"DEBUG: Chave de acesso final a ser usada: '{access_key}'")
-    else:
-        # O erro fatal já foi logado acima.
-        pass
-    # --- Fim da Extração da Chave de Acesso ---
+app = FastAPI(
+    title="API de Scraping de Nota Fiscal",
+    description="Extrai dados de notas fiscais da SEFAZ MG a partir do parâmetro QR Code.",
+    version="1.0.0",
+    lifespan=lifespan,
+    default_response_class=FastJSONResponse
+)
 
-    # Extração dos Itens da Nota (Chamando a outra função)
-    print("\n--- Iniciando Extração de Itens ---")
-    invoice_items = extract_items_from_html(soup)
-    print("--- Extração de Itens Concluída ---\n")
+# --- Endpoint ---
+@app.get("/", response_model=Invoice) # Define o modelo de resposta
+async def index(qr_code_parameter: str):
+    """
+    Recebe o parâmetro 'p' do QR Code da NFC-e de MG, busca os dados na SEFAZ,
+    extrai as informações e as salva no MongoDB se for uma nota nova.
+    Retorna os dados extraídos da nota fiscal.
+    """
+    if not qr_code_parameter:
+        raise HTTPException(status_code=400, detail="Parâmetro 'qr_code_parameter' é obrigatório.")
 
-    # Cria o objeto Invoice usando Pydantic (validará e converterá os tipos)
-    print("DEBUG: Criando objeto Invoice Pydantic...")
-    try:
-        invoice = Invoice(
-            market_name=market_name,
-            invoice_date=invoice_date_str, # Pydantic/dateutil fará o parse
-            total_invoice=total_invoice_str, # Pydantic/parse_decimal fará o parse
-            # Tenta converter a string para int, ou None se falhar ou for None
-            quantity_total_items=int(quantity_total_items_str) if quantity_total_items_str else None,
-            access_key=access_key,
-            items=invoice_items # Lista já deve conter objetos ItemInvoice
-        )
-        print("DEBUG: Objeto Invoice Pydantic criado com sucesso.")
-        # print(f"DEBUG: Conteúdo do objeto Invoice: {invoice.model_dump(exclude={'items'})}") # Opcional: Ver sem itens
-    except Exception as e:
-        print(f"ERRO ao criar o objeto Invoice Pydantic: {e}")
-        # Importante lançar erro aqui, pois os dados podem estar inconsistentes
-        raise HTTPException(status_code=500, detail=f"Erro ao processar os dados extraídos para criar a nota: {e}")
+    # Nota já gravada? Devolve sem ir à SEFAZ
+    stored_invoice = await lookup_stored_invoice(access_key_from_qr(qr_code_parameter))
+    if stored_invoice is not None:
+        logger.info("Nota %s já armazenada. Busca na SEFAZ ignorada.", stored_invoice.access_key)
+        return FastJSONResponse(stored_invoice)
 
-    # Salva no MongoDB (se a conexão estiver ativa e a nota não existir)
-    print("DEBUG: Tentando salvar no MongoDB...")
-    if mongo_client is not None and db is not None and invoices_collection is not None:
-        await save_invoice_to_db(invoice)
-    else:
-        print("AVISO: Conexão com MongoDB não está disponível. Nota não será salva.")
+    # Busca na SEFAZ, extrai e salva; requisições simultâneas da mesma nota
+    # (toque duplo, duas pessoas) esperam a mesma busca em vez de repeti-la
+    invoice, leader = await fetch_and_parse_shared(qr_code_parameter, store=True)
+    if not leader:
+        logger.info("Nota %s compartilhada com uma busca simultânea da mesma chave.", invoice.access_key)
 
-    # Retorna o objeto Invoice (FastAPI o serializará para JSON)
-    print("DEBUG: Retornando objeto Invoice.")
-    return invoice
+    # Retorna o objeto Invoice serializado direto (sem jsonable_encoder/revalidação)
+    return FastJSONResponse(invoice)
+
+@app.post("/batch", response_model=BatchResponse, response_model_exclude_none=True)
+async def batch(request: BatchRequest):
+    """
+    Recebe uma lista de parâmetros de QR Code, busca e extrai as notas em
+    paralelo (com limite de concorrência) e grava todas as notas novas com
+    um único insert em lote. Retorna o status de cada item.
+    """
+    qr_codes = [qr.strip() for qr in request.qr_code_parameters]
+    if len(qr_codes) > BATCH_MAX_ITEMS:
+        raise HTTPException(status_code=413, detail=f"Máximo de {BATCH_MAX_ITEMS} QR Codes por lote.")
+
+    # Notas já gravadas não precisam ir à SEFAZ (cache + uma consulta ao banco)
+    qr_keys = [access_key_from_qr(qr) for qr in qr_codes]
+    stored = await lookup_stored_invoices(sorted({key for key in qr_keys if key}))
+
+    semaphore = asyncio.Semaphore(BATCH_CONCURRENCY)
+
+    async def process(qr_code_parameter: str, key: Optional[str]):
+        if not qr_code_parameter:
+            raise HTTPException(status_code=400, detail="Parâmetro 'qr_code_parameter' vazio.")
+        if key in stored:
+            return stored[key]
+        async with semaphore:
+            invoice, _ = await fetch_and_parse_shared(qr_code_parameter)
+        if not invoice.access_key:
+            raise HTTPException(status_code=422, detail="Chave de acesso não encontrada na nota.")
+        return invoice
+
+    outcomes = await asyncio.gather(*(process(qr, key) for qr, key in zip(qr_codes, qr_keys)), return_exceptions=True)
+
+    results: List[BatchItemResult] = []
+    to_save: List[Invoice] = []
+    seen_keys = set()
+    for qr_code_parameter, key, outcome in zip(qr_codes, qr_keys, outcomes):
+        result = BatchItemResult(qr_code_parameter=qr_code_parameter, status="error")
+        if isinstance(outcome, HTTPException):
+            result.detail = outcome.detail
+        elif isinstance(outcome, Exception):
+            logger.error("[Lote] Falha ao processar '%s': %s", qr_code_parameter, outcome)
+            result.detail = f"Erro inesperado: {outcome}"
+        else:
+            result.access_key = outcome.access_key
+            if request.include_invoices:
+                result.invoice = outcome
+            if outcome.access_key in seen_keys:
+                result.status = "duplicate" # Mesma nota repetida dentro do lote
+            elif key in stored:
+                seen_keys.add(outcome.access_key)
+                result.status = "exists"
+            else:
+                seen_keys.add(outcome.access_key)
+                to_save.append(outcome)
+                result.status = "parsed"
+        results.append(result)
+
+    # Grava todas as notas novas de uma vez (ou enfileira, no modo write-behind)
+    if write_behind_queue.running:
+        for invoice in to_save:
+            await write_behind_queue.put(invoice)
+        statuses = {invoice.access_key: "queued" for invoice in to_save}
+    else:
+        statuses = await save_invoices_bulk(to_save)
+    for result in results:
+        if result.status == "parsed" and result.access_key in statuses:
+            result.status = statuses[result.access_key]
+
+    return FastJSONResponse(BatchResponse(
+        total=len(results),
+        inserted=sum(1 for r in results if r.status == "inserted"),
+        existing=sum(1 for r in results if r.status in ("exists", "duplicate")),
+        errors=sum(1 for r in results if r.status == "error"),
+        results=results,
+    ), exclude_none=True)
+
+@app.get("/health/live")
+async def health_live():
+    """Liveness: o processo está de pé e o event loop responde."""
+    return {"status": "ok"}
+
+@app.get("/health/ready")
+async def health_ready():
+    """Readiness: o MongoDB responde ao ping (503 enquanto não responder)."""
+    ready = await mongo_connector.ping()
+    return FastJSONResponse({"status": "ok" if ready else "unavailable", "mongo": mongo_connector.stats()},
+                            status_code=200 if ready else 503)
+
+@app.get("/metrics")
+async def metrics():
+    """Métricas no formato Prometheus (histogramas de latência por etapa)."""
+    return Response(generate_latest(), media_type=CONTENT_TYPE_LATEST)
+
+@app.get("/write-behind-stats")
+async def write_behind_stats():
+    """Estado da fila de gravação assíncrona."""
+    return write_behind_queue.stats()
+
+@app.get("/cache-stats")
+async def cache_stats():
+    """Estatísticas do cache de notas já armazenadas."""
+    return invoice_cache.stats()
+
+@app.get("/portal-stats")
+async def portal_stats():
+    """Limite de taxa, circuit breaker e coalescência das buscas no portal da SEFAZ."""
+    return {
+        "rate_limiter": portal_rate_limiter.stats(),
+        "circuit_breaker": portal_circuit.stats(),
+        "single_flight": invoice_flights.stats(),
+        "config": {"max_retries": SEFAZ_MAX_RETRIES, "backoff_base": SEFAZ_BACKOFF_BASE,
+                   "backoff_max": SEFAZ_BACKOFF_MAX},
+    }
+
+@app.get("/pool-stats")
+async def pool_stats():
+    """Estatísticas do pool de conexões HTTP usado para buscar páginas na SEFAZ."""
+    return sefaz_http_client.pool_stats()
 
 # --- Ponto de Entrada para rodar com Uvicorn ---
 if __name__ == "__main__":
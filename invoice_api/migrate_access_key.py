@@ -0,0 +1,116 @@
+"""
+Migração: preenche o campo NormalizedAccessKey (chave de acesso só com os 44
+dígitos) nos documentos já gravados na coleção de notas.
+
+- Processa em lotes, em ordem de _id, com um bulk_write não ordenado por lote.
+- É retomável: o último _id processado fica gravado em um arquivo de estado e
+  documentos que já têm o campo são ignorados. Rodar de novo continua de onde parou.
+- Documentos com chave inválida ou duplicada (mesma chave normalizada de outra
+  nota) são listados e ficam sem o campo para correção manual.
+
+Uso (dentro do diretório invoice_api):
+    python migrate_access_key.py
+    python migrate_access_key.py --batch-size 2000 --drop-legacy-index
+    python migrate_access_key.py --restart       # ignora o estado salvo
+"""
+import argparse
+import json
+import sys
+from pathlib import Path
+
+from bson import ObjectId
+from pymongo import ASCENDING, MongoClient, UpdateOne
+from pymongo.errors import BulkWriteError
+
+import main as invoice_api
+
+LEGACY_INDEX_NAME = "access_key_1" # Índice antigo em um campo que nunca foi gravado
+
+
+def load_last_id(state_file: Path):
+    if state_file.exists():
+        return ObjectId(json.loads(state_file.read_text())["last_id"])
+    return None
+
+
+def save_last_id(state_file: Path, last_id):
+    temp_file = state_file.with_suffix(".tmp")
+    temp_file.write_text(json.dumps({"last_id": str(last_id)}))
+    temp_file.replace(state_file)
+
+
+def main():
+    arg_parser = argparse.ArgumentParser(description="Preenche NormalizedAccessKey nas notas já gravadas.")
+    arg_parser.add_argument("--batch-size", type=int, default=1000, help="Documentos por lote")
+    arg_parser.add_argument("--state-file", default="migrate_access_key.state.json", help="Arquivo de progresso")
+    arg_parser.add_argument("--restart", action="store_true", help="Recomeça do início, ignorando o estado salvo")
+    arg_parser.add_argument("--drop-legacy-index", action="store_true", help=f"Remove o índice antigo '{LEGACY_INDEX_NAME}'")
+    args = arg_parser.parse_args()
+
+    client = MongoClient(invoice_api.MONGO_CONNECTION_STRING)
+    collection = client[invoice_api.DB_NAME][invoice_api.COLLECTION_NAME]
+    field = invoice_api.NORMALIZED_KEY_FIELD
+
+    # Garante o índice único antes de preencher: duplicatas são detectadas na gravação
+    collection.create_index(
+        field,
+        unique=True,
+        name=invoice_api.NORMALIZED_KEY_INDEX,
+        partialFilterExpression={field: {"$type": "string"}}
+    )
+
+    state_file = Path(args.state_file)
+    last_id = None if args.restart else load_last_id(state_file)
+    if last_id is not None:
+        print(f"Retomando após _id {last_id}.")
+
+    updated = invalid = duplicated = 0
+    while True:
+        query = {field: {"$exists": False}}
+        if last_id is not None:
+            query["_id"] = {"$gt": last_id}
+        batch = list(collection.find(query, {"AccessKey": 1}).sort("_id", ASCENDING).limit(args.batch_size))
+        if not batch:
+            break
+
+        operations = []
+        targets = [] # (_id, chave) de cada operação, para relatar duplicatas
+        for doc in batch:
+            normalized_key = invoice_api.normalize_access_key(doc.get("AccessKey"))
+            if normalized_key is None:
+                invalid += 1
+                print(f"INVÁLIDA: _id={doc['_id']} AccessKey={doc.get('AccessKey')!r}")
+                continue
+            # UpdatedAt muda junto: o invoice_lister usa o campo nos ETags e no cache de páginas
+            update = {"$set": {field: normalized_key}, "$currentDate": {invoice_api.UPDATED_AT_FIELD: True}}
+            operations.append(UpdateOne({"_id": doc["_id"], field: {"$exists": False}}, update))
+            targets.append((doc["_id"], normalized_key))
+
+        if operations:
+            try:
+                result = collection.bulk_write(operations, ordered=False)
+                updated += result.modified_count
+            except BulkWriteError as e:
+                updated += e.details.get("nModified", 0)
+                for error in e.details.get("writeErrors", []):
+                    if error.get("code") == 11000:
+                        duplicated += 1
+                        doc_id, normalized_key = targets[error["index"]]
+                        print(f"DUPLICADA: _id={doc_id} chave={normalized_key}")
+                    else:
+                        raise
+
+        last_id = batch[-1]["_id"]
+        save_last_id(state_file, last_id)
+        print(f"Lote concluído até _id {last_id}: {updated} atualizadas, {invalid} inválidas, {duplicated} duplicadas.")
+
+    if args.drop_legacy_index and LEGACY_INDEX_NAME in collection.index_information():
+        collection.drop_index(LEGACY_INDEX_NAME)
+        print(f"Índice antigo '{LEGACY_INDEX_NAME}' removido.")
+
+    print(f"Migração concluída: {updated} atualizadas, {invalid} inválidas, {duplicated} duplicadas.")
+    return 1 if invalid or duplicated else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
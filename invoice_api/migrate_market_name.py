@@ -0,0 +1,70 @@
+"""
+Migração: preenche o campo MarketNameNormalized (nome do mercado sem acentos,
+em maiúsculas) nos documentos já gravados na coleção de notas. O filtro por
+mercado do invoice_lister usa esse campo; notas sem ele não aparecem no filtro.
+
+- Processa em lotes, em ordem de _id, com um bulk_write não ordenado por lote.
+- É retomável: o último _id processado fica gravado em um arquivo de estado e
+  documentos que já têm o campo são ignorados. Rodar de novo continua de onde parou.
+- Atualiza UpdatedAt junto (ETags e cache de páginas do invoice_lister).
+
+Uso (dentro do diretório invoice_api):
+    python migrate_market_name.py
+    python migrate_market_name.py --batch-size 2000
+    python migrate_market_name.py --restart       # ignora o estado salvo
+"""
+import argparse
+import sys
+from pathlib import Path
+
+from pymongo import ASCENDING, MongoClient, UpdateOne
+
+import main as invoice_api
+from migrate_access_key import load_last_id, save_last_id
+
+
+def main():
+    arg_parser = argparse.ArgumentParser(description="Preenche MarketNameNormalized nas notas já gravadas.")
+    arg_parser.add_argument("--batch-size", type=int, default=1000, help="Documentos por lote")
+    arg_parser.add_argument("--state-file", default="migrate_market_name.state.json", help="Arquivo de progresso")
+    arg_parser.add_argument("--restart", action="store_true", help="Recomeça do início, ignorando o estado salvo")
+    args = arg_parser.parse_args()
+
+    client = MongoClient(invoice_api.MONGO_CONNECTION_STRING)
+    collection = client[invoice_api.DB_NAME][invoice_api.COLLECTION_NAME]
+    field = invoice_api.MARKET_SEARCH_FIELD
+
+    state_file = Path(args.state_file)
+    last_id = None if args.restart else load_last_id(state_file)
+    if last_id is not None:
+        print(f"Retomando após _id {last_id}.")
+
+    updated = 0
+    while True:
+        query = {field: {"$exists": False}, "MarketName": {"$type": "string"}}
+        if last_id is not None:
+            query["_id"] = {"$gt": last_id}
+        batch = list(collection.find(query, {"MarketName": 1}).sort("_id", ASCENDING).limit(args.batch_size))
+        if not batch:
+            break
+
+        operations = []
+        for doc in batch:
+            market_search = invoice_api.normalize_market_name(doc["MarketName"])
+            if market_search is None:
+                continue # Nome só com espaços: a nota fica fora do filtro por mercado
+            update = {"$set": {field: market_search}, "$currentDate": {invoice_api.UPDATED_AT_FIELD: True}}
+            operations.append(UpdateOne({"_id": doc["_id"], field: {"$exists": False}}, update))
+        if operations:
+            updated += collection.bulk_write(operations, ordered=False).modified_count
+
+        last_id = batch[-1]["_id"]
+        save_last_id(state_file, last_id)
+        print(f"Lote concluído até _id {last_id}: {updated} atualizadas.")
+
+    print(f"Migração concluída: {updated} atualizadas.")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,108 @@
+"""
+Reprocessa offline as páginas HTML arquivadas pelo invoice_api.
+
+Percorre o diretório de arquivo (HTML_ARCHIVE_DIR), roda a extração em
+paralelo (um processo por núcleo) e grava os documentos corrigidos no
+MongoDB com upserts em lote. Útil quando o layout da SEFAZ muda ou um bug
+do parser é corrigido: nenhuma requisição ao portal é feita.
+
+Uso (dentro do diretório invoice_api):
+    python reparse_archive.py
+    python reparse_archive.py --archive-dir html_archive --workers 8 --batch-size 500
+    python reparse_archive.py --dry-run          # só extrai, não grava
+"""
+import argparse
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+
+from pymongo import MongoClient, UpdateOne
+
+import main as invoice_api
+
+
+def reparse_file(path_str: str):
+    """
+    Executado nos processos filhos: extrai a nota de um HTML arquivado.
+    Retorna (chave, documento, erro) apenas com dados simples (picklable).
+    """
+    path = Path(path_str)
+    access_key = path.name.split(".")[0]
+    try:
+        html_content = invoice_api.read_archived_html(path)
+        invoice = invoice_api.parse_invoice_html(html_content, f"{access_key}|")
+        return access_key, invoice_api.invoice_to_document(invoice), None
+    except Exception as e:
+        return access_key, None, str(e)
+
+
+def upsert_documents(collection, documents):
+    """
+    Grava (upsert) os documentos extraídos com um único bulk_write não ordenado.
+    O documento traz UpdatedAt (invoice_to_document), que o invoice_lister usa nos ETags.
+    """
+    operations = [
+        UpdateOne({invoice_api.NORMALIZED_KEY_FIELD: access_key}, {"$set": document}, upsert=True)
+        for access_key, document in documents
+    ]
+    result = collection.bulk_write(operations, ordered=False)
+    return result.upserted_count, result.modified_count
+
+
+def main():
+    arg_parser = argparse.ArgumentParser(description="Reprocessa o HTML arquivado e atualiza as notas no MongoDB.")
+    arg_parser.add_argument("--archive-dir", default=invoice_api.HTML_ARCHIVE_DIR, help="Diretório do arquivo de HTML")
+    arg_parser.add_argument("--workers", type=int, default=os.cpu_count(), help="Processos de extração")
+    arg_parser.add_argument("--batch-size", type=int, default=500, help="Documentos por bulk_write")
+    arg_parser.add_argument("--dry-run", action="store_true", help="Apenas extrai, sem gravar no MongoDB")
+    args = arg_parser.parse_args()
+
+    paths = sorted(str(path) for path in Path(args.archive_dir).glob("*/*.html.gz"))
+    if not paths:
+        print(f"Nenhum HTML arquivado encontrado em '{args.archive_dir}'.")
+        return 1
+    print(f"{len(paths)} páginas arquivadas encontradas em '{args.archive_dir}'.")
+
+    collection = None
+    if not args.dry_run:
+        client = MongoClient(invoice_api.MONGO_CONNECTION_STRING)
+        collection = client.get_database(invoice_api.DB_NAME, codec_options=invoice_api.codec_options) \
+            .get_collection(invoice_api.COLLECTION_NAME, codec_options=invoice_api.codec_options)
+
+    parsed = failed = inserted = updated = 0
+    pending = []
+    start = time.perf_counter()
+    with ProcessPoolExecutor(max_workers=args.workers) as executor:
+        for access_key, document, error in executor.map(reparse_file, paths, chunksize=32):
+            if error is not None:
+                failed += 1
+                print(f"ERRO: {access_key}: {error}")
+                continue
+            parsed += 1
+            if collection is not None:
+                pending.append((access_key, document))
+                if len(pending) >= args.batch_size:
+                    new_count, modified_count = upsert_documents(collection, pending)
+                    inserted += new_count
+                    updated += modified_count
+                    pending = []
+            done = parsed + failed
+            if done % 1000 == 0:
+                elapsed = time.perf_counter() - start
+                print(f"{done}/{len(paths)} páginas ({done / elapsed:.0f}/s)")
+
+    if collection is not None and pending:
+        new_count, modified_count = upsert_documents(collection, pending)
+        inserted += new_count
+        updated += modified_count
+
+    elapsed = time.perf_counter() - start
+    print(f"Concluído em {elapsed:.1f}s: {parsed} extraídas, {failed} com erro, "
+          f"{inserted} inseridas, {updated} atualizadas.")
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
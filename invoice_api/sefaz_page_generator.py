@@ -0,0 +1,195 @@
+"""
+Gerador de páginas sintéticas de NFC-e no formato do portal da SEFAZ MG.
+
+Produz o mesmo HTML que o parser encontra no portal: cabeçalho com o nome do
+estabelecimento, tabela de itens em <tbody id="myTable"> (uma <tr> por item,
+com as spans txtTit/RCod/Rqtd/RUN/valor), a quantidade total de itens em
+div.col-lg-2, o valor total em #linhaTotal, a data de emissão e a chave de
+acesso formatada em blocos de 4 dígitos (com dígito verificador válido).
+Junto com o HTML vêm os valores esperados, para conferir a extração.
+
+Uso como módulo:
+    from sefaz_page_generator import generate_invoice_page
+    page = generate_invoice_page(300, seed=1)
+    page.html, page.access_key, page.qr_code_parameter, page.expected
+
+Uso pela linha de comando (dentro do diretório invoice_api):
+    python sefaz_page_generator.py --items 300 --seed 1 --out pagina.html
+"""
+import argparse
+import random
+from dataclasses import dataclass, field
+from datetime import datetime, timedelta
+from decimal import Decimal
+
+MIN_ITEMS = 5
+MAX_ITEMS = 2000
+
+PRODUCTS = [
+    ("ARROZ TIPO 1", "PCT", "5KG"), ("FEIJAO CARIOCA", "PCT", "1KG"), ("LEITE INTEGRAL", "UN", "1L"),
+    ("CAFE TORRADO E MOIDO", "UN", "500G"), ("ACUCAR CRISTAL", "PCT", "2KG"), ("OLEO DE SOJA", "UN", "900ML"),
+    ("BANANA PRATA", "KG", ""), ("TOMATE ITALIANO", "KG", ""), ("BATATA INGLESA", "KG", ""),
+    ("PAO FRANCES", "KG", ""), ("QUEIJO MUSSARELA FATIADO", "KG", ""), ("PRESUNTO COZIDO", "KG", ""),
+    ("DETERGENTE NEUTRO", "UN", "500ML"), ("PAPEL HIGIENICO FOLHA DUPLA", "PCT", "12UN"),
+    ("REFRIGERANTE COLA", "UN", "2L"), ("CERVEJA PILSEN LATA", "UN", "350ML"), ("SABAO EM PO", "CX", "1,6KG"),
+    ("IOGURTE MORANGO", "UN", "170G"), ("MACARRAO ESPAGUETE", "PCT", "500G"), ("CARNE BOVINA ACEM", "KG", ""),
+]
+BRANDS = ["BOM GOSTO", "SABOR DE MINAS", "QUALITA", "DA FAZENDA", "UNIAO", "PRIMOR", "TIROL", "ITAMBE"]
+MARKETS = ["SUPERMERCADO BH COMERCIO DE ALIMENTOS LTDA", "DMA DISTRIBUIDORA S/A", "MERCADINHO SAO JOSE LTDA",
+           "SUPERNOSSO EM CASA LTDA", "EPA SUPERMERCADOS LTDA"]
+
+
+@dataclass
+class SyntheticInvoicePage:
+    html: str
+    access_key: str # Formatada (blocos de 4 dígitos), como aparece no portal
+    qr_code_parameter: str
+    expected: dict = field(default_factory=dict) # Valores que a extração deve encontrar
+
+
+def format_br_number(value: Decimal, places: int) -> str:
+    """1234.5 -> '1.234,50' (formato usado pelo portal)."""
+    integer, fraction = f"{value:,.{places}f}".split(".")
+    return f"{integer.replace(',', '.')},{fraction}"
+
+
+def access_key_check_digit(digits43: str) -> str:
+    """Dígito verificador da chave de acesso (módulo 11, pesos 2 a 9)."""
+    total = sum(int(digit) * (2 + i % 8) for i, digit in enumerate(reversed(digits43)))
+    remainder = total % 11
+    return "0" if remainder < 2 else str(11 - remainder)
+
+
+def build_access_key(rng: random.Random, issued_at: datetime, number: int) -> str:
+    """Chave de 44 dígitos: UF 31 (MG), AAMM, CNPJ, modelo 65, série, número, tpEmis, código e DV."""
+    cnpj = f"{rng.randint(0, 99_999_999):08d}0001{rng.randint(10, 99)}"
+    digits43 = (f"31{issued_at:%y%m}{cnpj}65{rng.randint(1, 999):03d}{number:09d}1"
+                f"{rng.randint(0, 99_999_999):08d}")
+    return digits43 + access_key_check_digit(digits43)
+
+
+def format_access_key(digits: str) -> str:
+    return "-".join(digits[i:i + 4] for i in range(0, len(digits), 4))
+
+
+def build_item(rng: random.Random, index: int) -> dict:
+    name, unit, package = rng.choice(PRODUCTS)
+    description = " ".join(part for part in (name, rng.choice(BRANDS), package) if part)
+    if unit == "KG":
+        quantity = Decimal(rng.randint(50, 3500)) / 1000
+    else:
+        quantity = Decimal(rng.choice([1, 1, 1, 2, 2, 3, 4, 6, 12]))
+    unit_price = Decimal(rng.randint(99, 8999)) / 100
+    value = (quantity * unit_price).quantize(Decimal("0.01"))
+    return {
+        "code": str(rng.choice([rng.randint(1000, 99999), rng.randint(7890000000000, 7899999999999)])),
+        "description": description,
+        "quantity": quantity.quantize(Decimal("0.0001")),
+        "unit": unit,
+        "value": value,
+        "row_id": index,
+    }
+
+
+def render_item_row(item: dict) -> str:
+    return (
+        f'<tr id="Item + {item["row_id"]}">'
+        f'<td valign="top"><span class="txtTit">{item["description"]}</span>'
+        f'<span class="RCod"> (Código: {item["code"]})</span></td>'
+        f'<td><span class="Rqtd"><strong>Qtde total de ítens: </strong>{format_br_number(item["quantity"], 4)}</span></td>'
+        f'<td><span class="RUN"><strong>UN: </strong>{item["unit"]}</span></td>'
+        f'<td align="right" valign="top" class="txtTit noWrap"><span class="valor">Vl. Total R$: '
+        f'{format_br_number(item["value"], 2)}</span></td>'
+        f'</tr>'
+    )
+
+
+def generate_invoice_page(item_count: int, seed: int = 0, access_key: str = None) -> SyntheticInvoicePage:
+    """
+    Gera uma página com 'item_count' itens (5 a 2000). A mesma semente gera
+    sempre a mesma página; 'access_key' (44 dígitos) substitui a chave sorteada.
+    """
+    if not MIN_ITEMS <= item_count <= MAX_ITEMS:
+        raise ValueError(f"item_count deve estar entre {MIN_ITEMS} e {MAX_ITEMS}.")
+    rng = random.Random(seed)
+    issued_at = datetime(2025, 1, 1) + timedelta(seconds=rng.randint(0, 300 * 86400))
+    number = rng.randint(1, 999_999)
+    digits = access_key or build_access_key(rng, issued_at, number)
+    formatted_key = format_access_key(digits)
+    market_name = rng.choice(MARKETS)
+
+    items = [build_item(rng, i) for i in range(1, item_count + 1)]
+    total = sum((item["value"] for item in items), Decimal("0.00"))
+    rows = "".join(render_item_row(item) for item in items)
+
+    html = f"""<!DOCTYPE html>
+<html lang="pt-br">
+<head>
+<meta charset="UTF-8"><title>Portal SPED - Consulta NFC-e</title>
+<link rel="stylesheet" href="/portalnfce/css/bootstrap.min.css">
+<script type="text/javascript">var urlConsulta = "qrcode.xhtml"; function imprimir() {{ window.print(); }}</script>
+</head>
+<body>
+<!-- Cabeçalho do portal -->
+<div class="navbar navbar-default"><div class="container"><a class="navbar-brand" href="#">NFC-e MG</a></div></div>
+<div class="container">
+  <table class="table">
+    <thead><tr><th class="text-center text-uppercase"><h4><b>{market_name}</b></h4></th></tr></thead>
+    <tbody>
+      <tr><td class="text-center">CNPJ: {digits[6:8]}.{digits[8:11]}.{digits[11:14]}/{digits[14:18]}-{digits[18:20]},
+        AV AMAZONAS, {rng.randint(1, 9999)}, CENTRO, BELO HORIZONTE, MG</td></tr>
+    </tbody>
+  </table>
+  <table class="table table-striped">
+    <thead><tr><th>Descrição</th><th>Qtde</th><th>UN</th><th>Valor</th></tr></thead>
+    <tbody id="myTable">{rows}</tbody>
+  </table>
+  <div class="row"><div class="col-lg-10"><strong>Qtde total de ítens:</strong></div>
+    <div class="col-lg-2"><strong>{item_count}</strong></div></div>
+  <div id="linhaTotal"><label>Valor total R$:</label> <span class="totalNumb">{format_br_number(total, 2)}</span></div>
+  <div id="linhaTotal"><label>Valor a pagar R$:</label> <span class="totalNumb">{format_br_number(total, 2)}</span></div>
+  <table class="table"><tr>
+    <td>Número: {number} Série: {int(digits[22:25])}</td>
+    <td>Data de Emissão: {issued_at:%d/%m/%Y %H:%M:%S}</td>
+  </tr></table>
+  <div class="panel"><span><strong>Chave de acesso</strong></span>
+    <span class="chave">{formatted_key}</span></div>
+  <div class="text-center"><small>Consulte pela Chave de Acesso em www.fazenda.mg.gov.br/nfce</small></div>
+</div>
+</body>
+</html>"""
+
+    expected = {
+        "market_name": market_name,
+        "invoice_date": issued_at,
+        "total_invoice": total,
+        "quantity_total_items": item_count,
+        "access_key": formatted_key,
+        "items": [{key: item[key] for key in ("code", "description", "quantity", "unit", "value")} for item in items],
+    }
+    return SyntheticInvoicePage(
+        html=html,
+        access_key=formatted_key,
+        qr_code_parameter=f"{digits}|2|1|1|{rng.getrandbits(160):040X}",
+        expected=expected,
+    )
+
+
+def main():
+    arg_parser = argparse.ArgumentParser(description="Gera uma página sintética de NFC-e no formato da SEFAZ MG.")
+    arg_parser.add_argument("--items", type=int, default=50, help=f"Itens na nota ({MIN_ITEMS} a {MAX_ITEMS})")
+    arg_parser.add_argument("--seed", type=int, default=0, help="Semente (mesma semente, mesma página)")
+    arg_parser.add_argument("--out", help="Arquivo de saída (padrão: imprime na tela)")
+    args = arg_parser.parse_args()
+
+    page = generate_invoice_page(args.items, args.seed)
+    if args.out:
+        with open(args.out, "w", encoding="utf-8") as out_file:
+            out_file.write(page.html)
+        print(f"{args.out}: {args.items} itens, chave {page.access_key}, parâmetro QR {page.qr_code_parameter}")
+    else:
+        print(page.html)
+
+
+if __name__ == "__main__":
+    main()
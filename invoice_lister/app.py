@@ -1,11 +1,26 @@
 # app.py
-from flask import Flask, render_template, jsonify, abort, url_for, request, redirect, flash, make_response
+from flask import Flask, render_template, jsonify, abort, url_for, request, redirect, flash, make_response, Response, stream_with_context, g
 from pymongo import MongoClient, DESCENDING, ASCENDING
 from bson import json_util
+from pymongo import TEXT
+from pymongo.errors import OperationFailure, PyMongoError
+from bson.decimal128 import Decimal128
+from bson.errors import BSONError
 from bson.objectid import ObjectId
+import base64
+import binascii
+import gzip
+import hashlib
 import json
 import math
-from datetime import timedelta
+import re
+import threading
+import time
+import unicodedata
+from collections import OrderedDict
+from functools import wraps
+from datetime import datetime, timedelta
+from decimal import Decimal, InvalidOperation
 from werkzeug.security import generate_password_hash, check_password_hash
 from flask_jwt_extended import (
     create_access_token, create_refresh_token, jwt_required,
@@ -47,7 +62,7 @@ app.secret_key = FLASK_SECRET
 app.config["JWT_SECRET_KEY"] = JWT_SECRET
 app.config["JWT_ACCESS_TOKEN_EXPIRES"] = timedelta(minutes=30)
 app.config["JWT_REFRESH_TOKEN_EXPIRES"] = timedelta(days=30)
-app.config["JWT_TOKEN_LOCATION"] = ["cookies"]
+app.config["JWT_TOKEN_LOCATION"] = ["cookies", "headers"] # Headers: scripts usando a API JSON (Authorization: Bearer)
 app.config["JWT_COOKIE_CSRF_PROTECT"] = True
 # Verifique se FLASK_ENV é production para habilitar cookie seguro
 if os.getenv('FLASK_ENV') == 'production':
@@ -67,6 +82,52 @@ DEFAULT_SORT_BY = "date"
 DEFAULT_SORT_ORDER = "desc"
 ALLOWED_LIMITS = [10, 25, 50, 100, 0]
 DEFAULT_LIMIT = 10
+# Visão "Todos" (limit=0): documentos lidos por lote do cursor e partes do HTML
+# acumuladas antes de cada envio da resposta em streaming
+STREAM_BATCH_SIZE = int(os.getenv('STREAM_BATCH_SIZE', '500'))
+STREAM_BUFFER_SIZE = int(os.getenv('STREAM_BUFFER_SIZE', '500'))
+# API JSON (/api/invoices): limites por página, versão do formato (entra nos
+# ETags) e tamanho mínimo do corpo para comprimir com gzip
+API_ALLOWED_LIMITS = [10, 25, 50, 100]
+API_FORMAT_VERSION = 1
+API_GZIP_MIN_SIZE = int(os.getenv('API_GZIP_MIN_SIZE', '1024'))
+API_GZIP_LEVEL = int(os.getenv('API_GZIP_LEVEL', '6'))
+# A lista só exibe estes campos (e o _id): os Items ficam de fora da consulta
+SUMMARY_PROJECTION = {"MarketName": 1, "InvoiceDate": 1, "QuantityTotalItems": 1, "TotalInvoice": 1}
+# Cache das contagens usadas na paginação (segundos; 0 desliga)
+COUNT_CACHE_TTL = float(os.getenv('COUNT_CACHE_TTL', '30'))
+COUNT_CACHE_MAX_ENTRIES = int(os.getenv('COUNT_CACHE_MAX_ENTRIES', '256'))
+# Cache dos usuários carregados pelo JWT a cada requisição protegida (segundos; 0 desliga)
+USER_CACHE_TTL = float(os.getenv('USER_CACHE_TTL', '60'))
+USER_CACHE_MAX_ENTRIES = int(os.getenv('USER_CACHE_MAX_ENTRIES', '1024'))
+# Cache das páginas renderizadas (lista e detalhes): limite de memória em bytes
+# (0 desliga), idade máxima de uma página em segundos (0 sem limite), intervalo
+# da verificação de mudanças quando não há change stream e uso do change stream
+# (só existe em replica set)
+PAGE_CACHE_MAX_BYTES = int(os.getenv('PAGE_CACHE_MAX_BYTES', str(32 * 1024 * 1024)))
+PAGE_CACHE_MAX_AGE = float(os.getenv('PAGE_CACHE_MAX_AGE', '60'))
+PAGE_CACHE_CHECK_INTERVAL = float(os.getenv('PAGE_CACHE_CHECK_INTERVAL', '5'))
+PAGE_CACHE_CHANGE_STREAM = os.getenv('PAGE_CACHE_CHANGE_STREAM', '1') == '1'
+# Momento da última gravação de cada nota (atualizado pelo invoice_api e pelos
+# scripts que alteram notas): versão usada nos ETags e no cache de páginas
+UPDATED_AT_FIELD = 'UpdatedAt'
+# Índices compostos (campo de ordenação, _id) usados pela paginação por cursor.
+# O MongoDB percorre o índice nos dois sentidos, então um índice atende asc e desc.
+SORT_INDEXES = [[(field, DESCENDING), ("_id", DESCENDING)] for field in ALLOWED_SORT_COLUMNS.values()]
+# Nome do mercado para busca (sem acentos, em maiúsculas), gravado pelo
+# invoice_api: o portal só mostra o nome em maiúsculas via CSS, o texto vem como está
+MARKET_SEARCH_FIELD = 'MarketNameNormalized'
+# Índices dos filtros da lista: mercado (prefixo) + data, código do item
+# (multikey, um valor por item) e busca textual na descrição dos itens
+FILTER_INDEXES = [
+    ([(MARKET_SEARCH_FIELD, ASCENDING), ("InvoiceDate", DESCENDING)], {}),
+    ([("Items.Code", ASCENDING)], {}),
+    ([("Items.Description", TEXT)], {"default_language": "portuguese"}),
+]
+# Maior UpdatedAt (verificação de mudanças sem change stream)
+VERSION_INDEXES = [([(UPDATED_AT_FIELD, DESCENDING)], {})]
+# Filtros aceitos na query string da lista e da API (ver build_invoice_filter)
+FILTER_ARGS = ('market', 'date_from', 'date_to', 'total_min', 'total_max', 'item', 'item_code')
 
 # --- Conexão MongoDB ---
 try:
@@ -76,6 +137,11 @@ try:
     invoices_collection = db[COLLECTION_NAME]
     users_collection = db[USERS_COLLECTION_NAME] # Acessa a collection de usuários
     print("Conexão com MongoDB estabelecida com sucesso!")
+    for index_keys, index_options in [(keys, {}) for keys in SORT_INDEXES] + FILTER_INDEXES + VERSION_INDEXES:
+        try:
+            invoices_collection.create_index(index_keys, **index_options)
+        except Exception as e:
+            print(f"Aviso: não foi possível criar o índice {index_keys}: {e}")
 except Exception as e:
     print(f"Erro ao conectar ao MongoDB: {e}")
     invoices_collection = None
@@ -84,8 +150,481 @@ except Exception as e:
     client = None
 
 # --- Funções Auxiliares ---
-def parse_json(data):
-    return json.loads(json_util.dumps(data))
+def convert_bson(value, format_date):
+    """
+    Converte os tipos BSON em valores simples numa única passada (sem serializar
+    para JSON e ler de volta): ObjectId e Decimal128 viram texto (sem perder
+    casas decimais) e datas passam por format_date.
+    """
+    if isinstance(value, dict):
+        return {key: convert_bson(item, format_date) for key, item in value.items()}
+    if isinstance(value, list):
+        return [convert_bson(item, format_date) for item in value]
+    if isinstance(value, datetime):
+        return format_date(value)
+    if isinstance(value, (ObjectId, Decimal128)):
+        return str(value)
+    return value
+
+def to_template_value(value):
+    """Valores prontos para o template; datas como 'AAAA-MM-DD HH:MM:SS'."""
+    return convert_bson(value, lambda date: date.strftime('%Y-%m-%d %H:%M:%S'))
+
+def to_api_value(value):
+    """Valores prontos para JSON; datas em ISO 8601."""
+    return convert_bson(value, datetime.isoformat)
+
+def stream_template_values(cursor):
+    """Converte os documentos do cursor conforme são lidos, fechando o cursor ao final."""
+    try:
+        for row in cursor:
+            yield to_template_value(row)
+    except Exception as e:
+        # Os cabeçalhos já foram enviados: a lista termina aqui e o erro fica no log
+        print(f"Erro ao transmitir a lista de notas: {e}")
+    finally:
+        cursor.close()
+
+def render_template_streamed(template_name, **context):
+    """
+    Como render_template, mas envia o HTML em partes (resposta chunked) conforme
+    o Jinja renderiza: com um gerador no contexto, a primeira linha chega ao
+    navegador antes de o cursor terminar e a memória não cresce com a lista.
+    """
+    app.update_template_context(context)
+    stream = app.jinja_env.get_template(template_name).stream(context)
+    stream.enable_buffering(STREAM_BUFFER_SIZE) # Agrupa as partes pequenas do Jinja em envios maiores
+    return Response(stream_with_context(stream), mimetype='text/html')
+
+# --- Caches em memória ---
+class TTLCache:
+    """Dicionário LRU limitado a max_entries, com validade de ttl segundos por entrada (seguro entre threads)."""
+
+    def __init__(self, ttl, max_entries):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._entries = OrderedDict() # chave -> (expira_em, valor)
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        """Retorna (encontrado, valor)."""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return False, None
+            if entry[0] <= time.monotonic():
+                del self._entries[key]
+                return False, None
+            self._entries.move_to_end(key)
+            return True, entry[1]
+
+    def set(self, key, value):
+        if self.ttl <= 0 or self.max_entries <= 0:
+            return
+        with self._lock:
+            self._entries[key] = (time.monotonic() + self.ttl, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def invalidate(self, key=None):
+        """Descarta uma entrada ou, sem chave, todas."""
+        with self._lock:
+            if key is None:
+                self._entries.clear()
+            else:
+                self._entries.pop(key, None)
+
+class CountCache(TTLCache):
+    """
+    Guarda o total de notas por filtro durante COUNT_CACHE_TTL segundos, para a
+    paginação não contar a collection inteira a cada página. Sem filtro usa
+    estimated_document_count (metadado da collection, sem varredura); com
+    filtro usa count_documents e guarda uma entrada por filtro (LRU limitado).
+    invalidate() descarta tudo quando notas são inseridas.
+    """
+
+    def count(self, collection, query_filter=None):
+        key = json_util.dumps(query_filter or {}, sort_keys=True)
+        found, total = self.get(key)
+        if found:
+            return total
+        if query_filter:
+            total = collection.count_documents(query_filter)
+        else:
+            total = collection.estimated_document_count()
+        self.set(key, total)
+        return total
+
+invoice_counts = CountCache(COUNT_CACHE_TTL, COUNT_CACHE_MAX_ENTRIES)
+
+# Usuários por _id (texto), sem o hash da senha. Só usuários encontrados entram no
+# cache; quem alterar ou remover um usuário deve chamar invalidate_cached_user.
+user_cache = TTLCache(USER_CACHE_TTL, USER_CACHE_MAX_ENTRIES)
+
+def load_user(user_id):
+    """Usuário pelo _id (texto), do cache ou do MongoDB; None se não existir."""
+    found, user = user_cache.get(user_id)
+    if found:
+        return user
+    if users_collection is None or not ObjectId.is_valid(user_id):
+        return None
+    user = users_collection.find_one({"_id": ObjectId(user_id)}, {"password_hash": 0})
+    if user is not None:
+        user_cache.set(user_id, user)
+    return user
+
+def invalidate_cached_user(user_id=None):
+    """Descarta um usuário do cache (ou todos, sem argumento) após alterá-lo no banco."""
+    user_cache.invalidate(None if user_id is None else str(user_id))
+    page_cache.clear() # As páginas em cache mostram o nome do usuário
+
+class PageCache:
+    """
+    Páginas renderizadas (corpo HTML) por chave, em LRU limitado a max_bytes.
+    Cada entrada guarda a versão da collection em que foi gerada e só vale
+    enquanto a versão for a mesma (ver InvoiceCollectionVersion) e por até
+    max_age segundos (cobre alterações feitas sem atualizar UpdatedAt).
+    """
+
+    def __init__(self, max_bytes, max_age=0):
+        self.max_bytes = max_bytes
+        self.max_age = max_age
+        self._entries = OrderedDict() # chave -> (versão, criada em, corpo)
+        self._size = 0
+        self._lock = threading.Lock()
+
+    def get(self, key, version):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry[0] != version:
+                return None
+            if self.max_age > 0 and time.monotonic() - entry[1] >= self.max_age:
+                del self._entries[key]
+                self._size -= len(entry[2])
+                return None
+            self._entries.move_to_end(key)
+            return entry[2]
+
+    def set(self, key, version, body):
+        if len(body) > self.max_bytes:
+            return
+        with self._lock:
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self._size -= len(old[2])
+            self._entries[key] = (version, time.monotonic(), body)
+            self._size += len(body)
+            while self._size > self.max_bytes:
+                _, (_, _, evicted) = self._entries.popitem(last=False)
+                self._size -= len(evicted)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._size = 0
+
+class InvoiceCollectionVersion:
+    """
+    Contador local que muda sempre que a collection de notas muda; invalida o
+    cache de páginas e o de contagens. As notas são gravadas pelo invoice_api
+    (outro processo), então a mudança é detectada de duas formas:
+    - change stream (replica set): uma thread acompanha inserções/alterações
+      e incrementa o contador na hora;
+    - sem change stream: a cada PAGE_CACHE_CHECK_INTERVAL segundos, no máximo,
+      compara o estado da collection com o último visto: estimated_document_count
+      (metadado, sem varredura) e o maior UpdatedAt (pelo índice). Todo
+      gravador atualiza UpdatedAt, então inserções, remoções e notas alteradas
+      no lugar (reparse_archive.py, migrate_access_key.py) mudam o estado.
+    O estado também serve de base para os ETags da lista na API: ao contrário
+    do contador, ele é o mesmo em todos os processos do lister.
+    """
+
+    def __init__(self, check_interval):
+        self.check_interval = check_interval
+        self.value = 0
+        self.streaming = False # True enquanto o change stream estiver ativo
+        self._last_state = None # (contagem, maior UpdatedAt)
+        self._state_ok = False
+        self._last_check = 0.0
+        self._lock = threading.Lock()
+
+    def bump(self):
+        with self._lock:
+            self.value += 1
+        invoice_counts.invalidate()
+        page_cache.clear()
+
+    def state(self):
+        """
+        (contagem, maior UpdatedAt) da collection, conferidos no máximo a cada
+        check_interval; None se a última verificação falhou.
+        """
+        if invoices_collection is None:
+            return None
+        now = time.monotonic()
+        if now - self._last_check < self.check_interval:
+            return self._last_state if self._state_ok else None
+        self._last_check = now
+        try:
+            count = invoices_collection.estimated_document_count()
+            latest = invoices_collection.find_one({}, {UPDATED_AT_FIELD: 1, '_id': 0},
+                                                  sort=[(UPDATED_AT_FIELD, DESCENDING)])
+        except PyMongoError as e:
+            print(f"Aviso: não foi possível verificar mudanças nas notas: {e}")
+            self._state_ok = False
+            return None
+        state = (count, (latest or {}).get(UPDATED_AT_FIELD))
+        if self._last_state is not None and state != self._last_state and not self.streaming:
+            self.bump()
+        self._last_state = state
+        self._state_ok = True
+        return state
+
+    def current(self):
+        """Versão atual (sem change stream, confere o estado da collection se o intervalo passou)."""
+        if not self.streaming:
+            self.state()
+        return self.value
+
+    def watch(self):
+        """Thread do change stream; sem replica set, desiste e fica a verificação periódica."""
+        while True:
+            try:
+                with invoices_collection.watch(max_await_time_ms=1000) as stream:
+                    self.streaming = True
+                    self.bump() # Mudanças enquanto o stream estava fora do ar não foram vistas
+                    for _ in stream:
+                        self.bump()
+            except OperationFailure as e:
+                self.streaming = False
+                if e.code == 40573: # Change stream só existe em replica set
+                    print("Change stream indisponível: verificando mudanças nas notas periodicamente (contagem e UpdatedAt).")
+                    return
+                print(f"Change stream das notas interrompido: {e}")
+            except PyMongoError as e:
+                self.streaming = False
+                print(f"Change stream das notas interrompido: {e}")
+            time.sleep(self.check_interval)
+
+    def start(self):
+        if PAGE_CACHE_CHANGE_STREAM and invoices_collection is not None:
+            threading.Thread(target=self.watch, name="invoice-change-stream", daemon=True).start()
+
+page_cache = PageCache(PAGE_CACHE_MAX_BYTES, PAGE_CACHE_MAX_AGE)
+invoice_version = InvoiceCollectionVersion(PAGE_CACHE_CHECK_INTERVAL)
+if PAGE_CACHE_MAX_BYTES > 0:
+    invoice_version.start()
+
+def cached_page(key_func):
+    """
+    Serve a página do cache enquanto a collection não mudar. A chave inclui a
+    rota, o usuário (o nome aparece na página) e os argumentos normalizados
+    por key_func. Só respostas 200 completas são guardadas; uma view pode
+    recusar o cache com g.skip_page_cache (ex.: página com erro).
+    """
+    def decorator(view):
+        @wraps(view)
+        def wrapper(*args, **kwargs):
+            if PAGE_CACHE_MAX_BYTES <= 0:
+                return view(*args, **kwargs)
+            version = invoice_version.current() # Antes de renderizar: mudanças durante a renderização invalidam
+            key = (request.endpoint, get_jwt_identity(), key_func(*args, **kwargs))
+            body = page_cache.get(key, version)
+            if body is not None:
+                return Response(body, mimetype='text/html')
+            response = make_response(view(*args, **kwargs))
+            if response.status_code == 200 and not response.is_streamed and not g.get('skip_page_cache'):
+                page_cache.set(key, version, response.get_data())
+            return response
+        return wrapper
+    return decorator
+
+def index_cache_key():
+    limit, sort_by_key, sort_order, filters, cursor = read_list_args(ALLOWED_LIMITS)
+    # Cursor inválido equivale a nenhum (primeira página)
+    return (limit, sort_by_key, sort_order, tuple(sorted(filters.items())),
+            request.args.get('cursor') if cursor else None)
+
+# --- Paginação por cursor (keyset) ---
+# Em vez de skip((page-1)*limit), cada página continua a partir do último (ou
+# primeiro) registro da página vizinha, comparando (campo de ordenação, _id).
+# Com o índice composto, a página 5000 custa o mesmo que a página 1.
+# O cursor vai na URL como um token opaco (JSON estendido em base64 url-safe).
+def encode_cursor(data):
+    raw = json_util.dumps(data, json_options=json_util.CANONICAL_JSON_OPTIONS).encode('utf-8')
+    return base64.urlsafe_b64encode(raw).decode('ascii').rstrip('=')
+
+# Tipos aceitos no valor de ordenação do cursor: data, nome do mercado e total
+CURSOR_VALUE_TYPES = (str, int, float, datetime, Decimal128)
+
+def is_cursor_int(value):
+    return isinstance(value, int) and not isinstance(value, bool)
+
+def valid_cursor(data):
+    """O token não é assinado: confere tipo e formato de cada campo antes de usá-lo na consulta."""
+    if not isinstance(data, dict) or data.get('d') not in ('after', 'before', 'last'):
+        return False
+    if any(field in data and not is_cursor_int(data[field]) for field in ('s', 'n', 'p', 'limit')):
+        return False
+    if not isinstance(data.get('f', {}), dict):
+        return False
+    if data['d'] == 'last':
+        return True
+    value = data.get('v', False) # Ausente conta como inválido (None é um valor válido)
+    return (isinstance(data.get('id'), ObjectId)
+            and (value is None or (isinstance(value, CURSOR_VALUE_TYPES) and not isinstance(value, bool))))
+
+def decode_cursor(token):
+    """Retorna o dicionário do cursor ou None se o token for inválido."""
+    try:
+        raw = base64.urlsafe_b64decode(token + '=' * (-len(token) % 4))
+        data = json_util.loads(raw.decode('utf-8'))
+    except (binascii.Error, UnicodeDecodeError, ValueError, TypeError, OverflowError, RecursionError,
+            BSONError, InvalidOperation):
+        return None
+    return data if valid_cursor(data) else None
+
+def keyset_filter(field, value, last_id, after):
+    """
+    Filtro dos documentos depois (after=True) ou antes de (value, last_id) na
+    ordem ascendente de (field, _id). Documentos sem o campo (null) ficam antes
+    de qualquer valor, como na ordenação do MongoDB.
+    """
+    op = '$gt' if after else '$lt'
+    if value is None:
+        if after: # Depois de um null: os outros nulls com _id maior e todos os valores
+            return {'$or': [{field: None, '_id': {op: last_id}}, {field: {'$ne': None}}]}
+        return {field: None, '_id': {op: last_id}}
+    branches = [{field: {op: value}}, {field: value, '_id': {op: last_id}}]
+    if not after:
+        branches.append({field: None})
+    return {'$or': branches}
+
+# --- Filtros da lista ---
+def normalize_market_name(value):
+    """Nome sem acentos, em maiúsculas e com espaços simples (igual ao normalize_market_name do invoice_api)."""
+    if not value:
+        return None
+    decomposed = unicodedata.normalize('NFKD', value)
+    name = ''.join(char for char in decomposed if not unicodedata.combining(char))
+    return ' '.join(name.upper().split()) or None
+
+def normalize_filter_args(args):
+    """
+    Filtros válidos da query string, já normalizados (valores inválidos ou
+    vazios são ignorados). O resultado vai nos links e nos cursores.
+    """
+    filters = {}
+    market = args.get('market', '').strip()
+    if normalize_market_name(market): filters['market'] = market # Normalizado só na consulta (build_invoice_filter)
+    for name in ('date_from', 'date_to'):
+        value = args.get(name, '').strip()
+        try:
+            if value: filters[name] = datetime.strptime(value, '%Y-%m-%d').strftime('%Y-%m-%d')
+        except ValueError:
+            pass
+    for name in ('total_min', 'total_max'):
+        value = args.get(name, '').strip().replace(',', '.')
+        try:
+            if value and Decimal(value).is_finite(): filters[name] = str(Decimal(value))
+        except InvalidOperation:
+            pass
+    for name in ('item', 'item_code'):
+        value = args.get(name, '').strip()
+        if value: filters[name] = value
+    return filters
+
+def build_invoice_filter(filters):
+    """
+    Consulta MongoDB dos filtros normalizados. Cada filtro tem um índice:
+      market     -> prefixo de MarketNameNormalized (índice MarketNameNormalized + InvoiceDate)
+      date_from/date_to -> intervalo de InvoiceDate (data final inclusiva)
+      total_min/total_max -> intervalo de TotalInvoice
+      item_code  -> código exato em Items.Code (índice multikey)
+      item       -> busca textual ($text) em Items.Description
+    """
+    query = {}
+    if 'market' in filters:
+        # Prefixo ancorado usa o índice; o campo e o filtro têm a mesma normalização
+        query[MARKET_SEARCH_FIELD] = {'$regex': '^' + re.escape(normalize_market_name(filters['market']))}
+    if 'date_from' in filters or 'date_to' in filters:
+        query['InvoiceDate'] = {}
+        if 'date_from' in filters:
+            query['InvoiceDate']['$gte'] = datetime.strptime(filters['date_from'], '%Y-%m-%d')
+        if 'date_to' in filters:
+            query['InvoiceDate']['$lt'] = datetime.strptime(filters['date_to'], '%Y-%m-%d') + timedelta(days=1)
+    if 'total_min' in filters or 'total_max' in filters:
+        query['TotalInvoice'] = {}
+        if 'total_min' in filters: query['TotalInvoice']['$gte'] = Decimal128(filters['total_min'])
+        if 'total_max' in filters: query['TotalInvoice']['$lte'] = Decimal128(filters['total_max'])
+    if 'item_code' in filters:
+        query['Items.Code'] = filters['item_code']
+    if 'item' in filters:
+        query['$text'] = {'$search': filters['item']}
+    return query
+
+def keyset_find(sort_field, ascending, limit, cursor, projection=None, base_filter=None):
+    """
+    Monta (sem executar) a consulta de uma página: retorna (cursor do pymongo,
+    tamanho da página, leitura no sentido inverso). Separada da execução para
+    o check_query_plans.py conferir o plano exatamente desta consulta.
+    """
+    direction = cursor.get('d') if cursor else None
+    backwards = direction in ('before', 'last') # Lê no sentido inverso e inverte o resultado
+    query_ascending = ascending != backwards
+    mongo_direction = ASCENDING if query_ascending else DESCENDING
+    query_filter = dict(base_filter or {})
+    if direction in ('after', 'before'):
+        keyset = keyset_filter(sort_field, cursor['v'], cursor['id'], after=query_ascending)
+        query_filter = {'$and': [query_filter, keyset]} if query_filter else keyset
+    # O token não é assinado: salto e tamanho vêm limitados para não reabrir o custo do skip
+    skip_count = min(max(cursor.get('s', 0), 0), PAGE_WINDOW) * limit if direction in ('after', 'before') else 0
+    page_size = min(max(cursor.get('n', limit), 1), limit) if direction == 'last' else limit
+    query = (invoices_collection.find(query_filter, projection)
+             .sort([(sort_field, mongo_direction), ('_id', mongo_direction)])
+             .skip(skip_count).limit(page_size + 1))
+    return query, page_size, backwards
+
+def fetch_keyset_page(sort_field, ascending, limit, cursor, projection=None, base_filter=None):
+    """
+    Busca uma página a partir do cursor. Tipos de cursor:
+      None                  -> primeira página
+      {'d': 'after', ...}   -> registros depois de (v, id), pulando 's' páginas inteiras
+      {'d': 'before', ...}  -> registros antes de (v, id), pulando 's' páginas inteiras
+      {'d': 'last', 'n': n} -> os n últimos registros
+    O salto 's' só é usado para os números de página vizinhos (limitado por
+    PAGE_WINDOW), então o custo não depende da profundidade.
+    Retorna (documentos na ordem de exibição, há mais registros depois, há mais antes).
+    """
+    direction = cursor.get('d') if cursor else None
+    query, page_size, backwards = keyset_find(sort_field, ascending, limit, cursor, projection, base_filter)
+    rows = list(query)
+    has_more = len(rows) > page_size # O registro extra só indica se há mais no sentido da leitura
+    rows = rows[:page_size]
+    if backwards:
+        rows.reverse()
+        return rows, direction == 'before', has_more
+    return rows, has_more, direction == 'after'
+
+def read_list_args(allowed_limits):
+    """
+    Lê limit, sort_by, sort_order, filtros e cursor da query string (valores
+    inválidos voltam ao padrão). O cursor só vale para a mesma ordenação,
+    limite e filtros; senão, None (primeira página).
+    """
+    limit = request.args.get('limit', DEFAULT_LIMIT, type=int)
+    if limit not in allowed_limits: limit = DEFAULT_LIMIT
+    sort_by_key = request.args.get('sort_by', DEFAULT_SORT_BY).lower()
+    sort_order = request.args.get('sort_order', DEFAULT_SORT_ORDER).lower()
+    if sort_by_key not in ALLOWED_SORT_COLUMNS: sort_by_key = DEFAULT_SORT_BY
+    if sort_order not in ['asc', 'desc']: sort_order = DEFAULT_SORT_ORDER
+    filters = normalize_filter_args(request.args)
+    cursor = decode_cursor(request.args.get('cursor', ''))
+    if cursor and (cursor.get('sort_by') != sort_by_key or cursor.get('sort_order') != sort_order
+                   or cursor.get('limit') != limit or cursor.get('f', {}) != filters):
+        cursor = None
+    return limit, sort_by_key, sort_order, filters, cursor
 
 # --- Funções de Carregamento de Usuário para JWT ---
 # Define qual informação do seu objeto usuário será usada como 'identity' no token
@@ -98,11 +637,9 @@ def user_identity_lookup(user):
 @jwt.user_lookup_loader
 def user_lookup_callback(_jwt_header, jwt_data):
     identity = jwt_data["sub"]
-    if users_collection is not None: # <-- CORREÇÃO: Verifica explicitamente contra None
-         # Retorna o objeto usuário (ou None se não encontrado)
-        return users_collection.find_one({"_id": ObjectId(identity)})
-    # Se users_collection for None (erro de conexão inicial), retorna None
-    return None
+    # Retorna o objeto usuário (ou None se não encontrado ou sem conexão), sem ir ao
+    # MongoDB a cada requisição enquanto estiver no cache
+    return load_user(identity)
 
 # --- Rotas de Autenticação ---
 
@@ -164,7 +701,7 @@ def api_refresh():
     current_user_identity = get_jwt_identity() # Pega a identidade do refresh token
     # Cria um *novo* access token. A identidade pode ser str ou objeto dependendo do loader
     # Se user_identity_loader retorna str(id), buscamos o user para passar ao create_access_token
-    user_object = users_collection.find_one({"_id": ObjectId(current_user_identity)})
+    user_object = load_user(current_user_identity)
     if not user_object:
          return jsonify({"msg": "Usuário não encontrado para refresh"}), 404
          
@@ -177,6 +714,7 @@ def api_refresh():
 
 @app.route('/')
 @jwt_required() # Protege a rota, requer um Access Token válido (via cookie)
+@cached_page(index_cache_key)
 def index():
     # --- Obter o usuário atual ---
     current_user = get_current_user() # Pega o objeto do usuário carregado pelo user_lookup_loader
@@ -188,43 +726,50 @@ def index():
     pagination = {
         "page": 1, "total_pages": 0, "has_prev": False, "has_next": False,
         "total_items": 0, "page_numbers": [], "sort_by": DEFAULT_SORT_BY,
-        "sort_order": DEFAULT_SORT_ORDER, "limit": DEFAULT_LIMIT
+        "sort_order": DEFAULT_SORT_ORDER, "limit": DEFAULT_LIMIT, "cursors": {"pages": {}}, "filters": {}
     }
     if invoices_collection is not None:
         try:
-            page = request.args.get('page', 1, type=int)
-            if page < 1: page = 1
-            pagination['page'] = page
-            limit = request.args.get('limit', DEFAULT_LIMIT, type=int)
-            if limit not in ALLOWED_LIMITS: limit = DEFAULT_LIMIT
+            # Cursor da URL; inválido ou de outra ordenação/limite -> primeira página
+            limit, sort_by_key, sort_order, filters, cursor = read_list_args(ALLOWED_LIMITS)
+            pagination['filters'] = filters
+            query_filter = build_invoice_filter(filters)
             pagination['limit'] = limit
-            items_per_page = limit if limit > 0 else float('inf')
-            sort_by_key = request.args.get('sort_by', DEFAULT_SORT_BY).lower()
-            sort_order = request.args.get('sort_order', DEFAULT_SORT_ORDER).lower()
-            if sort_by_key not in ALLOWED_SORT_COLUMNS: sort_by_key = DEFAULT_SORT_BY
             pagination['sort_by'] = sort_by_key
-            mongo_sort_field = ALLOWED_SORT_COLUMNS[sort_by_key]
-            if sort_order not in ['asc', 'desc']: sort_order = DEFAULT_SORT_ORDER
             pagination['sort_order'] = sort_order
+            mongo_sort_field = ALLOWED_SORT_COLUMNS[sort_by_key]
             mongo_sort_direction = ASCENDING if sort_order == 'asc' else DESCENDING
-            total_invoices = invoices_collection.count_documents({})
+            total_invoices = invoice_counts.count(invoices_collection, query_filter)
             pagination['total_items'] = total_invoices
-            if total_invoices > 0:
-                skip_count = (page - 1) * limit if limit > 0 else 0
-                if limit > 0: total_pages = math.ceil(total_invoices / limit)
-                else: total_pages = 1
+            if total_invoices > 0 and limit == 0:
+                pagination['total_pages'] = 1
+                query = (invoices_collection.find(query_filter, SUMMARY_PROJECTION)
+                         .sort([(mongo_sort_field, mongo_sort_direction), ('_id', mongo_sort_direction)])
+                         .batch_size(STREAM_BATCH_SIZE))
+                # Sem list(): as linhas são lidas e renderizadas durante o envio da resposta
+                return render_template_streamed('index.html', invoices=stream_template_values(query),
+                                                pagination=pagination, error=None, username=username)
+            elif total_invoices > 0:
+                total_pages = math.ceil(total_invoices / limit)
                 pagination['total_pages'] = total_pages
-                if page > total_pages:
-                    page = total_pages
-                    skip_count = (page - 1) * limit if limit > 0 else 0
-                    pagination['page'] = page
-                query = invoices_collection.find().sort([(mongo_sort_field, mongo_sort_direction)])
-                if limit > 0: query = query.skip(skip_count).limit(limit)
-                cursor = query
-                raw_invoices = list(cursor)
-                invoice_list = parse_json(raw_invoices)
-                pagination['has_prev'] = page > 1
-                pagination['has_next'] = page < total_pages
+                ascending = sort_order == 'asc'
+                rows, has_next, has_prev = fetch_keyset_page(mongo_sort_field, ascending, limit, cursor, SUMMARY_PROJECTION,
+                                                             query_filter)
+                if not rows and cursor: # Cursor aponta para além do fim (notas removidas): volta ao início
+                    cursor = None
+                    rows, has_next, has_prev = fetch_keyset_page(mongo_sort_field, ascending, limit, None, SUMMARY_PROJECTION,
+                                                                 query_filter)
+                if cursor is None: page = 1
+                elif cursor['d'] == 'last': page = total_pages
+                else: page = cursor.get('p', 1)
+                # O número da página vem do token; se a collection mudou, mantém-no coerente com as bordas
+                if not has_prev: page = 1
+                elif not has_next: page = total_pages
+                page = max(1, min(page, total_pages))
+                pagination['page'] = page
+                invoice_list = [to_template_value(row) for row in rows]
+                pagination['has_prev'] = has_prev
+                pagination['has_next'] = has_next
                 if total_pages > 1:
                     start_page = max(1, page - PAGE_WINDOW)
                     end_page = min(total_pages, page + PAGE_WINDOW)
@@ -232,11 +777,31 @@ def index():
                     if page + PAGE_WINDOW > total_pages: start_page = max(1, start_page - (PAGE_WINDOW - (total_pages - page)))
                     pagination['page_numbers'] = list(range(start_page, end_page + 1))
                 else: pagination['page_numbers'] = []
+                # Tokens dos links: vizinhos partem das bordas desta página (salto limitado por PAGE_WINDOW)
+                context = {'sort_by': sort_by_key, 'sort_order': sort_order, 'limit': limit, 'f': filters}
+                last_cursor = encode_cursor(dict(context, d='last', n=total_invoices - (total_pages - 1) * limit))
+                def cursor_for(target):
+                    if target <= 1: return None
+                    if target >= total_pages: return last_cursor
+                    if target == page: return request.args.get('cursor') if cursor else None
+                    anchor = rows[-1] if target > page else rows[0]
+                    return encode_cursor(dict(context, d='after' if target > page else 'before',
+                                              v=anchor.get(mongo_sort_field), id=anchor['_id'],
+                                              s=abs(target - page) - 1, p=target))
+                pagination['cursors'] = {
+                    'first': None, 'last': last_cursor,
+                    'prev': cursor_for(page - 1) if has_prev else None,
+                    'next': cursor_for(page + 1) if has_next else None,
+                    'pages': {p: cursor_for(p) for p in pagination['page_numbers']},
+                }
             else: pagination['total_pages'] = 0
         except Exception as e:
             error_message = f"Erro ao buscar dados do MongoDB: {e}"
             print(error_message)
-    else: error_message = "Não foi possível conectar ao banco de dados MongoDB."
+            g.skip_page_cache = True
+    else:
+        error_message = "Não foi possível conectar ao banco de dados MongoDB."
+        g.skip_page_cache = True
     # Passa a informação se o usuário está logado (verificado pelo @jwt_required)
     # Ou obtem dados do usuário se necessário: current_user = get_current_user()
     return render_template('index.html', invoices=invoice_list, pagination=pagination, error=error_message, username=username)
@@ -244,6 +809,7 @@ def index():
 
 @app.route('/invoice/<invoice_id>')
 @jwt_required() # Protege a rota
+@cached_page(lambda invoice_id: invoice_id)
 def view_invoice(invoice_id):
     # ... (código da rota view_invoice existente) ...
     # --- Obter o usuário atual ---
@@ -256,7 +822,7 @@ def view_invoice(invoice_id):
         try:
             obj_id = ObjectId(invoice_id)
             raw_invoice = invoices_collection.find_one({"_id": obj_id})
-            if raw_invoice: invoice_data = parse_json(raw_invoice)
+            if raw_invoice: invoice_data = to_template_value(raw_invoice)
             else: abort(404, description="Invoice não encontrada")
         except Exception as e:
             error_message = f"Erro ao buscar detalhes da invoice: {e}"
@@ -267,17 +833,127 @@ def view_invoice(invoice_id):
         abort(503, description="Serviço indisponível (DB Connection Error)")
     return render_template('details.html', invoice=invoice_data, error=error_message, username=username)
 
+# --- API JSON (somente leitura) ---
+# Respostas compactas com ETag forte, derivado de versões e não do corpo, para
+# responder 304 antes de buscar e serializar as notas:
+# - nota: _id + UpdatedAt (todo gravador atualiza o campo), lidos com projeção
+#   mínima pelo índice do _id;
+# - lista: estado da collection (InvoiceCollectionVersion.state: contagem e
+#   maior UpdatedAt) + argumentos da consulta. Sem change stream o estado é
+#   conferido a cada PAGE_CACHE_CHECK_INTERVAL segundos, então uma mudança
+#   pode levar esse tempo para gerar um ETag novo.
+# Um cliente que repete a consulta sem mudanças recebe 304 quase sem custo.
+def api_etag(*parts):
+    """ETag a partir dos valores que determinam o corpo da resposta."""
+    raw = json_util.dumps([API_FORMAT_VERSION, *parts], json_options=json_util.CANONICAL_JSON_OPTIONS)
+    return hashlib.sha256(raw.encode('utf-8')).hexdigest()[:32]
+
+def gzip_etag(etag):
+    # A versão comprimida é outra representação: ETag forte próprio
+    return f"{etag}-gzip"
+
+def api_not_modified(etag):
+    """Resposta 304 se o If-None-Match tiver este ETag (comprimido ou não); senão None."""
+    for tag in (etag, gzip_etag(etag)):
+        if request.if_none_match.contains(tag):
+            response = Response(status=304)
+            response.set_etag(tag)
+            response.headers['Cache-Control'] = 'private, no-cache'
+            response.vary.add('Accept-Encoding')
+            return response
+    return None
+
+def api_json_response(data, etag):
+    """JSON compacto; comprimido com gzip se o cliente aceitar e o corpo for grande."""
+    body = json.dumps(data, ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+    response = Response(body, mimetype='application/json')
+    if len(body) >= API_GZIP_MIN_SIZE and 'gzip' in request.accept_encodings:
+        response.set_data(gzip.compress(body, compresslevel=API_GZIP_LEVEL))
+        response.headers['Content-Encoding'] = 'gzip'
+        etag = gzip_etag(etag)
+    response.set_etag(etag)
+    response.headers['Cache-Control'] = 'private, no-cache' # Sempre revalidar com If-None-Match
+    response.vary.add('Accept-Encoding')
+    return response
+
+@app.route('/api/invoices')
+@jwt_required()
+def api_list_invoices():
+    """Lista paginada (resumo das notas), com os mesmos parâmetros da página inicial e cursores next/prev."""
+    if invoices_collection is None:
+        return jsonify({"msg": "Serviço indisponível (DB Connection Error)"}), 503
+    limit, sort_by_key, sort_order, filters, cursor = read_list_args(API_ALLOWED_LIMITS)
+    collection_state = invoice_version.state()
+    etag = None
+    if collection_state is not None: # Sem o estado (falha na verificação), o ETag sai do corpo
+        etag = api_etag('list', collection_state, sort_by_key, sort_order, limit, filters,
+                        request.args.get('cursor') if cursor else None)
+        response = api_not_modified(etag)
+        if response is not None:
+            return response
+    mongo_sort_field = ALLOWED_SORT_COLUMNS[sort_by_key]
+    query_filter = build_invoice_filter(filters)
+    try:
+        total_invoices = invoice_counts.count(invoices_collection, query_filter)
+        rows, has_next, has_prev = fetch_keyset_page(mongo_sort_field, sort_order == 'asc', limit, cursor,
+                                                     SUMMARY_PROJECTION, query_filter)
+    except Exception as e:
+        print(f"Erro ao buscar dados do MongoDB: {e}")
+        return jsonify({"msg": "Erro ao buscar as notas"}), 500
+    context = {'sort_by': sort_by_key, 'sort_order': sort_order, 'limit': limit, 'f': filters}
+    data = {
+        "items": [to_api_value(row) for row in rows],
+        "total": total_invoices, "limit": limit, "sort_by": sort_by_key, "sort_order": sort_order, "filters": filters,
+        "next": encode_cursor(dict(context, d='after', v=rows[-1].get(mongo_sort_field), id=rows[-1]['_id']))
+                if has_next else None,
+        "prev": encode_cursor(dict(context, d='before', v=rows[0].get(mongo_sort_field), id=rows[0]['_id']))
+                if has_prev else None,
+    }
+    return api_json_response(data, etag or api_etag(data))
+
+def invoice_etag(document):
+    return api_etag('invoice', document['_id'], document.get(UPDATED_AT_FIELD))
+
+@app.route('/api/invoices/<invoice_id>')
+@jwt_required()
+def api_get_invoice(invoice_id):
+    """Nota completa, com os itens."""
+    if invoices_collection is None:
+        return jsonify({"msg": "Serviço indisponível (DB Connection Error)"}), 503
+    if not ObjectId.is_valid(invoice_id):
+        return jsonify({"msg": f"ID inválido: {invoice_id}"}), 404
+    obj_id = ObjectId(invoice_id)
+    try:
+        # Revalidação: só _id e UpdatedAt, sem ler a nota inteira
+        if request.if_none_match:
+            version = invoices_collection.find_one({'_id': obj_id}, {UPDATED_AT_FIELD: 1})
+            if version is not None:
+                response = api_not_modified(invoice_etag(version))
+                if response is not None:
+                    return response
+        invoice = invoices_collection.find_one({'_id': obj_id})
+    except Exception as e:
+        print(f"Erro ao buscar detalhes da invoice: {e}")
+        return jsonify({"msg": "Erro ao buscar a nota"}), 500
+    if invoice is None:
+        return jsonify({"msg": "Invoice não encontrada"}), 404
+    return api_json_response(to_api_value(invoice), invoice_etag(invoice))
+
 # --- Error Handlers ---
 # Custom error handler para redirecionar para login em caso de 401 (não autorizado)
 # Flask-JWT-Extended faz isso automaticamente se `login_url` for configurado,
 # ou podemos customizar
 @jwt.unauthorized_loader
 def unauthorized_callback(reason):
+    if request.path.startswith('/api/invoices'): # Clientes da API JSON recebem 401, não o redirecionamento
+        return jsonify({"msg": "Acesso não autorizado"}), 401
     flash('Acesso não autorizado. Por favor, faça login.', 'warning')
     return redirect(url_for('login_page', next=request.url))
 
 @jwt.invalid_token_loader
 def invalid_token_callback(reason):
+    if request.path.startswith('/api/invoices'):
+        return jsonify({"msg": "Token inválido"}), 401
     flash('Token inválido ou expirado. Por favor, faça login novamente.', 'warning')
     response = make_response(redirect(url_for('login_page')))
     unset_jwt_cookies(response) # Limpa cookies inválidos
@@ -287,6 +963,8 @@ def invalid_token_callback(reason):
 def expired_token_callback(jwt_header, jwt_payload):
      # Se o token expirado for um access token, podemos tentar usar o refresh token
      # Mas para simplificar a UI, vamos apenas redirecionar para login
+    if request.path.startswith('/api/invoices'):
+        return jsonify({"msg": "Token expirado"}), 401
     flash('Sua sessão expirou. Por favor, faça login novamente.', 'warning')
     response = make_response(redirect(url_for('login_page', next=request.url)))
     unset_jwt_cookies(response) # Limpa cookies expirados
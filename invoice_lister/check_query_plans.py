@@ -0,0 +1,162 @@
+"""
+Confere, com explain() no MongoDB, que nenhuma consulta da lista de notas
+cai em varredura da collection (COLLSCAN).
+
+Autossuficiente: cria uma collection temporária no banco do app, com os
+mesmos índices que o app cria (ordenação, filtros e UpdatedAt) e algumas
+notas sintéticas, e a remove ao terminar. Os dados reais não são usados.
+
+Monta as mesmas consultas que a página inicial e a API fazem (keyset_find e
+build_invoice_filter do app.py) para todas as combinações de filtros (mercado,
+intervalo de datas, intervalo de total, produto e código do item), as três
+colunas de ordenação, os dois sentidos e tanto a primeira página quanto uma
+página a partir de um cursor. As contagens (count_documents) com os mesmos
+filtros também são conferidas.
+
+Sai com código 0 se todas as consultas usam índice e 1 se alguma varre a
+collection (ou se o MongoDB não responder): é a verificação obrigatória antes
+de mudar consultas, filtros ou índices da lista.
+
+Uso (dentro do diretório invoice_lister, com MONGO_URI no .env ou no ambiente):
+    python check_query_plans.py
+    python check_query_plans.py --verbose     # mostra o plano de cada consulta
+"""
+import argparse
+import itertools
+import os
+import random
+import sys
+from datetime import datetime, timedelta
+
+from bson.decimal128 import Decimal128
+from bson.objectid import ObjectId
+
+# O app exige as chaves secretas ao ser importado; aqui elas não são usadas
+os.environ.setdefault('FLASK_SECRET_KEY', 'check-query-plans')
+os.environ.setdefault('JWT_SECRET_KEY', 'check-query-plans')
+os.environ.setdefault('PAGE_CACHE_CHANGE_STREAM', '0') # Sem a thread do change stream na collection real
+
+import app as lister
+
+FILTER_GROUPS = ('market', 'dates', 'totals', 'item', 'item_code')
+# Valores dos filtros; as notas sintéticas são geradas para que todos encontrem resultados
+SAMPLE_FILTERS = {
+    'market': {'market': 'super'},
+    'dates': {'date_from': '2025-03-01', 'date_to': '2025-03-31'},
+    'totals': {'total_min': '10', 'total_max': '100'},
+    'item': {'item': 'arroz'},
+    'item_code': {'item_code': '7891000'},
+}
+MARKET_NAMES = ('Supermercado Bom Preço', 'SUPERMERCADO CENTRAL', 'Padaria São Jorge', 'Drogaria Saúde')
+ITEM_DESCRIPTIONS = ('ARROZ TIPO 1 5KG', 'Feijão carioca', 'LEITE INTEGRAL 1L', 'Café torrado 500g')
+
+
+def seed_documents(count, rng):
+    """Notas no formato gravado pelo invoice_api (inclusive MarketNameNormalized e UpdatedAt)."""
+    documents = []
+    for _ in range(count):
+        market = rng.choice(MARKET_NAMES)
+        items = [{'Code': str(rng.choice([7891000, rng.randint(1, 99999)])), 'Description': rng.choice(ITEM_DESCRIPTIONS),
+                  'Quantity': Decimal128('1.0000'), 'Unit': 'UN', 'Value': Decimal128(f"{rng.randint(100, 5000) / 100:.2f}")}
+                 for _ in range(rng.randint(1, 5))]
+        documents.append({
+            'MarketName': market,
+            'MarketNameNormalized': lister.normalize_market_name(market),
+            'InvoiceDate': datetime(2025, 1, 1) + timedelta(minutes=rng.randint(0, 365 * 24 * 60)),
+            'TotalInvoice': Decimal128(f"{rng.randint(100, 50000) / 100:.2f}"),
+            'QuantityTotalItems': len(items),
+            'Items': items,
+            'UpdatedAt': datetime(2025, 12, 31),
+        })
+    return documents
+
+
+def create_app_indexes(collection):
+    """Os mesmos índices que o app cria na collection de notas ao iniciar."""
+    for index_keys, index_options in ([(keys, {}) for keys in lister.SORT_INDEXES] + lister.FILTER_INDEXES
+                                      + lister.VERSION_INDEXES):
+        collection.create_index(index_keys, **index_options)
+
+
+def plan_stages(plan):
+    """Todas as etapas ('stage') do plano, em qualquer formato de explain (clássico ou SBE)."""
+    if isinstance(plan, dict):
+        if 'stage' in plan:
+            yield plan['stage']
+        for value in plan.values():
+            yield from plan_stages(value)
+    elif isinstance(plan, list):
+        for value in plan:
+            yield from plan_stages(value)
+
+
+def winning_plan(explain):
+    return explain.get('queryPlanner', {}).get('winningPlan', {})
+
+
+def check_plans(collection, limit, verbose):
+    """Confere todas as consultas na collection; retorna (consultas conferidas, nomes com COLLSCAN)."""
+    # Valor de cada coluna de ordenação para os cursores (o plano não depende de o _id existir)
+    anchor_values = {field: (collection.find_one({field: {'$ne': None}}, {field: 1}) or {}).get(field)
+                     for field in lister.ALLOWED_SORT_COLUMNS.values()}
+    checked = 0
+    failures = []
+    for size in range(len(FILTER_GROUPS) + 1):
+        for groups in itertools.combinations(FILTER_GROUPS, size):
+            filters = {}
+            for group in groups:
+                filters.update(SAMPLE_FILTERS[group])
+            query_filter = lister.build_invoice_filter(lister.normalize_filter_args(filters))
+            label = '+'.join(groups) or 'sem filtros'
+
+            explain = lister.db.command({'explain': {'count': collection.name, 'query': query_filter},
+                                         'verbosity': 'queryPlanner'})
+            checks = [(f"{label} | contagem", explain)]
+            for sort_by_key, sort_field in lister.ALLOWED_SORT_COLUMNS.items():
+                for sort_order in ('asc', 'desc'):
+                    anchor = {'d': 'after', 'v': anchor_values[sort_field], 'id': ObjectId(), 's': 0}
+                    for page, cursor in (('primeira página', None), ('cursor', anchor)):
+                        query, _, _ = lister.keyset_find(sort_field, sort_order == 'asc', limit, cursor,
+                                                         lister.SUMMARY_PROJECTION, query_filter)
+                        checks.append((f"{label} | {sort_by_key} {sort_order} | {page}", query.explain()))
+
+            for name, explain in checks:
+                checked += 1
+                stages = list(plan_stages(winning_plan(explain)))
+                if 'COLLSCAN' in stages:
+                    failures.append(name)
+                    print(f"COLLSCAN: {name}: {' > '.join(stages)}")
+                elif verbose:
+                    print(f"ok: {name}: {' > '.join(stages)}")
+    return checked, failures
+
+
+def main():
+    arg_parser = argparse.ArgumentParser(description="Confere que as consultas da lista de notas usam índices.")
+    arg_parser.add_argument('--limit', type=int, default=lister.DEFAULT_LIMIT, help="Notas por página")
+    arg_parser.add_argument('--documents', type=int, default=500, help="Notas sintéticas na collection temporária")
+    arg_parser.add_argument('--seed', type=int, default=2025, help="Semente das notas sintéticas")
+    arg_parser.add_argument('--verbose', action='store_true', help="Mostra as etapas do plano de cada consulta")
+    args = arg_parser.parse_args()
+
+    if lister.db is None:
+        print("MongoDB indisponível: verifique MONGO_URI.")
+        return 1
+
+    collection = lister.db[f"{lister.COLLECTION_NAME}_plan_check_{ObjectId()}"]
+    app_collection = lister.invoices_collection
+    try:
+        create_app_indexes(collection)
+        collection.insert_many(seed_documents(args.documents, random.Random(args.seed)))
+        lister.invoices_collection = collection # keyset_find consulta a collection global do app
+        checked, failures = check_plans(collection, args.limit, args.verbose)
+    finally:
+        lister.invoices_collection = app_collection
+        collection.drop()
+
+    print(f"{checked} consultas conferidas, {len(failures)} com varredura da collection.")
+    return 1 if failures else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())